@@ -1,8 +1,6 @@
-from langchain.agents import initialize_agent, AgentType, Tool
-from langchain_openai import ChatOpenAI
-from tools.pandasai_tool import PandasAITool
 from utils.file_manager import list_excel_files, get_excel_files_metadata
 import os
+import threading
 
 # --- Prompt de sistema personalizado para Aria ---
 system_prompt = (
@@ -13,15 +11,6 @@ system_prompt = (
     "- Siempre responde de manera profesional y clara, presentándote como Aria."
 )
 
-# --- Subtarea 4.1: Inicialización explícita del modelo GPT-4o ---
-# Usa la API key de OpenAI y el modelo GPT-4o
-llm = ChatOpenAI(
-    openai_api_key=os.getenv("OPENAI_API_KEY"),
-    model="gpt-4o",
-    temperature=float(os.getenv("CHAT_TEMPERATURE", 0.0)),
-    streaming=True,
-)
-
 # --- Herramientas para el agente ---
 def tool_list_excels(_):
     files = list_excel_files()
@@ -38,30 +27,63 @@ def tool_metadata_excels(_):
         return msg
     return "No se encontró metadata de archivos Excel en la carpeta /data."
 
-# Registrar herramientas con nombres válidos para OpenAI
-herramientas = [
-    Tool(
-        name="listar_archivos_excel",
-        func=tool_list_excels,
-        description="Lista todos los archivos Excel disponibles en la carpeta /data."
-    ),
-    Tool(
-        name="metadata_archivos_excel",
-        func=tool_metadata_excels,
-        description="Devuelve la metadata de los archivos Excel en la carpeta /data."
-    ),
-    PandasAITool(),
-]
+_agent = None
+_agent_lock = threading.Lock()
 
-# --- Inicialización del agente con AgentType.OPENAI_FUNCTIONS ---
-agent = initialize_agent(
-    tools=herramientas,
-    llm=llm,
-    agent=AgentType.OPENAI_FUNCTIONS,
-    verbose=True,
-    system_message=system_prompt,
-    handle_parsing_errors=True,
-)
+def get_agent():
+    """
+    Construye el agente en el primer uso: langchain, pandasai y el modelo no se cargan
+    al importar este módulo.
+    """
+    global _agent
+    if _agent is not None:
+        return _agent
+    with _agent_lock:
+        if _agent is not None:
+            return _agent
+        from langchain.agents import initialize_agent, AgentType, Tool
+        from langchain_openai import ChatOpenAI
+        from tools.pandasai_tool import PandasAITool
+        from utils.llm_scheduler import scheduled_async_http_client, scheduled_http_client
+
+        # --- Subtarea 4.1: Inicialización explícita del modelo GPT-4o ---
+        # Usa la API key de OpenAI y el modelo GPT-4o
+        llm = ChatOpenAI(
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            model="gpt-4o",
+            temperature=float(os.getenv("CHAT_TEMPERATURE", 0.0)),
+            streaming=True,
+            # Clientes HTTP compartidos: las peticiones pasan por el planificador, que también reintenta
+            http_client=scheduled_http_client(),
+            http_async_client=scheduled_async_http_client(),
+            max_retries=0,
+        )
+
+        # Registrar herramientas con nombres válidos para OpenAI
+        herramientas = [
+            Tool(
+                name="listar_archivos_excel",
+                func=tool_list_excels,
+                description="Lista todos los archivos Excel disponibles en la carpeta /data."
+            ),
+            Tool(
+                name="metadata_archivos_excel",
+                func=tool_metadata_excels,
+                description="Devuelve la metadata de los archivos Excel en la carpeta /data."
+            ),
+            PandasAITool(),
+        ]
+
+        # --- Inicialización del agente con AgentType.OPENAI_FUNCTIONS ---
+        _agent = initialize_agent(
+            tools=herramientas,
+            llm=llm,
+            agent=AgentType.OPENAI_FUNCTIONS,
+            verbose=True,
+            system_message=system_prompt,
+            handle_parsing_errors=True,
+        )
+    return _agent
 
 def ask_excel_agent(file_name: str, instruction: str) -> str:
     """
@@ -69,7 +91,7 @@ def ask_excel_agent(file_name: str, instruction: str) -> str:
     """
     try:
         query = f"{file_name}: {instruction}"
-        result = agent.run(query)
+        result = get_agent().run(query)
         return str(result)
     except Exception as e:
         return f"[Error agente] {e}"
@@ -79,7 +101,7 @@ def ask_aria_agent(message: str) -> str:
     Envía cualquier mensaje al agente Aria y devuelve la respuesta.
     """
     try:
-        result = agent.run(message)
+        result = get_agent().run(message)
         return str(result)
     except Exception as e:
         return f"[Error agente] {e}" 
\ No newline at end of file
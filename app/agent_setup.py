@@ -1,69 +1,233 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
 from typing import Optional, List, Dict, Any, Union
 # Import correcto del paquete agents
 from agents import Agent, function_tool
-from tools.pandasai_tool import PandasAITool
-from tools.guardar_excel_tool import AnalizarYGuardarExcelTool
+from utils.async_executor import run_tool_async
 from utils.file_manager import list_excel_files, get_excel_files_metadata
 
+# Las herramientas, perfiles y resultados arrastran pandas, pandasai y langchain: se importan
+# dentro de cada herramienta, en su primer uso, para no retrasar el arranque de Chainlit.
+
 # --- Función de herramienta para listar archivos Excel ---
+LISTADO_POR_PAGINA = 200
+
 @function_tool
-def listar_archivos_excel() -> str:
-    """Lista todos los archivos Excel disponibles en la carpeta /data."""
-    files = list_excel_files()
+def listar_archivos_excel(patron: Optional[str] = None, pagina: int = 1) -> str:
+    """
+    Lista los archivos Excel disponibles en la carpeta /data.
+
+    Args:
+        patron: Patrón glob opcional para filtrar por nombre (ej. 'ventas_*.xlsx')
+        pagina: Página de resultados (200 archivos por página)
+    """
+    pagina = max(pagina, 1)
+    total = len(list_excel_files(pattern=patron))
+    files = list_excel_files(pattern=patron, offset=(pagina - 1) * LISTADO_POR_PAGINA, limit=LISTADO_POR_PAGINA)
     if files:
-        return "Archivos Excel disponibles: " + ", ".join(files)
+        # Un listado corto (p. ej. filtrado) casi siempre precede a un análisis de esos archivos
+        from utils.prefetch import prefetch_listing
+        prefetch_listing(files)
+        msg = "Archivos Excel disponibles: " + ", ".join(files)
+        if total > LISTADO_POR_PAGINA:
+            paginas = (total + LISTADO_POR_PAGINA - 1) // LISTADO_POR_PAGINA
+            msg += f"\n(Página {pagina} de {paginas}; {total} archivos en total)"
+        return msg
     return "No se encontraron archivos Excel en la carpeta /data."
 
 # --- Función de herramienta para mostrar metadata de archivos Excel ---
 @function_tool
-def metadata_archivos_excel() -> str:
+async def metadata_archivos_excel() -> str:
     """Devuelve la metadata de los archivos Excel en la carpeta /data."""
+    # Lee perfiles y catálogos de todos los archivos: corre en el pool para no bloquear el event loop
+    return await run_tool_async("metadata_archivos_excel", _metadata_archivos)
+
+def _metadata_archivos() -> str:
     metadata = get_excel_files_metadata()
     if metadata:
+        from utils.profile_index import get_profile, refresh_profiles_async
+        from utils.sheet_catalog import format_catalog, read_sheet_catalog
+        paths = [os.path.join("data", m["nombre"]) for m in metadata]
+        # Los perfiles que falten se calculan en segundo plano para las siguientes consultas
+        refresh_profiles_async(paths)
+        from utils.prefetch import prefetch_listing
+        prefetch_listing([m["nombre"] for m in metadata])
         msg = "Metadata de archivos Excel:\n"
-        for m in metadata:
-            msg += f"- {m['nombre']} | {m['tamano_bytes']} bytes | Última modificación: {m['ultima_modificacion']}\n"
+        for m, path in zip(metadata, paths):
+            msg += f"- {m['nombre']} | {m['tamano_bytes']} bytes | Última modificación: {m['ultima_modificacion']}"
+            try:
+                profile = get_profile(path, build=False)
+            except OSError:
+                profile = None
+            if profile:
+                hojas = ", ".join(f"{nombre} ({info['filas']} filas, {len(info['columnas'])} columnas)"
+                                  for nombre, info in profile["hojas"].items())
+                msg += f" | Hojas: {hojas}"
+            else:
+                # Sin perfil todavía: nombres y dimensiones salen del catálogo XML, sin parsear celdas
+                try:
+                    msg += f" | Hojas: {format_catalog(read_sheet_catalog(path))}"
+                except Exception:
+                    pass
+            msg += "\n"
         return msg
     return "No se encontró metadata de archivos Excel en la carpeta /data."
 
+# --- Función de herramienta para consultar el esquema de un archivo Excel ---
+@function_tool
+async def esquema_excel(filename: str, hoja: Optional[str] = None) -> str:
+    """
+    Devuelve las columnas, tipos, filas, nulos, rangos y valores frecuentes de cada hoja de un archivo Excel.
+
+    Args:
+        filename: Nombre del archivo Excel en la carpeta /data (ej. 'ejemplo1.xlsx')
+        hoja: Nombre o número (desde 1) de una hoja; si se indica, solo se analiza esa hoja
+    """
+    from utils.prefetch import schedule
+    from utils.profile_index import format_profile, get_profile, get_sheet_profile
+    from utils.sheet_catalog import SheetNotFoundError, resolve_sheet
+    path = os.path.join("data", filename)
+    if not os.path.exists(path):
+        return f"[Error] El archivo '{path}' no existe."
+    try:
+        sheet = resolve_sheet(path, hoja) if hoja else None
+        # Después del esquema suele venir el análisis de la misma hoja
+        schedule(path, sheet)
+        if sheet is not None:
+            profile = await run_tool_async("esquema_excel", get_sheet_profile, path, sheet)
+        else:
+            profile = await run_tool_async("esquema_excel", get_profile, path)
+    except SheetNotFoundError as e:
+        return f"[Error] {e}"
+    except Exception as e:
+        return f"[Error] No se pudo calcular el esquema: {e}"
+    return format_profile(profile)
+
 # --- Función de herramienta para analizar archivos Excel con PandasAI ---
 @function_tool
-def analizar_excel(filename: str, query: str) -> str:
+async def analizar_excel(filename: str, query: str, hoja: Optional[str] = None) -> str:
     """
     Analiza un archivo Excel usando PandasAI.
     
     Args:
         filename: Nombre del archivo Excel en la carpeta /data (ej. 'ejemplo1.xlsx')
         query: Pregunta o instrucción para analizar el archivo
+        hoja: Nombre o número (desde 1) de la hoja a analizar; por defecto, la primera
     """
+    from tools.pandasai_tool import PandasAITool
     tool = PandasAITool()
-    return tool._run(f"{filename}: {query}")
+    target = f"{filename}#{hoja}" if hoja else filename
+    return await tool._arun(f"{target}: {query}")
+
+# --- Funciones de herramienta para consultas SQL entre archivos ---
+@function_tool
+async def tablas_sql(patron: Optional[str] = None) -> str:
+    """
+    Lista las tablas SQL disponibles: una por hoja de cada archivo Excel de /data.
+
+    Args:
+        patron: Patrón glob opcional para filtrar por nombre de archivo (ej. 'ventas_*.xlsx')
+    """
+    from utils.sql_engine import list_tables
+    # Abre el catálogo de cada libro: corre en el pool para no bloquear el event loop
+    try:
+        tables = await run_tool_async("tablas_sql", list_tables, pattern=patron)
+    except Exception as e:
+        return f"[Error] No se pudieron listar las tablas: {e}"
+    if not tables:
+        return "No se encontraron archivos Excel en la carpeta /data."
+    lines = ["Tablas SQL disponibles (tabla → archivo, hoja):"]
+    for t in tables:
+        size = f" ({t['filas']} filas, {t['columnas']} columnas)" if t["filas"] is not None else ""
+        lines.append(f"- {t['tabla']} → {t['archivo']}, hoja '{t['hoja']}'{size}")
+    return "\n".join(lines)
+
+@function_tool
+async def consulta_sql(sql: str) -> str:
+    """
+    Ejecuta una consulta SQL de solo lectura sobre los archivos Excel de /data, en una sola pasada.
+    Sirve para comparar o combinar varios archivos u hojas (JOIN, UNION, GROUP BY).
+    Cada hoja es una tabla: `ventas_2025` es la primera hoja de ventas_2025.xlsx y
+    `ventas_2025__resumen` su hoja 'Resumen'. Las columnas con espacios o acentos van entre
+    comillas dobles (ej. "Monto Total").
+
+    Args:
+        sql: Consulta SELECT (o WITH ... SELECT)
+    """
+    from utils.result_store import store_and_describe
+    from utils.sql_engine import SQL_MAX_ROWS, SQLError, run_sql
+    try:
+        df, truncated = await run_tool_async("consulta_sql", run_sql, sql)
+    except SQLError as e:
+        return f"[Error] {e}"
+    except Exception as e:
+        return f"[Error] La consulta SQL falló: {e}"
+    aviso = f"[Aviso] El resultado se limitó a las primeras {SQL_MAX_ROWS} filas.\n" if truncated else ""
+    return aviso + store_and_describe(df)
+
+# --- Función de herramienta para paginar resultados tabulares ya calculados ---
+@function_tool
+def ver_resultado(handle: str, pagina: int = 1, filas_por_pagina: int = 50,
+                  ordenar_por: Optional[str] = None, descendente: bool = False,
+                  filtro_columna: Optional[str] = None, filtro_valor: Optional[str] = None) -> str:
+    """
+    Muestra una página de un resultado tabular guardado (sin volver a analizar el archivo).
+
+    Args:
+        handle: Handle del resultado devuelto por `analizar_excel` (ej. 'res_0123456789ab')
+        pagina: Número de página, empezando en 1
+        filas_por_pagina: Filas por página (máximo 200)
+        ordenar_por: Columna por la que ordenar (opcional)
+        descendente: Ordenar de mayor a menor
+        filtro_columna: Columna para filtrar por igualdad (opcional)
+        filtro_valor: Valor que debe tener `filtro_columna`
+    """
+    from utils.result_store import result_store, slice_result
+    df = result_store.get(handle)
+    if df is None:
+        return f"[Error] El resultado '{handle}' no existe o ya expiró. Vuelve a ejecutar el análisis."
+    filas_por_pagina = min(max(filas_por_pagina, 1), 200)
+    try:
+        page_df, total = slice_result(df, pagina, filas_por_pagina, ordenar_por, descendente,
+                                      filtro_columna, filtro_valor)
+    except KeyError as e:
+        return f"[Error] La columna {e} no existe. Columnas disponibles: {', '.join(map(str, df.columns))}"
+    paginas = max((total + filas_por_pagina - 1) // filas_por_pagina, 1)
+    return (f"Página {max(pagina, 1)} de {paginas} ({total} filas):\n"
+            f"{page_df.to_string(index=False)}")
 
 # --- Herramienta para analizar y guardar resultado en Excel (como función) ---
 @function_tool
-def analizar_y_guardar_excel(filename: str, query: str, output_filename: str) -> str:
+async def analizar_y_guardar_excel(filename: str, query: str, output_filename: str,
+                                   hoja: Optional[str] = None) -> str:
     """
-    Analiza un archivo Excel usando PandasAI y guarda el resultado en un nuevo archivo Excel.
+    Analiza un archivo Excel usando PandasAI y guarda el resultado en /exports.
+    La extensión de `output_filename` elige el formato: .xlsx, .csv, .parquet o .feather.
+    `hoja` (nombre o número desde 1) elige la hoja de entrada; por defecto, la primera.
     """
+    from tools.guardar_excel_tool import AnalizarYGuardarExcelTool
     tool = AnalizarYGuardarExcelTool()
-    query_str = f"{filename}: {query}; guardar como {output_filename}"
-    return tool._run(query_str)
+    target = f"{filename}#{hoja}" if hoja else filename
+    query_str = f"{target}: {query}; guardar como {output_filename}"
+    return await tool._arun(query_str)
 
-# --- Crear y configurar agente para análisis de Excel ---
-excel_agent = Agent(
-    name="Excel Analyzer",
-    instructions="""
+# --- Instrucciones del agente para análisis de Excel ---
+EXCEL_AGENT_INSTRUCTIONS = """
 Eres Aria, un asistente experto en análisis de datos Excel y automatización de tareas de oficina.
 
 **Reglas de comportamiento:**
 - Siempre responde en español, de manera clara y profesional.
 - Si el usuario pregunta por archivos, usa la herramienta `listar_archivos_excel`.
 - Si el usuario pide detalles, usa `metadata_archivos_excel`.
+- Si necesitas saber qué columnas tiene un archivo, sus tipos o rangos, usa `esquema_excel` antes de analizarlo.
 - Si el usuario solicita un análisis, usa `analizar_excel` y explica el resultado de forma sencilla.
+- Los archivos pueden tener varias hojas; si el usuario menciona una, pásala en el parámetro `hoja` (sin `hoja` se usa la primera). Las hojas de cada archivo aparecen en `metadata_archivos_excel`.
+- Si la pregunta compara o combina varios archivos u hojas (p. ej. Q1 de ventas_2025.xlsx contra ventas_2026.xlsx), usa `tablas_sql` para ver los nombres de tabla, `esquema_excel` si necesitas las columnas, y resuélvela con una sola `consulta_sql`.
+- Si un resultado tabular trae un `handle`, usa `ver_resultado` para mostrar más filas, ordenar o filtrar; no repitas el análisis.
 - Si el usuario solicita un análisis y que el resultado se guarde en un nuevo archivo, usa la herramienta `analizar_y_guardar_excel`.
+- Si la exportación queda en curso en segundo plano, avisa al usuario que verá el progreso y el archivo en el chat.
 - Si la consulta no es sobre Excel, responde amablemente que solo puedes ayudar con análisis de archivos Excel.
 - Si usas una herramienta, explica brevemente qué hiciste y muestra el resultado.
 - Si ocurre un error, informa al usuario de forma empática y sugiere cómo corregirlo.
@@ -81,15 +245,30 @@ Aria:
 
 Usuario: ventas_globales.xlsx: filtra las ventas de Europa; guardar como ventas_europa.xlsx
 Aria:
-1. He filtrado las ventas de Europa y guardado el resultado en `/data/ventas_europa.xlsx`.
+1. He filtrado las ventas de Europa y guardado el resultado en `/exports/ventas_europa.xlsx`.
 2. Aquí tienes una vista previa de los primeros registros.
 
 ¿Te gustaría realizar otro análisis o ver la lista de archivos disponibles?
-""",
-    tools=[listar_archivos_excel, metadata_archivos_excel, analizar_excel, analizar_y_guardar_excel],
-    model="gpt-4o"
-)
+"""
+
+_excel_agent = None
+_excel_agent_lock = threading.Lock()
 
-# Función para acceder al agente configurado
+# Función para acceder al agente configurado (se construye en el primer uso)
 def get_excel_agent():
-    return excel_agent
\ No newline at end of file
+    global _excel_agent
+    if _excel_agent is None:
+        with _excel_agent_lock:
+            if _excel_agent is None:
+                from agents import set_default_openai_client
+                from utils.llm_scheduler import get_async_openai_client
+                # El Runner usa el cliente compartido: sus llamadas pasan por el planificador de LLM
+                set_default_openai_client(get_async_openai_client(), use_for_tracing=False)
+                _excel_agent = Agent(
+                    name="Excel Analyzer",
+                    instructions=EXCEL_AGENT_INSTRUCTIONS,
+                    tools=[listar_archivos_excel, metadata_archivos_excel, esquema_excel, analizar_excel,
+                           tablas_sql, consulta_sql, ver_resultado, analizar_y_guardar_excel],
+                    model="gpt-4o"
+                )
+    return _excel_agent
\ No newline at end of file
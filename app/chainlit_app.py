@@ -2,90 +2,311 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import chainlit as cl
-from agents.run import Runner
-from app.agent_setup import get_excel_agent
+from app.history import ConversationHistory
+from utils.logger import logger
+from utils.metrics import (log_trace, metrics, record, register_lazy_collector, start_metrics_server,
+                           start_trace)
+from utils.session_context import current_session_id
 import asyncio
+import threading
+import time
 
-# Obtener el agente configurado
-excel_agent = get_excel_agent()
+# Mostrar en el chat el desglose de tiempos de cada respuesta como pasos de Chainlit
+SHOW_TIMING_STEPS = os.getenv("SHOW_TIMING_STEPS", "false").lower() in ("1", "true", "yes")
+# Importar las herramientas y construir el agente en segundo plano justo después de arrancar
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() in ("1", "true", "yes")
+
+# Estadísticas que se exportan junto con los histogramas en /metrics. Se registran sin importar
+# los módulos (pandas, pandasai, agents...), que se cargan en el primer uso o en el calentamiento.
+register_lazy_collector("cache_dataframes", "utils.dataframe_cache", "dataframe_cache.stats")
+register_lazy_collector("cache_resultados", "utils.result_cache", "result_cache.stats")
+register_lazy_collector("almacen_resultados", "utils.result_store", "result_store.stats")
+register_lazy_collector("herramientas", "utils.async_executor", "executor_stats")
+register_lazy_collector("ruta_rapida", "utils.query_planner", "fast_path_stats")
+register_lazy_collector("historial", "app.history", "history_stats")
+register_lazy_collector("streaming", "app.streaming", "streaming_stats")
+register_lazy_collector("sandbox", "utils.code_sandbox", "sandbox_pool.stats")
+register_lazy_collector("coalescencia", "utils.single_flight", "single_flight_stats")
+register_lazy_collector("optimizacion_memoria", "utils.frame_optimizer", "optimizer_stats")
+register_lazy_collector("sql", "utils.sql_engine", "sql_stats")
+register_lazy_collector("reingesta", "utils.sheet_versions", "ingest_stats")
+register_lazy_collector("prefetch", "utils.prefetch", "prefetch_stats")
+register_lazy_collector("cache_compartida", "utils.shared_cache", "shared_cache_stats")
+register_lazy_collector("llm", "utils.llm_scheduler", "llm_scheduler_stats")
+# Solo con METRICS_SERVER=true: con varios workers, un endpoint por proceso no puede compartir puerto
+start_metrics_server()
+
+def _warm_up():
+    """Carga los módulos pesados, construye el agente y crea los workers de PandasAI."""
+    try:
+        from app.agent_setup import get_excel_agent
+        get_excel_agent()
+        import tools.pandasai_tool, tools.guardar_excel_tool, utils.result_store  # noqa: F401
+        from utils.code_sandbox import SANDBOX_ENABLED, sandbox_pool
+        # Los workers que ejecutan el código de PandasAI se crean al arrancar, no en la primera consulta
+        if SANDBOX_ENABLED:
+            sandbox_pool.start()
+        # Los libros que se reescriban en /data se re-ingieren en segundo plano, solo las hojas que cambiaron
+        from utils.sheet_versions import watch_directory
+        watch_directory("data")
+        # Los libros del conjunto caliente (EXCEL_PREFETCH_HOT_SET) quedan cargados antes de la primera consulta
+        from utils.prefetch import warm_hot_set
+        warm_hot_set("data")
+        logger.info("Calentamiento terminado")
+    except Exception as e:
+        # Si algo falla aquí, se vuelve a intentar (y se reporta) en la primera consulta
+        logger.warning("Falló el calentamiento: {}", e)
+
+if WARMUP_ON_START:
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
 
 @cl.on_message
 async def on_message(message: cl.Message):
     # Tomar el contenido del mensaje
     user_query = message.content.strip()
+    # Registrar la tarea actual para poder cancelarla si el usuario se desconecta
+    cl.user_session.set("current_task", asyncio.current_task())
+    # Las herramientas heredan la sesión (p. ej. para reportar aquí el progreso de exportaciones)
+    session_id = cl.context.session.id
+    current_session_id.set(session_id)
+    # Las etapas medidas durante este turno (incluidas las de las herramientas) se anotan en la traza
+    trace = start_trace()
+    started = time.perf_counter()
     
     # --- MEMORIA DE SESIÓN ---
     # Recuperar historial de mensajes de la sesión del usuario
-    history = cl.user_session.get("history", [])
+    history = cl.user_session.get("history")
+    if not isinstance(history, ConversationHistory):
+        history = ConversationHistory()
+    # Los archivos nombrados en este mensaje o en los anteriores se empiezan a cargar mientras responde el modelo
+    previous = [m["content"] for m in history.messages if m["role"] == "user"]
+    asyncio.get_running_loop().run_in_executor(None, _prefetch_mentions, user_query, previous)
     # Agregar el nuevo mensaje del usuario
-    history.append({"role": "user", "content": user_query})
+    history.add_user(user_query)
     
-    # Limitar el historial a las últimas 20 interacciones
-    MAX_HISTORY = 20
-    history = history[-MAX_HISTORY:]
+    # El historial se recorta por presupuesto de tokens y las salidas grandes de herramientas van resumidas
+    history_input, history_usage = history.build_input()
     
     # Mensaje de feedback opcional (puedes comentar si no lo quieres)
     # await cl.Message(content="Procesando consulta...", author="Excel Assistant").send()
     
+    metrics.enter("mensaje.total")
+    # Si hay mucha demanda, el usuario ve su posición en la cola de llamadas al modelo
+    queue_notice = asyncio.create_task(_report_queue_position(session_id))
     try:
+        from agents.run import Runner
+        from app.agent_setup import get_excel_agent
+        from app.streaming import TokenCoalescer
+        from utils.export_engine import export_jobs
+        from utils.result_store import find_handles
         # Ejecutar el agente con el historial de mensajes (memoria)
         # NOTA: Si el agente no soporta historial, solo envía el último mensaje
         streamed_result = Runner.run_streamed(
-            excel_agent,
-            input=[{"role": h["role"], "content": h["content"]} for h in history]
+            get_excel_agent(),
+            input=history_input
         )
-        full_response = ""
-
+        tool_outputs = []
         # Crear mensaje para streaming en Chainlit
         msg = cl.Message(content="", author="Excel Assistant")
         await msg.send()
 
-        async for event in streamed_result.stream_events():
-            # Procesar eventos de streaming
-            if hasattr(event, 'type'):
-                if event.type == "run_item_stream_event":
-                    # Mensaje del modelo o resultado de herramienta
-                    item = event.item
-                    if hasattr(item, 'type') and item.type == "message_output_item":
-                        # Mensaje del modelo (token o bloque)
-                        last_content = item.raw_item.content[-1]
-                        if hasattr(last_content, 'text'):
-                            token = last_content.text
-                            if token:
-                                full_response += token
-                                await msg.stream_token(token)
-                    elif hasattr(item, 'type') and item.type == "tool_call_output_item":
-                        # Resultado de herramienta
-                        output = getattr(item, 'output', None)
-                        if output:
-                            full_response += str(output)
-                            await msg.stream_token(str(output))
-                elif event.type == "raw_response_event":
-                    data = getattr(event, 'data', None)
-                    if data and hasattr(data, 'delta'):
-                        print("[DEBUG] Delta recibido:", data.delta)
-                        delta = data.delta
-                        if delta and hasattr(delta, 'content'):
-                            token = delta.content
-                            if token:
-                                full_response += token
-                                await msg.stream_token(token)
-                        elif isinstance(delta, str):
-                            full_response += delta
-                            await msg.stream_token(delta)
-                # Puedes agregar más tipos de eventos si lo deseas
+        # Los tokens se agrupan por ventana de tiempo/tamaño antes de enviarse por el websocket
+        first_token = None
+        async with TokenCoalescer(msg) as stream:
+            async for event in streamed_result.stream_events():
+                # Procesar eventos de streaming
+                if hasattr(event, 'type'):
+                    if event.type == "run_item_stream_event":
+                        # Mensaje del modelo o resultado de herramienta
+                        item = event.item
+                        if hasattr(item, 'type') and item.type == "message_output_item":
+                            # Mensaje del modelo (token o bloque)
+                            last_content = item.raw_item.content[-1]
+                            if hasattr(last_content, 'text'):
+                                await stream.push(last_content.text)
+                        elif hasattr(item, 'type') and item.type == "tool_call_output_item":
+                            # Resultado de herramienta
+                            output = getattr(item, 'output', None)
+                            if output:
+                                tool_outputs.append(str(output))
+                                await stream.push(str(output))
+                    elif event.type == "raw_response_event":
+                        data = getattr(event, 'data', None)
+                        if data and hasattr(data, 'delta'):
+                            logger.opt(lazy=True).debug("Delta recibido: {}", lambda: data.delta)
+                            delta = data.delta
+                            if delta and hasattr(delta, 'content'):
+                                await stream.push(delta.content)
+                            elif isinstance(delta, str):
+                                await stream.push(delta)
+                    # Puedes agregar más tipos de eventos si lo deseas
+                if first_token is None and stream.tokens_received:
+                    first_token = time.perf_counter()
+                    record("agente.primer_token", first_token - started)
+        full_response = stream.text
+        record("agente.respuesta", time.perf_counter() - started)
+
+        # Botones para paginar o descargar resultados tabulares sin otra llamada al LLM
+        handles = [h for output in tool_outputs for h in find_handles(output)]
+        if handles:
+            msg.actions = _result_actions(handles)
 
         # Actualizar mensaje final
         await msg.update()
-        # Guardar la respuesta del asistente en el historial
-        history.append({"role": "assistant", "content": full_response})
+        if SHOW_TIMING_STEPS:
+            await _send_timing_steps(trace, time.perf_counter() - started)
+        # Guardar la respuesta del asistente en el historial (las tablas grandes se referencian por su handle)
+        refs = [(find_handles(output) or [None])[0] for output in tool_outputs]
+        history.add_assistant(full_response, tool_outputs, refs)
+        history.trim()
         cl.user_session.set("history", history)
+
+        # Exportaciones en segundo plano lanzadas en este turno: su progreso se muestra en el chat
+        for job in export_jobs.for_session(session_id):
+            export_jobs.mark_notified(job["id"])
+            asyncio.create_task(_watch_export(job["id"]))
         
     except Exception as e:
         # Manejar errores
-        error_msg = f"Error al procesar la consulta: {str(e)}"
+        from utils.llm_scheduler import find_queue_full
+        busy = find_queue_full(e)
+        # El cliente de OpenAI envuelve el rechazo de la cola en un error de conexión: se muestra el original
+        error_msg = f"[Error] {busy}" if busy is not None else f"Error al procesar la consulta: {str(e)}"
         # Al final, envía el error como un nuevo mensaje
         await cl.Message(content=error_msg, author="Excel Assistant").send()
         # Guardar el error en el historial
-        history.append({"role": "assistant", "content": error_msg})
-        cl.user_session.set("history", history)
\ No newline at end of file
+        history.add_assistant(error_msg)
+        cl.user_session.set("history", history)
+    finally:
+        queue_notice.cancel()
+        metrics.exit("mensaje.total")
+        record("mensaje.total", time.perf_counter() - started)
+        log_trace(trace, sesion=session_id)
+        cl.user_session.set("current_task", None)
+
+def _prefetch_mentions(user_query, previous):
+    try:
+        from utils.prefetch import prefetch_from_messages
+        prefetch_from_messages(user_query, previous)
+    except Exception as e:
+        logger.warning("Falló el prefetch de archivos mencionados: {}", e)
+
+RESULT_PAGE_SIZE = 50
+EXPORT_PROGRESS_INTERVAL = 1.0
+QUEUE_NOTICE_INTERVAL = 1.0
+
+async def _report_queue_position(session_id):
+    """Mientras la sesión tenga llamadas al modelo en cola, muestra (y actualiza) su posición."""
+    from utils.llm_scheduler import llm_scheduler
+    notice = None
+    try:
+        while True:
+            await asyncio.sleep(QUEUE_NOTICE_INTERVAL)
+            position = llm_scheduler.position(session_id)
+            if position is None:
+                if notice is not None:
+                    await notice.remove()
+                    notice = None
+                continue
+            content = f"Hay mucha demanda en este momento: tu consulta está en la posición {position} de la cola."
+            if notice is None:
+                notice = cl.Message(content=content, author="Excel Assistant")
+                await notice.send()
+            elif notice.content != content:
+                notice.content = content
+                await notice.update()
+    finally:
+        if notice is not None:
+            await notice.remove()
+
+async def _watch_export(job_id):
+    """Actualiza un mensaje con el progreso de una exportación y adjunta el archivo al terminar."""
+    from utils.export_engine import export_jobs
+    job = export_jobs.get(job_id)
+    progress_msg = cl.Message(content=f"Exportando {job['archivo']} ({job['filas']} filas): 0%",
+                              author="Excel Assistant")
+    await progress_msg.send()
+    while job["estado"] in ("en_cola", "en_progreso"):
+        await asyncio.sleep(EXPORT_PROGRESS_INTERVAL)
+        job = export_jobs.get(job_id)
+        progress_msg.content = f"Exportando {job['archivo']} ({job['filas']} filas): {job['progreso']:.0%}"
+        await progress_msg.update()
+    if job["estado"] == "error":
+        progress_msg.content = f"La exportación de {job['archivo']} falló: {job['error']}"
+    else:
+        split = f" (repartido en {job['hojas']} hojas)" if (job.get("hojas") or 1) > 1 else ""
+        progress_msg.content = f"Exportación terminada: /exports/{job['archivo']}{split}"
+        progress_msg.elements = [cl.File(name=job["archivo"], path=job["ruta"])]
+    await progress_msg.update()
+
+async def _send_timing_steps(trace, total_seconds):
+    """Desglose de tiempos del turno: un paso padre con el total y un paso por etapa."""
+    async with cl.Step(name="Desglose de tiempos", type="run") as parent:
+        parent.output = f"Total: {total_seconds * 1000:.0f} ms"
+        for item in list(trace):
+            async with cl.Step(name=item["etapa"], type="tool") as step:
+                details = ", ".join(f"{k}: {v}" for k, v in item.items() if k not in ("etapa", "ms"))
+                step.output = f"{item['ms']:.1f} ms" + (f" ({details})" if details else "")
+
+def _result_actions(handles, pagina=2):
+    actions = []
+    for handle in dict.fromkeys(handles):
+        actions.append(cl.Action(name="resultado_pagina", payload={"handle": handle, "pagina": pagina},
+                                 label=f"Ver más filas ({handle})"))
+        actions.append(cl.Action(name="resultado_descargar", payload={"handle": handle},
+                                 label=f"Descargar CSV ({handle})"))
+    return actions
+
+@cl.action_callback("resultado_pagina")
+async def on_result_page(action: cl.Action):
+    from utils.result_store import result_store, slice_result
+    handle = action.payload["handle"]
+    pagina = int(action.payload.get("pagina", 2))
+    df = result_store.get(handle)
+    if df is None:
+        await cl.Message(content=f"El resultado `{handle}` ya no está disponible.", author="Excel Assistant").send()
+        return
+    page_df, total = slice_result(df, pagina, RESULT_PAGE_SIZE)
+    paginas = max((total + RESULT_PAGE_SIZE - 1) // RESULT_PAGE_SIZE, 1)
+    actions = []
+    if pagina < paginas:
+        actions.append(cl.Action(name="resultado_pagina", payload={"handle": handle, "pagina": pagina + 1},
+                                 label="Siguiente página"))
+    await cl.Message(
+        content=f"Página {pagina} de {paginas} del resultado `{handle}`:\n```\n{page_df.to_string(index=False)}\n```",
+        author="Excel Assistant",
+        actions=actions,
+    ).send()
+
+@cl.action_callback("resultado_descargar")
+async def on_result_download(action: cl.Action):
+    from utils.result_store import export_result
+    handle = action.payload["handle"]
+    path = await asyncio.to_thread(export_result, handle, "csv")
+    if path is None:
+        await cl.Message(content=f"El resultado `{handle}` ya no está disponible.", author="Excel Assistant").send()
+        return
+    await cl.Message(
+        content=f"Resultado `{handle}` completo:",
+        author="Excel Assistant",
+        elements=[cl.File(name=os.path.basename(path), path=path)],
+    ).send()
+
+def _cancel_current_task():
+    """Cancela la consulta en curso; las herramientas aún en cola se descartan."""
+    task = cl.user_session.get("current_task")
+    if task is not None and not task.done():
+        task.cancel()
+
+@cl.on_stop
+async def on_stop():
+    _cancel_current_task()
+
+@cl.on_chat_end
+async def on_chat_end():
+    # El usuario cerró la sesión o se desconectó
+    _cancel_current_task()
+    # El thread de OpenAI de la sesión ya no se va a usar (solo si el asistente llegó a cargarse)
+    openai_agent = sys.modules.get("app.openai_agent")
+    if openai_agent is not None:
+        openai_agent.agent_graph.reset_session(cl.context.session.id)
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Historial de conversación con presupuesto de tokens.
+
+En lugar de reenviar los últimos 20 mensajes tal cual, el historial:
+- cuenta tokens con el tokenizer del modelo (tiktoken; si no está, una aproximación),
+- guarda las salidas grandes de herramientas como un resumen corto; si la salida es un resultado
+  tabular del almacén (utils/result_store.py), el resumen conserva su handle, que el agente puede
+  paginar con `ver_resultado`,
+- y, si aun así se excede el presupuesto, omite los turnos más antiguos dejando un resumen.
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+# Tokens máximos que se envían al modelo como historial
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Salidas de herramienta por encima de este tamaño se guardan resumidas
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("HISTORY_TOOL_OUTPUT_MAX_TOKENS", "300"))
+# Líneas de la salida de herramienta que se conservan en el resumen
+TOOL_OUTPUT_PREVIEW_LINES = 6
+HISTORY_MODEL = os.getenv("HISTORY_MODEL", "gpt-4o")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+_totals = {"solicitudes": 0, "tokens_enviados": 0, "tokens_ahorrados": 0}
+_totals_lock = threading.Lock()
+
+
+def _get_encoding():
+    # El tokenizer se carga en el primer uso: cargarlo al importar retrasa el arranque de la app
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    try:
+                        _encoding = tiktoken.encoding_for_model(HISTORY_MODEL)
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("o200k_base")
+                except ImportError:  # tiktoken es opcional
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de un texto según el tokenizer del modelo (≈ 4 caracteres por token sin tiktoken)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def summarize_tool_output(output: str, handle: Optional[str] = None) -> str:
+    """
+    Resumen corto de una salida de herramienta: primeras líneas y tamaño. Con `handle` (un
+    resultado del almacén) indica cómo ver el resto; sin él, no promete nada que no se pueda consultar.
+    """
+    lines = output.splitlines()
+    preview = "\n".join(lines[:TOOL_OUTPUT_PREVIEW_LINES])
+    omitted = max(len(lines) - TOOL_OUTPUT_PREVIEW_LINES, 0)
+    where = (f"el resultado completo se consulta con `ver_resultado` y el handle {handle}" if handle
+             else "si hace falta el resto, vuelve a ejecutar la herramienta")
+    return (f"{preview}\n[... salida de herramienta resumida: {omitted} líneas más, "
+            f"{len(output)} caracteres en total; {where}]")
+
+
+class ConversationHistory:
+    """Historial de una sesión de chat con compactación por presupuesto de tokens."""
+
+    def __init__(self, budget_tokens: int = HISTORY_TOKEN_BUDGET,
+                 tool_output_max_tokens: int = TOOL_OUTPUT_MAX_TOKENS):
+        self.budget_tokens = budget_tokens
+        self.tool_output_max_tokens = tool_output_max_tokens
+        # Cada mensaje guarda el texto compacto, sus tokens y los tokens del texto original
+        self.messages: List[Dict] = []
+
+    def add_user(self, content: str) -> None:
+        tokens = count_tokens(content)
+        self.messages.append({"role": "user", "content": content, "tokens": tokens, "raw_tokens": tokens})
+
+    def add_assistant(self, content: str, tool_outputs: Optional[List[str]] = None,
+                      refs: Optional[List[Optional[str]]] = None) -> None:
+        """
+        Guarda la respuesta del asistente reemplazando las salidas de herramienta grandes
+        por un resumen. `refs[i]` es el handle del almacén de resultados de la salida i, si tiene.
+        """
+        raw_tokens = count_tokens(content)
+        compact = content
+        for i, output in enumerate(tool_outputs or []):
+            if not output or count_tokens(output) <= self.tool_output_max_tokens or output not in compact:
+                continue
+            handle = refs[i] if refs and i < len(refs) else None
+            compact = compact.replace(output, summarize_tool_output(output, handle), 1)
+        self.messages.append({"role": "assistant", "content": compact,
+                              "tokens": count_tokens(compact), "raw_tokens": raw_tokens})
+
+    def build_input(self) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Mensajes a enviar al modelo dentro del presupuesto, del más reciente hacia atrás.
+        Devuelve también las métricas de la solicitud (tokens enviados y ahorrados).
+        """
+        selected: List[Dict] = []
+        used = 0
+        for i, message in enumerate(reversed(self.messages)):
+            # El último mensaje del usuario se envía siempre
+            if i > 0 and used + message["tokens"] > self.budget_tokens:
+                break
+            selected.append(message)
+            used += message["tokens"]
+        selected.reverse()
+        # Un historial no debe empezar con una respuesta del asistente sin su pregunta
+        while len(selected) > 1 and selected[0]["role"] != "user":
+            used -= selected.pop(0)["tokens"]
+
+        dropped = self.messages[:len(self.messages) - len(selected)]
+        payload = [{"role": m["role"], "content": m["content"]} for m in selected]
+        if dropped:
+            summary = self._summarize_dropped(dropped, self.budget_tokens - used)
+            if summary:
+                payload.insert(0, {"role": "user", "content": summary})
+                used += count_tokens(summary)
+
+        raw = sum(m["raw_tokens"] for m in self.messages)
+        stats = {"tokens_enviados": used, "tokens_originales": raw,
+                 "tokens_ahorrados": max(raw - used, 0), "turnos_omitidos": len(dropped)}
+        with _totals_lock:
+            _totals["solicitudes"] += 1
+            _totals["tokens_enviados"] += used
+            _totals["tokens_ahorrados"] += stats["tokens_ahorrados"]
+        logger.info("Historial: {} tokens enviados, {} ahorrados, {} mensajes omitidos",
+                    used, stats["tokens_ahorrados"], len(dropped))
+        return payload, stats
+
+    def trim(self) -> None:
+        """Descarta del estado los mensajes que ya no caben en el presupuesto (evita crecer sin límite)."""
+        total = 0
+        keep = len(self.messages)
+        for i in range(len(self.messages) - 1, -1, -1):
+            total += self.messages[i]["tokens"]
+            if total > self.budget_tokens * 4:
+                keep = len(self.messages) - i - 1
+                break
+        self.messages = self.messages[len(self.messages) - keep:]
+
+    @staticmethod
+    def _summarize_dropped(dropped: List[Dict], available_tokens: int) -> str:
+        questions = [m["content"].strip().replace("\n", " ")[:120] for m in dropped if m["role"] == "user"]
+        if not questions or available_tokens <= 20:
+            return ""
+        summary = "Contexto de turnos anteriores (resumido): el usuario preguntó " + "; ".join(
+            f"'{q}'" for q in questions[-10:]) + "."
+        while questions and count_tokens(summary) > available_tokens:
+            questions.pop(0)
+            summary = "Contexto de turnos anteriores (resumido): el usuario preguntó " + "; ".join(
+                f"'{q}'" for q in questions[-10:]) + "."
+        return summary if questions else ""
+
+
+def history_stats() -> Dict[str, int]:
+    """Totales del proceso: solicitudes, tokens enviados y tokens ahorrados por la compactación."""
+    with _totals_lock:
+        return dict(_totals)
@@ -1,13 +1,31 @@
 import os
-from openai import OpenAI
-from tools.pandasai_tool import PandasAITool
+from utils.async_executor import run_tool_async
 from utils.file_manager import list_excel_files, get_excel_files_metadata
+from utils.logger import logger
+import hashlib
 import json
-import time
 import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
 
-# Inicializar cliente de OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Archivo donde se guarda el ID del asistente creado, para reutilizarlo entre reinicios
+ASSISTANT_ID_FILE = os.getenv("OPENAI_ASSISTANT_ID_FILE", os.path.join("data", ".cache", "assistant_id.json"))
+ASSISTANT_NAME = "Excel Analyzer"
+ASSISTANT_MODEL = "gpt-4o"
+# Threads de sesión que se recuerdan como máximo (las sesiones sin actividad más antiguas se olvidan)
+MAX_SESSION_THREADS = int(os.getenv("OPENAI_MAX_SESSION_THREADS", "1000"))
+# Eventos con los que un run termina (después de ellos ya no hay nada que cancelar)
+_TERMINAL_RUN_EVENTS = ("thread.run.completed", "thread.run.failed", "thread.run.cancelled",
+                        "thread.run.expired", "thread.run.incomplete")
+ASSISTANT_INSTRUCTIONS = "Eres un asistente experto en análisis de datos de Excel. SIEMPRE usa las herramientas disponibles cuando sea apropiado. Usa 'listar_archivos_excel' antes de analizar cualquier archivo."
+
+def get_client():
+    """
+    Cliente asíncrono de OpenAI compartido, creado en el primer uso (respeta OPENAI_BASE_URL, útil
+    para el servidor mock). Sus peticiones pasan por el planificador de utils/llm_scheduler.py.
+    """
+    from utils.llm_scheduler import get_async_openai_client
+    return get_async_openai_client()
 
 # Definir herramientas
 tools = [
@@ -86,149 +104,210 @@ def execute_tool(tool_name, arguments=None):
         if not filename or not query:
             return "Error: Se requiere el nombre del archivo y la consulta."
         
-        # Usar PandasAITool
+        # Usar PandasAITool (se importa aquí: arrastra pandas, pandasai y langchain)
+        from tools.pandasai_tool import PandasAITool
         tool = PandasAITool()
         return tool._run(f"{filename}: {query}")
     
     else:
         return f"Error: Herramienta '{tool_name}' no reconocida."
 
-# Clase de agente con simulación de streaming
+# Clase de agente con streaming real (server-sent events)
 class AssistantAgent:
-    def __init__(self, assistant_id=None):
-        self.client = client
-        
-        # Intentar recuperar un asistente existente o crear uno nuevo
-        if assistant_id:
-            try:
-                self.assistant = client.beta.assistants.retrieve(assistant_id)
-                print(f"Usando asistente existente: {self.assistant.id}")
-            except Exception as e:
-                print(f"Error al recuperar asistente: {e}. Creando nuevo...")
-                self.assistant = self._create_assistant()
-        else:
-            # Crear asistente
-            self.assistant = self._create_assistant()
-            print(f"Nuevo asistente creado: {self.assistant.id}")
-    
-    def _create_assistant(self):
+    def __init__(self, assistant_id=None, client_override=None, id_file: Optional[str] = ASSISTANT_ID_FILE):
+        self._client_override = client_override
+        self.assistant_id = assistant_id
+        self.id_file = id_file
+        self._assistant_checked = False
+        self._assistant_lock = asyncio.Lock()
+        # Un thread de OpenAI por sesión de usuario; un thread no admite dos runs simultáneos
+        self._threads: "OrderedDict[str, str]" = OrderedDict()
+        self._thread_locks: Dict[str, asyncio.Lock] = {}
+        # Dos primeros mensajes simultáneos de una sesión deben crear un solo thread
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def client(self):
+        return self._client_override or get_client()
+
+    @staticmethod
+    def _config_hash() -> str:
+        # Si cambian las herramientas, el modelo o las instrucciones, el asistente guardado ya no sirve
+        config = json.dumps([ASSISTANT_NAME, ASSISTANT_MODEL, ASSISTANT_INSTRUCTIONS, tools], sort_keys=True)
+        return hashlib.sha256(config.encode("utf-8")).hexdigest()[:16]
+
+    def _load_saved_id(self) -> Optional[str]:
+        if not self.id_file:
+            return None
+        try:
+            with open(self.id_file, encoding="utf-8") as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        return saved.get("id") if saved.get("config") == self._config_hash() else None
+
+    def _save_id(self, assistant_id: str) -> None:
+        if not self.id_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.id_file)), exist_ok=True)
+            tmp_path = f"{self.id_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump({"id": assistant_id, "config": self._config_hash()}, fh)
+            os.replace(tmp_path, self.id_file)
+        except OSError as e:
+            logger.warning("No se pudo guardar el ID del asistente: {}", e)
+
+    async def _create_assistant(self):
         """Crea un nuevo asistente con las herramientas configuradas."""
-        return client.beta.assistants.create(
-            name="Excel Analyzer",
-            instructions="Eres un asistente experto en análisis de datos de Excel. SIEMPRE usa las herramientas disponibles cuando sea apropiado. Usa 'listar_archivos_excel' antes de analizar cualquier archivo.",
+        return await self.client.beta.assistants.create(
+            name=ASSISTANT_NAME,
+            instructions=ASSISTANT_INSTRUCTIONS,
             tools=tools,
-            model="gpt-4o"
-        )
-    
-    async def arun(self, query):
-        # Crear un thread
-        thread = self.client.beta.threads.create()
-        
-        # Agregar mensaje del usuario al thread
-        self.client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=query
+            model=ASSISTANT_MODEL
         )
-        
-        # Ejecutar el asistente en el thread
-        run = self.client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=self.assistant.id
-        )
-        
-        # Inicializar variables para tracking de tokens
-        last_content = ""
-        assistant_message_id = None
-        
-        # Polling para simular streaming
-        while True:
-            # Obtener estado actual de la ejecución
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread.id,
-                run_id=run.id
+
+    async def _ensure_assistant(self) -> str:
+        """
+        Recupera el asistente configurado (OPENAI_ASSISTANT_ID o el guardado localmente) o crea
+        uno nuevo y guarda su ID. Se resuelve una sola vez por proceso, en la primera consulta.
+        """
+        async with self._assistant_lock:
+            if self._assistant_checked:
+                return self.assistant_id
+            assistant_id = self.assistant_id or self._load_saved_id()
+            if assistant_id:
+                try:
+                    assistant = await self.client.beta.assistants.retrieve(assistant_id)
+                    logger.info("Usando asistente existente: {}", assistant.id)
+                except Exception as e:
+                    logger.warning("Error al recuperar asistente: {}. Creando nuevo...", e)
+                    assistant = await self._create_assistant()
+                    self._save_id(assistant.id)
+            else:
+                assistant = await self._create_assistant()
+                logger.info("Nuevo asistente creado: {}", assistant.id)
+                self._save_id(assistant.id)
+            self.assistant_id = assistant.id
+            self._assistant_checked = True
+            return self.assistant_id
+
+    async def _get_thread(self, session_id: Optional[str]) -> str:
+        """Reutiliza el thread de la sesión; sin session_id se crea uno nuevo por consulta."""
+        if not session_id:
+            return (await self.client.beta.threads.create()).id
+        session_lock = self._session_locks.get(session_id)
+        if session_lock is None:
+            session_lock = self._session_locks[session_id] = asyncio.Lock()
+        async with session_lock:
+            if session_id in self._threads:
+                self._threads.move_to_end(session_id)
+                return self._threads[session_id]
+            thread = await self.client.beta.threads.create()
+            self._threads[session_id] = thread.id
+            while len(self._threads) > MAX_SESSION_THREADS:
+                old_session, old_thread = self._threads.popitem(last=False)
+                lock = self._thread_locks.get(old_thread)
+                if lock is not None and not lock.locked():
+                    del self._thread_locks[old_thread]
+                old_lock = self._session_locks.get(old_session)
+                if old_lock is not None and not old_lock.locked():
+                    del self._session_locks[old_session]
+            return thread.id
+
+    def _thread_lock(self, thread_id: str) -> asyncio.Lock:
+        lock = self._thread_locks.get(thread_id)
+        if lock is None:
+            lock = self._thread_locks[thread_id] = asyncio.Lock()
+        return lock
+
+    def reset_session(self, session_id: str) -> None:
+        """Olvida el thread de una sesión (p. ej. al terminar el chat)."""
+        thread_id = self._threads.pop(session_id, None)
+        if thread_id:
+            self._thread_locks.pop(thread_id, None)
+        self._session_locks.pop(session_id, None)
+
+    async def _execute_tool_call(self, tool_call) -> str:
+        function_name = tool_call.function.name
+        try:
+            arguments = json.loads(tool_call.function.arguments or "{}")
+            result = await run_tool_async(function_name, execute_tool, function_name, arguments)
+        except Exception as e:
+            result = f"Error al ejecutar la herramienta '{function_name}': {e}"
+        return str(result)
+
+    async def arun(self, query, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        assistant_id = await self._ensure_assistant()
+        thread_id = await self._get_thread(session_id)
+
+        async with self._thread_lock(thread_id):
+            # Agregar mensaje del usuario al thread
+            await self.client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=query
+            )
+
+            # Ejecutar el asistente en el thread recibiendo eventos por streaming
+            stream = await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True
             )
-            
-            # Manejar estado "requires_action" (llamada a herramienta)
-            if run.status == "requires_action":
-                tool_calls = run.required_action.submit_tool_outputs.tool_calls
-                tool_outputs = []
-                
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
-                    arguments = json.loads(tool_call.function.arguments)
-                    
-                    # Mostrar información de la herramienta
-                    yield f"\n\n[Ejecutando herramienta: {function_name}]\n"
-                    
-                    # Ejecutar la herramienta
-                    result = execute_tool(function_name, arguments)
-                    
-                    # Mostrar el resultado
-                    yield f"{result}\n\n"
-                    
-                    # Agregar a las salidas de herramientas
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": result
-                    })
-                
-                # Enviar resultados al asistente
-                self.client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=thread.id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
-            
-            # Si la ejecución está en progreso o completa, buscar mensajes nuevos/actualizados
-            elif run.status in ["in_progress", "completed"]:
-                # Obtener mensajes, ordenados por más reciente primero
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread.id,
-                    order="desc",
-                    limit=1  # Solo el mensaje más reciente
-                )
-                
-                # Buscar el mensaje más reciente del asistente
-                for msg in messages.data:
-                    if msg.role == "assistant":
-                        # Si es un mensaje nuevo o el mismo mensaje con contenido actualizado
-                        if (assistant_message_id is None or 
-                            msg.id == assistant_message_id):
-                            
-                            # Actualizar ID del mensaje actual
-                            assistant_message_id = msg.id
-                            
-                            # Obtener todo el contenido de texto del mensaje
-                            full_content = ""
-                            for content_part in msg.content:
-                                if content_part.type == "text":
-                                    full_content += content_part.text.value
-                            
-                            # Si hay nuevo contenido
-                            if full_content != last_content:
-                                # Solo enviar la parte nueva
-                                new_content = full_content[len(last_content):]
-                                if new_content:
-                                    yield new_content
-                                
-                                # Actualizar último contenido visto
-                                last_content = full_content
-                        
-                        break  # Solo procesamos el primer mensaje
-            
-            # Si la ejecución ha terminado y ya enviamos todo el contenido, salimos
-            if run.status == "completed" and assistant_message_id is not None:
-                break
-            
-            # Si ocurrió un error
-            if run.status in ["failed", "cancelled", "expired"]:
-                yield f"\n\nError: La ejecución finalizó con estado {run.status}.\n"
-                break
-            
-            # Pausa breve para no sobrecargar la API
-            await asyncio.sleep(0.3)
-
-# Instanciar agente (usar ID existente si está disponible)
+
+            # Si quien consume el stream lo abandona (el usuario detiene la respuesta o se desconecta),
+            # el run se cancela: un thread con un run activo rechaza los mensajes siguientes
+            run_id, finished = None, False
+            try:
+                while stream is not None:
+                    next_stream = None
+                    async with stream:
+                        async for event in stream:
+                            if event.event.startswith("thread.run.") and getattr(event.data, "id", None):
+                                run_id = event.data.id
+                            if event.event in _TERMINAL_RUN_EVENTS:
+                                finished = True
+
+                            if event.event == "thread.message.delta":
+                                for part in event.data.delta.content or []:
+                                    if part.type == "text" and part.text and part.text.value:
+                                        yield part.text.value
+
+                            # Manejar llamadas a herramientas: se ejecutan todas a la vez
+                            elif event.event == "thread.run.requires_action":
+                                run = event.data
+                                tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                                for tool_call in tool_calls:
+                                    yield f"\n\n[Ejecutando herramienta: {tool_call.function.name}]\n"
+                                results = await asyncio.gather(*(self._execute_tool_call(tc) for tc in tool_calls))
+                                for result in results:
+                                    yield f"{result}\n\n"
+
+                                # Enviar resultados al asistente y continuar con el nuevo stream
+                                next_stream = await self.client.beta.threads.runs.submit_tool_outputs(
+                                    run.id,
+                                    thread_id=thread_id,
+                                    tool_outputs=[
+                                        {"tool_call_id": tc.id, "output": result}
+                                        for tc, result in zip(tool_calls, results)
+                                    ],
+                                    stream=True
+                                )
+                                break
+
+                            # Si ocurrió un error
+                            elif event.event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired"):
+                                status = event.event.rsplit(".", 1)[-1]
+                                yield f"\n\nError: La ejecución finalizó con estado {status}.\n"
+                    stream = next_stream
+            finally:
+                if run_id and not finished:
+                    try:
+                        await self.client.beta.threads.runs.cancel(run_id, thread_id=thread_id)
+                    except Exception as e:
+                        logger.warning("No se pudo cancelar el run {}: {}", run_id, e)
+
+# Instanciar agente (usar ID existente si está disponible); el cliente y el asistente se resuelven en la primera consulta
 assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
-agent_graph = AssistantAgent(assistant_id)
\ No newline at end of file
+agent_graph = AssistantAgent(assistant_id)
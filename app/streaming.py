@@ -0,0 +1,101 @@
+"""
+Etapa de streaming que agrupa tokens antes de enviarlos a Chainlit.
+
+Enviar un frame de websocket por cada delta domina la CPU del worker con muchas sesiones
+concurrentes. `TokenCoalescer` acumula los tokens y emite un solo `stream_token` cuando
+pasa la ventana de tiempo o se junta el tamaño configurado.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List
+
+from utils.logger import logger
+
+# Ventana máxima entre envíos (milisegundos)
+STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", "30"))
+# Caracteres acumulados que fuerzan un envío inmediato
+STREAM_FLUSH_MAX_CHARS = int(os.getenv("STREAM_FLUSH_MAX_CHARS", "256"))
+
+_totals = {"respuestas": 0, "frames": 0, "tokens": 0, "caracteres": 0}
+_totals_lock = threading.Lock()
+
+
+class TokenCoalescer:
+    """Acumula tokens de un mensaje de Chainlit y los envía por lotes."""
+
+    def __init__(self, msg, interval_ms: float = STREAM_FLUSH_INTERVAL_MS,
+                 max_chars: int = STREAM_FLUSH_MAX_CHARS):
+        self.msg = msg
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._ticker = None
+        self.frames_sent = 0
+        self.tokens_received = 0
+
+    async def __aenter__(self) -> "TokenCoalescer":
+        # Un tick periódico envía lo pendiente aunque no lleguen más tokens (p. ej. mientras corre una herramienta)
+        self._ticker = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def push(self, token: str) -> None:
+        if not token:
+            return
+        self._parts.append(token)
+        self._pending.append(token)
+        self._pending_chars += len(token)
+        self.tokens_received += 1
+        if self._pending_chars >= self.max_chars or time.monotonic() - self._last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            chunk = "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+            self._last_flush = time.monotonic()
+            self.frames_sent += 1
+            await self.msg.stream_token(chunk)
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._pending and time.monotonic() - self._last_flush >= self.interval:
+                await self.flush()
+
+    async def close(self) -> None:
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        await self.flush()
+        with _totals_lock:
+            _totals["respuestas"] += 1
+            _totals["frames"] += self.frames_sent
+            _totals["tokens"] += self.tokens_received
+            _totals["caracteres"] += len(self.text)
+        logger.info("Respuesta enviada: {} tokens en {} frames ({} caracteres)",
+                    self.tokens_received, self.frames_sent, len(self.text))
+
+    @property
+    def text(self) -> str:
+        """Texto completo de la respuesta (se arma una sola vez al final)."""
+        return "".join(self._parts)
+
+
+def streaming_stats() -> Dict[str, float]:
+    """Totales de streaming y frames promedio por respuesta."""
+    with _totals_lock:
+        stats: Dict[str, float] = dict(_totals)
+    stats["frames_por_respuesta"] = stats["frames"] / stats["respuestas"] if stats["respuestas"] else 0.0
+    return stats
@@ -0,0 +1,62 @@
+"""
+Mide latencia y número de peticiones de `AssistantAgent` contra el servidor mock, sin red.
+
+Uso:
+    python -m bench.assistant_latency --queries 5 --latency-ms 40 --token-delay-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from openai import AsyncOpenAI
+
+from bench.mock_openai_server import start_server
+
+
+async def _measure(queries: int, session_id: str, base_url: str) -> dict:
+    from app.openai_agent import AssistantAgent
+
+    # Sin archivo de ID: cada corrida mide también la creación del asistente
+    agent = AssistantAgent(client_override=AsyncOpenAI(api_key="mock", base_url=base_url), id_file=None)
+    first_token, totals = [], []
+    prompts = ["¿Qué archivos Excel hay disponibles?"] + ["Resume los datos de ventas"] * (queries - 1)
+    for prompt in prompts[:queries]:
+        start = time.perf_counter()
+        first = None
+        async for _ in agent.arun(prompt, session_id=session_id):
+            if first is None:
+                first = time.perf_counter() - start
+        totals.append(time.perf_counter() - start)
+        first_token.append(first or 0.0)
+    return {
+        "consultas": queries,
+        "primer_token_ms": [round(t * 1000, 1) for t in first_token],
+        "total_ms": [round(t * 1000, 1) for t in totals],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latencia de AssistantAgent contra el mock de OpenAI.")
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--token-delay-ms", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    server, state = start_server(latency_ms=args.latency_ms, token_delay_ms=args.token_delay_ms)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    try:
+        result = asyncio.run(_measure(args.queries, "bench-session", base_url))
+    finally:
+        server.shutdown()
+    with state.lock:
+        result["peticiones"] = dict(state.requests)
+        result["peticiones_totales"] = sum(state.requests.values())
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Verifica el presupuesto de tiempo de importación del arranque en frío.
+
+Importa el módulo en un intérprete nuevo con `python -X importtime`, suma el tiempo
+acumulado de los imports de primer nivel y lista los más costosos. Falla (código 1) si se
+excede el presupuesto o si se importó alguno de los módulos pesados que deben cargarse
+de forma perezosa.
+
+Uso:
+    python -m bench.import_time --module app.chainlit_app --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Presupuesto por defecto del arranque (milisegundos)
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+# Módulos que no deben cargarse al arrancar: se importan en el primer uso o en el calentamiento
+FORBIDDEN_AT_STARTUP = ("pandas", "pandasai", "langchain", "pyarrow", "tiktoken", "agents", "duckdb")
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Líneas de `-X importtime` como dicts: módulo, propio_us, acumulado_us y profundidad."""
+    rows = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            rows.append({"modulo": match.group(4), "propio_us": int(match.group(1)),
+                         "acumulado_us": int(match.group(2)), "profundidad": len(match.group(3)) // 2})
+    return rows
+
+
+def measure(module: str) -> List[Dict]:
+    env = dict(os.environ, WARMUP_ON_START="false", METRICS_PORT="0")
+    # El calentamiento y el endpoint de métricas se desactivan: solo interesa el costo de importar
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    rows = parse_importtime(proc.stderr)
+    if proc.returncode != 0:
+        error = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError("\n".join(error[-5:]) or f"El import de {module} falló")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Presupuesto de tiempo de importación del arranque.")
+    parser.add_argument("--module", default="app.chainlit_app")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="Imports más costosos a mostrar")
+    parser.add_argument("--allow", action="append", default=[],
+                        help="Módulo pesado permitido al arrancar (se puede repetir)")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = measure(args.module)
+    except RuntimeError as e:
+        print(f"[Error] {e}", file=sys.stderr)
+        return 2
+    total_ms = sum(r["acumulado_us"] for r in rows if r["profundidad"] == 0) / 1000
+    imported = {r["modulo"] for r in rows}
+    forbidden = sorted(m for m in FORBIDDEN_AT_STARTUP if m in imported and m not in args.allow)
+    # Imports directos del módulo (y de los paquetes que lo contienen), del más costoso al menos
+    top = sorted((r for r in rows if r["profundidad"] == 1), key=lambda r: r["acumulado_us"], reverse=True)
+    report = {
+        "modulo": args.module,
+        "total_ms": round(total_ms, 1),
+        "presupuesto_ms": args.budget_ms,
+        "modulos_importados": len(imported),
+        "pesados_importados": forbidden,
+        "mas_costosos": [{"modulo": r["modulo"], "ms": round(r["acumulado_us"] / 1000, 1)} for r in top[:args.top]],
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    ok = total_ms <= args.budget_ms and not forbidden
+    if not ok:
+        print("El arranque excede el presupuesto o importa módulos pesados.", file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Servidor mock de la API de Assistants de OpenAI para pruebas sin red.
+
+Implementa lo que usa `app/openai_agent.AssistantAgent` (asistentes, threads, mensajes,
+runs con streaming SSE y envío de resultados de herramientas), con latencia configurable
+por petición y por token, y cuenta las peticiones recibidas por ruta.
+
+Uso:
+    python -m bench.mock_openai_server --port 8765 --latency-ms 40 --token-delay-ms 5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock chainlit run ...
+
+    GET  /_stats  -> peticiones por ruta
+    POST /_reset  -> reinicia contadores y estado
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Si el mensaje del usuario contiene alguna de estas palabras, el mock pide herramientas
+_TOOL_TRIGGERS = {
+    "listar_archivos_excel": ("archivos", "files", "lista"),
+    "metadata_archivos_excel": ("metadata", "detalles"),
+}
+
+
+class MockState:
+    def __init__(self, latency_ms: float = 0.0, token_delay_ms: float = 0.0,
+                 response_text: str = "Esta es una respuesta simulada del asistente sobre tus archivos Excel."):
+        self.latency = latency_ms / 1000.0
+        self.token_delay = token_delay_ms / 1000.0
+        self.response_text = response_text
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests: Counter = Counter()
+            self.threads: Dict[str, List[Dict]] = {}
+            self.runs: Dict[str, Dict] = {}
+            self._ids = itertools.count(1)
+
+    def next_id(self, prefix: str) -> str:
+        with self.lock:
+            return f"{prefix}_mock{next(self._ids)}"
+
+
+def _route_name(method: str, path: str) -> str:
+    """Normaliza la ruta quitando los IDs para agrupar los contadores."""
+    return f"{method} " + re.sub(r"/(asst|thread|run|msg|call)_mock\d+", r"/{\1}", path.split("?")[0])
+
+
+def _run_object(run_id: str, thread_id: str, assistant_id: str, status: str, required_action=None) -> Dict:
+    return {
+        "id": run_id, "object": "thread.run", "created_at": int(time.time()), "thread_id": thread_id,
+        "assistant_id": assistant_id, "status": status, "required_action": required_action,
+        "model": "gpt-4o", "instructions": "", "tools": [], "metadata": {}, "parallel_tool_calls": True,
+    }
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        # --- utilidades ---
+        def _body(self) -> Dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        def _json(self, payload: Dict, status: int = 200) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _start_sse(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+        def _event(self, name: str, data) -> None:
+            payload = data if isinstance(data, str) else json.dumps(data)
+            self.wfile.write(f"event: {name}\ndata: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def _count(self) -> None:
+            with state.lock:
+                state.requests[_route_name(self.command, self.path)] += 1
+            if state.latency:
+                time.sleep(state.latency)
+
+        # --- rutas ---
+        def do_GET(self):
+            if self.path == "/_stats":
+                with state.lock:
+                    return self._json({"requests": dict(state.requests), "total": sum(state.requests.values())})
+            self._count()
+            match = re.fullmatch(r"/v1/assistants/([\w-]+)", self.path)
+            if match:
+                return self._json({"id": match.group(1), "object": "assistant", "created_at": 0,
+                                   "model": "gpt-4o", "name": "Excel Analyzer", "tools": []})
+            self._json({"error": {"message": f"Ruta no soportada: {self.path}"}}, 404)
+
+        def do_POST(self):
+            if self.path == "/_reset":
+                state.reset()
+                return self._json({"ok": True})
+            self._count()
+            body = self._body()
+            path = self.path.split("?")[0]
+
+            if path == "/v1/assistants":
+                return self._json({"id": state.next_id("asst"), "object": "assistant", "created_at": 0,
+                                   "model": body.get("model", "gpt-4o"), "name": body.get("name"), "tools": []})
+            if path == "/v1/threads":
+                thread_id = state.next_id("thread")
+                with state.lock:
+                    state.threads[thread_id] = []
+                return self._json({"id": thread_id, "object": "thread", "created_at": 0, "metadata": {}})
+
+            match = re.fullmatch(r"/v1/threads/([\w-]+)/messages", path)
+            if match:
+                thread_id = match.group(1)
+                message = {"id": state.next_id("msg"), "object": "thread.message", "thread_id": thread_id,
+                           "role": body.get("role", "user"), "created_at": 0, "status": "completed",
+                           "content": [{"type": "text", "text": {"value": body.get("content", ""), "annotations": []}}]}
+                with state.lock:
+                    state.threads.setdefault(thread_id, []).append(message)
+                return self._json(message)
+
+            match = re.fullmatch(r"/v1/threads/([\w-]+)/runs", path)
+            if match:
+                return self._stream_run(match.group(1), body.get("assistant_id", ""))
+
+            match = re.fullmatch(r"/v1/threads/([\w-]+)/runs/([\w-]+)/submit_tool_outputs", path)
+            if match:
+                thread_id, run_id = match.groups()
+                with state.lock:
+                    run = state.runs.get(run_id, {"assistant_id": ""})
+                return self._stream_answer(thread_id, run_id, run["assistant_id"], body.get("tool_outputs", []))
+
+            self._json({"error": {"message": f"Ruta no soportada: {self.path}"}}, 404)
+
+        def _requested_tools(self, thread_id: str) -> List[str]:
+            with state.lock:
+                messages = state.threads.get(thread_id, [])
+                last = messages[-1]["content"][0]["text"]["value"].lower() if messages else ""
+            return [name for name, words in _TOOL_TRIGGERS.items() if any(w in last for w in words)]
+
+        def _stream_run(self, thread_id: str, assistant_id: str) -> None:
+            run_id = state.next_id("run")
+            with state.lock:
+                state.runs[run_id] = {"assistant_id": assistant_id}
+            self._start_sse()
+            self._event("thread.run.created", _run_object(run_id, thread_id, assistant_id, "queued"))
+            self._event("thread.run.in_progress", _run_object(run_id, thread_id, assistant_id, "in_progress"))
+            requested = self._requested_tools(thread_id)
+            if requested:
+                tool_calls = [{"id": state.next_id("call"), "type": "function",
+                               "function": {"name": name, "arguments": "{}"}} for name in requested]
+                required = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}}
+                self._event("thread.run.requires_action",
+                            _run_object(run_id, thread_id, assistant_id, "requires_action", required))
+                self._event("done", "[DONE]")
+                return
+            self._emit_answer(thread_id, run_id, assistant_id, state.response_text)
+
+        def _stream_answer(self, thread_id: str, run_id: str, assistant_id: str, tool_outputs: List[Dict]) -> None:
+            self._start_sse()
+            summary = " ".join(str(o.get("output", ""))[:80] for o in tool_outputs)
+            self._emit_answer(thread_id, run_id, assistant_id, f"Resultado de las herramientas: {summary}")
+
+        def _emit_answer(self, thread_id: str, run_id: str, assistant_id: str, text: str) -> None:
+            message_id = state.next_id("msg")
+            for word in re.findall(r"\S+\s*", text):
+                if state.token_delay:
+                    time.sleep(state.token_delay)
+                self._event("thread.message.delta", {
+                    "id": message_id, "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word}}]},
+                })
+            self._event("thread.run.completed", _run_object(run_id, thread_id, assistant_id, "completed"))
+            self._event("done", "[DONE]")
+
+    return Handler
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 token_delay_ms: float = 0.0, state: Optional[MockState] = None):
+    """Arranca el servidor en un hilo y devuelve (server, state). Con port=0 se elige un puerto libre."""
+    state = state or MockState(latency_ms, token_delay_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor mock de la API de Assistants de OpenAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia añadida a cada petición")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="Pausa entre tokens del streaming")
+    args = parser.parse_args(argv)
+    state = MockState(args.latency_ms, args.token_delay_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Mock de OpenAI escuchando en http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
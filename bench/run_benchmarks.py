@@ -0,0 +1,269 @@
+"""
+Suite de benchmarks reproducible de la ruta de datos, sin red.
+
+Mide, sobre libros sintéticos deterministas:
+- lectura con `pd.read_excel` y con la ruta de carga de la app (`read_excel_cached`, en frío y en caliente),
+- latencia de `PandasAITool._run` con un LLM stub (en frío y con la caché de resultados),
+- escalado de `list_excel_files` / `get_excel_files_metadata` con el número de archivos,
+- pico de memoria (RSS) de cada caso; cada caso corre en un proceso nuevo para aislarlo.
+
+Uso:
+    python -m bench.run_benchmarks --profile rapido --output bench_actual.json
+    python -m bench.run_benchmarks --output bench_nuevo.json --baseline bench_actual.json --threshold 0.2
+
+Con `--baseline` se compara contra un JSON anterior y el proceso sale con código 1 si algún
+caso es más lento (o usa más memoria) que la línea base por encima del umbral.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bench.synthetic import WorkbookSpec, populate_directory, write_workbook
+
+PROFILES = {
+    "rapido": {
+        "workbooks": [WorkbookSpec(2_000, 10, "mixto"), WorkbookSpec(20_000, 10, "numerico"),
+                      WorkbookSpec(5_000, 8, "texto", sheets=3)],
+        "listing": [100, 1_000],
+        "repeats": 3,
+    },
+    "completo": {
+        "workbooks": [WorkbookSpec(2_000, 10, "mixto"), WorkbookSpec(100_000, 20, "numerico"),
+                      WorkbookSpec(100_000, 20, "mixto"), WorkbookSpec(20_000, 12, "texto", sheets=5)],
+        "listing": [100, 1_000, 10_000],
+        "repeats": 5,
+    },
+}
+
+# Métricas que se comparan contra la línea base (más alto = peor)
+# y diferencia absoluta mínima para considerarla (evita falsas alarmas por ruido en casos de microsegundos)
+COMPARED_METRICS = {"mediana_s": 0.005, "rss_pico_mb": 5.0}
+BENCH_INSTRUCTION = "Dame un resumen estadístico de todas las columnas"
+
+
+def _reset_peak_rss() -> None:
+    # El pico de RSS se hereda del proceso padre al crear el hijo; en Linux se puede reiniciar
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(func: Callable[[], object], repeats: int) -> Dict[str, float]:
+    times: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"mediana_s": round(statistics.median(times), 5), "min_s": round(min(times), 5),
+            "repeticiones": repeats}
+
+
+def _remove_sidecars(path: str) -> None:
+    from utils.sidecar import sidecar_paths
+
+    for sheet in (0, "Hoja1"):
+        for sidecar in sidecar_paths(path, sheet).values():
+            try:
+                os.remove(sidecar)
+            except OSError:
+                pass
+
+
+# --- Casos; cada uno se ejecuta en un proceso nuevo con cwd = workdir ---
+
+def _case_read_excel(workdir: str, file_name: str, repeats: int) -> Dict:
+    import pandas as pd
+
+    os.chdir(workdir)
+    result = _timed(lambda: pd.read_excel(os.path.join("data", file_name)), repeats)
+    result["rss_pico_mb"] = _peak_rss_mb()
+    return result
+
+
+def _case_load_path(workdir: str, file_name: str, repeats: int, warm: bool) -> Dict:
+    os.chdir(workdir)
+    from utils.dataframe_cache import dataframe_cache, read_excel_cached
+
+    path = os.path.join("data", file_name)
+
+    def load():
+        if not warm:
+            # En frío: sin caché en memoria ni sidecar en disco
+            dataframe_cache.clear()
+            _remove_sidecars(path)
+        read_excel_cached(path)
+
+    if warm:
+        load()
+    result = _timed(load, repeats)
+    result["rss_pico_mb"] = _peak_rss_mb()
+    return result
+
+
+def _case_pandasai_tool(workdir: str, file_name: str, repeats: int, warm: bool, llm_latency_s: float) -> Dict:
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    try:
+        import tools.pandasai_tool as pandasai_tool
+        from bench.stub_llm import StubLLM
+    except ImportError as e:
+        return {"omitido": f"dependencia no disponible: {e}"}
+    from utils.dataframe_cache import dataframe_cache
+    from utils.llm_scheduler import pandasai_llms
+    from utils.result_cache import result_cache
+
+    # La herramienta toma el LLM del pool: el stub se crea ahí para que sus llamadas sigan pasando por el planificador
+    pandasai_llms._new_llm = lambda api_key: StubLLM(api_key, latency_s=llm_latency_s)
+    tool = pandasai_tool.PandasAITool()
+    query = f"{file_name}: {BENCH_INSTRUCTION}"
+
+    def run():
+        if not warm:
+            dataframe_cache.clear()
+            _remove_sidecars(os.path.join("data", file_name))
+            result_cache.clear()
+        output = tool._run(query)
+        if isinstance(output, str) and output.startswith("[Error]"):
+            raise RuntimeError(output)
+
+    if warm:
+        run()
+    result = _timed(run, repeats)
+    result["rss_pico_mb"] = _peak_rss_mb()
+    return result
+
+
+def _case_listing(workdir: str, directory: str, repeats: int, warm: bool) -> Dict:
+    os.chdir(workdir)
+    from utils.file_manager import get_directory_index, get_excel_files_metadata, list_excel_files
+
+    if warm:
+        list_excel_files(directory)
+        result = _timed(lambda: (list_excel_files(directory), get_excel_files_metadata(directory, limit=200)),
+                        repeats)
+    else:
+        # En frío: se reescanea el directorio completo en cada repetición
+        index = get_directory_index(directory)
+        result = _timed(lambda: (index.rescan(), index.names()), repeats)
+    result["rss_pico_mb"] = _peak_rss_mb()
+    return result
+
+
+def _isolated(func: Callable, *args) -> Dict:
+    """Ejecuta un caso en un proceso recién creado para que el pico de RSS sea solo suyo."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"), initializer=_reset_peak_rss) as pool:
+        try:
+            return pool.submit(func, *args).result()
+        except Exception as e:
+            return {"error": str(e)}
+
+
+def run_suite(profile: str, workdir: str, llm_latency_s: float) -> Dict[str, Dict]:
+    config = PROFILES[profile]
+    repeats = config["repeats"]
+    data_dir = os.path.join(workdir, "data")
+    results: Dict[str, Dict] = {}
+
+    for spec in config["workbooks"]:
+        write_workbook(spec, data_dir)
+        base = spec.name[:-len(".xlsx")]
+        print(f"- {base}", file=sys.stderr)
+        results[f"read_excel/{base}"] = _isolated(_case_read_excel, workdir, spec.name, repeats)
+        results[f"carga_frio/{base}"] = _isolated(_case_load_path, workdir, spec.name, repeats, False)
+        results[f"carga_caliente/{base}"] = _isolated(_case_load_path, workdir, spec.name, repeats, True)
+        results[f"pandasai_frio/{base}"] = _isolated(
+            _case_pandasai_tool, workdir, spec.name, repeats, False, llm_latency_s)
+        results[f"pandasai_caliente/{base}"] = _isolated(
+            _case_pandasai_tool, workdir, spec.name, repeats, True, llm_latency_s)
+
+    template = write_workbook(WorkbookSpec(10, 3, "mixto"), os.path.join(workdir, "plantilla"))
+    for count in config["listing"]:
+        directory = os.path.join(workdir, f"listado_{count}")
+        populate_directory(directory, count, template)
+        print(f"- listado {count} archivos", file=sys.stderr)
+        results[f"listado_frio/{count}"] = _isolated(_case_listing, workdir, directory, repeats, False)
+        results[f"listado_caliente/{count}"] = _isolated(_case_listing, workdir, directory, repeats, True)
+    return results
+
+
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """Casos cuya métrica empeoró más de `threshold` (fracción) respecto a la línea base."""
+    regressions = []
+    for name, metrics in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, min_delta in COMPARED_METRICS.items():
+            new, old = metrics.get(metric), base.get(metric)
+            if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            change = (new - old) / old
+            if change > threshold and new - old > min_delta:
+                regressions.append(f"{name} {metric}: {old} -> {new} (+{change:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de carga, análisis y listado de archivos Excel.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="rapido")
+    parser.add_argument("--workdir", default=os.path.join("bench", ".work"),
+                        help="Directorio donde se generan los libros sintéticos (se reutilizan entre corridas)")
+    parser.add_argument("--output", help="Ruta del JSON de resultados (por defecto solo se imprime)")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Empeoramiento relativo permitido frente a la línea base (0.2 = 20%%)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="Latencia simulada del LLM stub por llamada")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir)
+    report = {
+        "meta": {"perfil": args.profile, "python": platform.python_version(), "plataforma": platform.platform(),
+                 "cpus": os.cpu_count(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "resultados": run_suite(args.profile, workdir, args.llm_latency_ms / 1000),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)["resultados"]
+        regressions = compare(report["resultados"], baseline, args.threshold)
+        if regressions:
+            print("Regresiones frente a la línea base:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("Sin regresiones frente a la línea base.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+LLM determinista y sin red para los benchmarks.
+
+Sustituye a `pandasai.llm.OpenAI` en el pool de LLMs de las herramientas: siempre devuelve el mismo
+código (un resumen estadístico del primer DataFrame) tras una latencia fija configurable,
+de modo que las mediciones reflejan el costo del lado de la aplicación.
+"""
+import time
+
+from pandasai.llm.base import LLM
+
+STUB_CODE = """```python
+import pandas as pd
+
+df = dfs[0]
+result = {"type": "dataframe", "value": df.describe(include="all").reset_index()}
+```"""
+
+
+class StubLLM(LLM):
+    """LLM de PandasAI que responde siempre con `STUB_CODE`."""
+
+    def __init__(self, api_token: str = "stub", latency_s: float = 0.0, **kwargs):
+        self.api_token = api_token
+        self.latency_s = latency_s
+        self.calls = 0
+
+    @property
+    def type(self) -> str:
+        return "stub"
+
+    def call(self, instruction, context=None, *args, **kwargs) -> str:
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return STUB_CODE
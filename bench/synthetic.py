@@ -0,0 +1,90 @@
+"""
+Generador determinista de libros de Excel sintéticos para los benchmarks.
+
+Cada especificación fija filas, columnas, mezcla de tipos y número de hojas; con la misma
+semilla siempre se genera el mismo contenido.
+"""
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# Mezclas de tipos disponibles: proporción de columnas de cada tipo
+DTYPE_MIXES: Dict[str, Dict[str, float]] = {
+    "numerico": {"int": 0.5, "float": 0.5},
+    "mixto": {"int": 0.25, "float": 0.25, "categoria": 0.2, "texto": 0.1, "fecha": 0.1, "bool": 0.1},
+    "texto": {"categoria": 0.6, "texto": 0.4},
+}
+
+_CATEGORIES = ["Norte", "Sur", "Centro", "Occidente", "Noreste", "Sureste", "Bajío", "Península"]
+
+
+@dataclass(frozen=True)
+class WorkbookSpec:
+    rows: int
+    cols: int
+    mix: str = "mixto"
+    sheets: int = 1
+    seed: int = 42
+
+    @property
+    def name(self) -> str:
+        return f"sint_{self.rows}x{self.cols}_{self.mix}_{self.sheets}h.xlsx"
+
+
+def _column_types(cols: int, mix: str) -> List[str]:
+    weights = DTYPE_MIXES[mix]
+    types: List[str] = []
+    for kind, share in weights.items():
+        types.extend([kind] * max(1, round(cols * share)))
+    return (types * (cols // len(types) + 1))[:cols]
+
+
+def make_frame(rows: int, cols: int, mix: str = "mixto", seed: int = 42) -> pd.DataFrame:
+    """DataFrame sintético con la mezcla de tipos indicada."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i, kind in enumerate(_column_types(cols, mix)):
+        name = f"{kind}_{i}"
+        if kind == "int":
+            data[name] = rng.integers(0, 10_000, rows)
+        elif kind == "float":
+            data[name] = rng.normal(1_000, 250, rows).round(2)
+        elif kind == "categoria":
+            data[name] = rng.choice(_CATEGORIES, rows)
+        elif kind == "texto":
+            data[name] = [f"registro-{v}" for v in rng.integers(0, rows * 10 + 1, rows)]
+        elif kind == "fecha":
+            data[name] = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2_000, rows), unit="D")
+        else:
+            data[name] = rng.integers(0, 2, rows).astype(bool)
+    return pd.DataFrame(data)
+
+
+def write_workbook(spec: WorkbookSpec, directory: str) -> str:
+    """Escribe el libro en `directory` (si no existe ya) y devuelve su ruta."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, spec.name)
+    if os.path.exists(path):
+        return path
+    with pd.ExcelWriter(path) as writer:
+        for sheet in range(spec.sheets):
+            df = make_frame(spec.rows, spec.cols, spec.mix, spec.seed + sheet)
+            df.to_excel(writer, sheet_name=f"Hoja{sheet + 1}", index=False)
+    return path
+
+
+def populate_directory(directory: str, count: int, template: str) -> None:
+    """Llena un directorio con `count` copias (enlaces duros si es posible) de un libro pequeño."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        target = os.path.join(directory, f"archivo_{i:06d}.xlsx")
+        if os.path.exists(target):
+            continue
+        try:
+            os.link(template, target)
+        except OSError:
+            with open(template, "rb") as src, open(target, "wb") as dst:
+                dst.write(src.read())
@@ -0,0 +1,91 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.async_executor as async_executor
+from utils.async_executor import executor_stats, run_tool_async
+
+_request = contextvars.ContextVar("request", default=None)
+
+
+def test_tools_run_off_the_event_loop_with_the_caller_context():
+    loop_thread = threading.get_ident()
+
+    def tool(value):
+        time.sleep(0.2)
+        return threading.get_ident(), _request.get(), value
+
+    async def main():
+        _request.set("req-1")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await run_tool_async("prueba_contexto", tool, value=3)
+        task.cancel()
+        return result, ticks
+
+    (thread, request, value), ticks = asyncio.run(main())
+    assert thread != loop_thread and request == "req-1" and value == 3
+    # El event loop siguió atendiendo mientras el hilo dormía
+    assert ticks >= 5
+    assert executor_stats()["prueba_contexto"]["completadas"] == 1
+
+
+def test_concurrency_is_limited_per_tool(monkeypatch):
+    monkeypatch.setattr(async_executor, "TOOL_CONCURRENCY", 2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def tool():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    async def main():
+        await asyncio.gather(*(run_tool_async("prueba_limite", tool) for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak[0] == 2
+    stats = executor_stats()["prueba_limite"]
+    assert stats["completadas"] == 6 and stats["max_en_cola"] >= 4 and stats["en_cola"] == 0
+
+
+def test_cancelled_and_failed_runs_are_counted(monkeypatch):
+    monkeypatch.setattr(async_executor, "TOOL_CONCURRENCY", 1)
+    release = threading.Event()
+
+    def fail():
+        raise ValueError("roto")
+
+    async def main():
+        busy = asyncio.create_task(run_tool_async("prueba_cancelar", release.wait, 5))
+        waiting = asyncio.create_task(run_tool_async("prueba_cancelar", time.sleep, 0))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        release.set()
+        await busy
+        with pytest.raises(ValueError):
+            await run_tool_async("prueba_fallo", fail)
+
+    asyncio.run(main())
+    stats = executor_stats()
+    assert stats["prueba_cancelar"]["canceladas"] == 1 and stats["prueba_cancelar"]["completadas"] == 1
+    assert stats["prueba_cancelar"]["en_cola"] == 0 and stats["prueba_cancelar"]["en_ejecucion"] == 0
+    assert stats["prueba_fallo"]["fallidas"] == 1
@@ -0,0 +1,93 @@
+import os
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.code_sandbox as code_sandbox
+from utils.code_sandbox import (SandboxExecutionError, SandboxLimitExceeded, SandboxPool, SandboxResultError,
+                                SandboxSecurityError, chat_with_sandbox)
+
+_FRAME = pd.DataFrame({"region": ["Norte", "Sur", "Norte"], "total": [1.0, 2.0, 3.5]})
+_GROUPED = ("result = {'type': 'dataframe', "
+            "'value': dfs[0].groupby('region', as_index=False)['total'].sum()}")
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SandboxPool(workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_generated_code_runs_in_the_pool(pool):
+    result = pool.run(_GROUPED, _FRAME)
+    assert result["value"]["total"].tolist() == [4.5, 2.0]
+    assert pool.stats()["ejecutados"] >= 1
+
+
+@pytest.mark.parametrize("code, error", [
+    ("x = dfs[0]['total'].sum()", SandboxResultError),
+    ("import os\nresult = {'type': 'string', 'value': os.getcwd()}", SandboxSecurityError),
+    ("result = {'type': 'string', 'value': dfs[0].__class__}", SandboxSecurityError),
+    ("result = {'type': 'string', 'value': open('x').read()}", SandboxExecutionError),
+    ("result = {'type': 'number', 'value': dfs[0]['monto'].sum()}", SandboxExecutionError),
+])
+def test_failures_are_reported_by_kind(pool, code, error):
+    with pytest.raises(error):
+        pool.run(code, _FRAME)
+
+
+def test_wall_clock_limit_replaces_the_worker(pool):
+    with pytest.raises(SandboxLimitExceeded):
+        pool.run("while True:\n    pass", _FRAME, wall_seconds=0.5)
+    # El worker reemplazado sigue atendiendo trabajos
+    assert pool.run(_GROUPED, _FRAME)["type"] == "dataframe"
+
+
+@pytest.fixture
+def fake_pandasai(monkeypatch, pool):
+    """`pandasai` no está instalado en las pruebas: un Agent falso devuelve código preparado."""
+    prompts, answers = [], []
+
+    class Agent:
+        def __init__(self, df, config=None):
+            self.df = df
+
+        def generate_code(self, prompt):
+            prompts.append(prompt)
+            return answers.pop(0)
+
+    module = types.ModuleType("pandasai")
+    module.Agent = Agent
+    module.SmartDataframe = None
+    monkeypatch.setitem(sys.modules, "pandasai", module)
+    monkeypatch.setattr(code_sandbox, "sandbox_pool", pool)
+    monkeypatch.setattr(code_sandbox, "SANDBOX_ENABLED", True)
+    return prompts, answers
+
+
+def test_chat_returns_the_parsed_result(fake_pandasai):
+    prompts, answers = fake_pandasai
+    answers.append(_GROUPED)
+
+    result = chat_with_sandbox(_FRAME, "total por region", llm=None)
+
+    assert isinstance(result, pd.DataFrame) and result["total"].tolist() == [4.5, 2.0]
+    assert prompts == ["total por region"]
+
+
+def test_chat_asks_for_a_correction_once(fake_pandasai):
+    prompts, answers = fake_pandasai
+    answers.extend(["x = 1", "result = {'type': 'number', 'value': dfs[0]['total'].max()}"])
+
+    assert chat_with_sandbox(_FRAME, "maximo", llm=None) == 3.5
+    assert len(prompts) == 2 and "result = {'type'" in prompts[1]
+
+    answers.extend(["import subprocess", "import subprocess"])
+    with pytest.raises(SandboxSecurityError):
+        chat_with_sandbox(_FRAME, "maximo", llm=None)
+    assert "sin importar otros módulos" in prompts[-1]
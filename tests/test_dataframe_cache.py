@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.dataframe_cache import DataFrameCache, dataframe_cache, file_fingerprint, read_excel_cached
+from utils.shared_cache import shared_cache
+
+
+@pytest.fixture(autouse=True)
+def local_cache(monkeypatch):
+    # Sin el nivel compartido en /dev/shm: cada prueba ve solo la caché del proceso
+    monkeypatch.setattr(shared_cache, "enabled", False)
+    dataframe_cache.clear()
+    yield
+    dataframe_cache.clear()
+
+
+def _write_book(path, resumen=3):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({"monto": [1, 2]}).to_excel(writer, sheet_name="Ventas", index=False)
+        pd.DataFrame({"total": [resumen]}).to_excel(writer, sheet_name="Resumen", index=False)
+
+
+def test_first_sheet_by_index_and_by_name_share_one_entry(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+
+    assert file_fingerprint(path, 0) == file_fingerprint(path, "Ventas")
+    assert read_excel_cached(path, 0) is read_excel_cached(path, "Ventas")
+    assert dataframe_cache.stats()["entries"] == 1
+    assert len([f for f in os.listdir(tmp_path / ".cache") if f.endswith(".arrow")]) == 1
+
+
+def test_hit_returns_cached_frame_without_copying(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+
+    first = read_excel_cached(path)
+    assert read_excel_cached(path) is first
+    assert dataframe_cache.stats()["hits"] >= 1
+    assert first["monto"].tolist() == [1, 2]
+
+
+def test_fingerprint_only_changes_for_the_rewritten_sheet(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+    ventas, resumen = file_fingerprint(path, "Ventas"), file_fingerprint(path, "Resumen")
+
+    _write_book(path, resumen=4)
+
+    assert file_fingerprint(path, "Ventas") == ventas
+    assert file_fingerprint(path, "Resumen") != resumen
+    assert read_excel_cached(path, "Resumen")["total"].tolist() == [4]
+
+
+def test_eviction_by_total_bytes_and_replacement_of_old_versions():
+    cache = DataFrameCache(max_bytes=3000)
+    frame = pd.DataFrame({"x": range(100)})  # 800 bytes
+    for i in range(4):
+        cache.put((f"/data/{i}.xlsx", "v1", 0), frame)
+    assert cache.stats()["entries"] == 3
+    assert cache.get(("/data/0.xlsx", "v1", 0)) is None
+
+    cache.put(("/data/3.xlsx", "v2", 0), frame)
+    assert cache.get(("/data/3.xlsx", "v1", 0)) is None
+    assert cache.get(("/data/3.xlsx", "v2", 0)) is frame
+    # Más grande que toda la caché: no se guarda
+    cache.put(("/data/grande.xlsx", "v1", 0), pd.DataFrame({"x": range(1000)}))
+    assert ("/data/grande.xlsx", "v1", 0) not in cache
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.excel_stream import aggregate_excel
+
+
+def test_aggregate_column_numeric_in_one_chunk_and_text_in_another(tmp_path):
+    path = tmp_path / "mixta.xlsx"
+    pd.DataFrame({"valor": [1, 2, "x", "y"], "monto": [10, 20, 30, 40]}).to_excel(path, index=False)
+
+    resumen = aggregate_excel(str(path), 0, chunk_rows=2).set_index("columna")
+
+    mixta = resumen.loc["valor"]
+    assert mixta["conteo"] == 4
+    assert pd.isna(mixta["suma"]) and pd.isna(mixta["minimo"]) and pd.isna(mixta["maximo"])
+    numerica = resumen.loc["monto"]
+    assert (numerica["suma"], numerica["minimo"], numerica["maximo"], numerica["media"]) == (100, 10, 40, 25)
@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.export_engine as export_engine
+from utils.export_engine import ExportJobs, export_dataframe, write_result, xlsx_sheet_count
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        "region": ["Norte", "Sur", None] * 4,
+        "total": [1.5, 2.0, float("nan")] * 4,
+        "fecha": pd.date_range("2024-01-01", periods=12, freq="D"),
+    })
+
+
+@pytest.fixture(autouse=True)
+def exports_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(export_engine, "EXPORTS_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".feather", ".xlsx"])
+def test_every_format_round_trips_without_leaving_temporaries(frame, exports_dir, extension):
+    path = write_result(frame, str(exports_dir / f"resultado{extension}"))
+
+    if extension == ".csv":
+        back = pd.read_csv(path, parse_dates=["fecha"])
+    elif extension == ".parquet":
+        back = pd.read_parquet(path)
+    elif extension == ".feather":
+        back = pd.read_feather(path)
+    else:
+        back = pd.read_excel(path)
+    assert back["total"].sum() == frame["total"].sum()
+    assert back["region"].isna().sum() == 4
+    assert list(back["fecha"].dt.day[:3]) == [1, 2, 3]
+    assert os.listdir(exports_dir) == [f"resultado{extension}"]
+
+
+def test_unsupported_extension_is_rejected(frame, exports_dir):
+    with pytest.raises(ValueError):
+        write_result(frame, str(exports_dir / "resultado.xls"))
+    assert os.listdir(exports_dir) == []
+
+
+def test_concurrent_exports_to_the_same_name_use_distinct_temporaries(exports_dir, monkeypatch):
+    temporaries, barrier = [], threading.Barrier(2)
+    original = export_engine._write_csv
+
+    def write_csv(df, path, progress):
+        temporaries.append(path)
+        barrier.wait(timeout=5)
+        original(df, path, progress)
+
+    monkeypatch.setattr(export_engine, "_write_csv", write_csv)
+    frames = [pd.DataFrame({"a": range(1000)}), pd.DataFrame({"a": range(1000, 2000)})]
+    threads = [threading.Thread(target=write_result, args=(f, str(exports_dir / "mismo.csv"))) for f in frames]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(temporaries)) == 2
+    assert pd.read_csv(exports_dir / "mismo.csv")["a"].tolist() in (list(range(1000)), list(range(1000, 2000)))
+    assert os.listdir(exports_dir) == ["mismo.csv"]
+
+
+def test_xlsx_beyond_the_row_limit_is_split_across_sheets(exports_dir, monkeypatch):
+    monkeypatch.setattr(export_engine, "XLSX_MAX_ROWS", 4)
+    df = pd.DataFrame({"n": range(7)})
+
+    job = export_dataframe(df, "grande.xlsx")
+
+    sheets = pd.read_excel(job["ruta"], sheet_name=None)
+    assert job["hojas"] == 3 == xlsx_sheet_count(7)
+    assert list(sheets) == ["Hoja1", "Hoja2", "Hoja3"]
+    assert pd.concat(sheets.values())["n"].tolist() == list(range(7))
+
+
+def test_failed_export_is_reported_in_the_job(exports_dir, monkeypatch):
+    monkeypatch.setattr(export_engine, "XLSX_MAX_COLUMNS", 1)
+    jobs = ExportJobs(workers=1)
+    job_id = jobs.submit(pd.DataFrame({"a": [1], "b": [2]}), "ancho.xlsx")
+    deadline = time.monotonic() + 5
+    while jobs.get(job_id)["estado"] not in ("completado", "error") and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    job = jobs.get(job_id)
+    assert job["estado"] == "error" and "columnas" in job["error"]
+    assert os.listdir(exports_dir) == []
+
+
+def test_finished_jobs_are_pruned_by_count_and_age(exports_dir):
+    jobs = ExportJobs(workers=1, max_finished=2)
+    ids = []
+    for i in range(4):
+        ids.append(jobs.submit(pd.DataFrame({"a": [i]}), f"r{i}.csv"))
+        deadline = time.monotonic() + 5
+        while jobs.get(ids[-1])["estado"] != "completado" and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert [jobs.get(i) is not None for i in ids] == [False, False, True, True]
+    jobs.ttl = -1
+    assert jobs.get(ids[-1]) is None and jobs.for_session(None, only_unnotified=False) == []
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.file_manager import DirectoryIndex
+
+
+def _touch(path, content=b"x"):
+    with open(path, "wb") as fh:
+        fh.write(content)
+
+
+@pytest.fixture
+def polling_index(monkeypatch, tmp_path):
+    # Sin inotify: el índice depende del mtime del directorio y del intervalo de sondeo
+    monkeypatch.setattr(DirectoryIndex, "_start_watcher", lambda self: None)
+    for name in ("ventas_2024.xlsx", "ventas_2025.xlsx", "clientes.xls", "notas.txt", "~$ventas_2025.xlsx"):
+        _touch(tmp_path / name)
+    return DirectoryIndex(str(tmp_path), poll_interval=3600)
+
+
+def test_lists_only_excel_files_sorted_filtered_and_paginated(polling_index):
+    assert polling_index.names() == ["clientes.xls", "ventas_2024.xlsx", "ventas_2025.xlsx"]
+    assert polling_index.names(prefix="ventas") == ["ventas_2024.xlsx", "ventas_2025.xlsx"]
+    assert polling_index.names(pattern="VENTAS_*.XLSX", offset=1, limit=1) == ["ventas_2025.xlsx"]
+    assert polling_index.get("clientes.xls")["tamano_bytes"] == 1
+    assert polling_index.get("notas.txt") is None
+
+
+def test_additions_are_seen_through_the_directory_mtime(polling_index, tmp_path):
+    assert len(polling_index) == 3
+    scans = polling_index.full_scans
+    path = tmp_path / "nuevo.xlsx"
+    _touch(path)
+    os.utime(tmp_path, ns=(time.time_ns() + 10 ** 9,) * 2)
+
+    assert "nuevo.xlsx" in polling_index.names()
+    assert polling_index.full_scans == scans + 1
+    # Sin cambios no se vuelve a escanear
+    polling_index.names()
+    assert polling_index.full_scans == scans + 1
+
+
+def test_listeners_receive_only_new_or_modified_files(polling_index, tmp_path):
+    seen = []
+    polling_index.add_listener(seen.append)
+    polling_index._update_one("ventas_2024.xlsx")
+    assert seen == []
+
+    _touch(tmp_path / "ventas_2024.xlsx", b"otro contenido")
+    polling_index._update_one("ventas_2024.xlsx")
+    os.remove(tmp_path / "clientes.xls")
+    polling_index._update_one("clientes.xls")
+
+    assert seen == ["ventas_2024.xlsx"]
+    assert "clientes.xls" not in polling_index.names()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify solo existe en Linux")
+def test_inotify_updates_the_index_without_rescanning(tmp_path):
+    index = DirectoryIndex(str(tmp_path))
+    assert index.names() == []
+    _touch(tmp_path / "informe.xlsx")
+    deadline = time.monotonic() + 5
+    while "informe.xlsx" not in index.names() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert index.names() == ["informe.xlsx"]
+    assert index.full_scans == 1 and index.incremental_updates >= 1
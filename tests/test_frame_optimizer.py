@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.frame_optimizer as frame_optimizer
+from utils.frame_optimizer import optimize_frame, widen_frame
+from utils.query_planner import QueryPlan, try_fast_path
+
+
+@pytest.fixture
+def raw():
+    rng = np.random.default_rng(7)
+    n = 200_000
+    return pd.DataFrame({
+        "region": rng.choice(["Norte", "Sur", "Este", "Oeste"], n).astype(object),
+        # Enteros + 0.5: exactos en float32, pero su suma no cabe en la mantisa de 24 bits
+        "monto": rng.integers(0, 100_000, n) + 0.5,
+        "unidades": rng.integers(0, 100, n),
+    })
+
+
+def test_compact_types_are_chosen(raw):
+    df = optimize_frame(raw)
+    assert isinstance(df["region"].dtype, pd.CategoricalDtype)
+    assert df["monto"].dtype == np.float32
+    assert df["unidades"].dtype == np.int8
+    assert df.memory_usage(deep=True).sum() < raw.memory_usage(deep=True).sum() / 4
+
+
+def test_fast_path_aggregates_match_float64_pandas(raw):
+    df = optimize_frame(raw)
+
+    grouped = try_fast_path("suma de monto por region", df).set_index("region")["monto"]
+    expected = raw.groupby("region")["monto"].sum()
+    assert grouped.dtype == np.float64
+    assert (grouped.sort_index() == expected.sort_index()).all()
+
+    assert try_fast_path("suma de monto", df) == raw["monto"].sum()
+    assert try_fast_path("promedio de monto", df) == raw["monto"].mean()
+    totals = QueryPlan(kind="aggregate_all", operation="sum").execute(df).set_index("columna")["sum"]
+    assert totals["monto"] == raw["monto"].sum() and totals["unidades"] == raw["unidades"].sum()
+    means = QueryPlan(kind="aggregate_all", operation="mean").execute(df).set_index("columna")["mean"]
+    assert means["monto"] == raw["monto"].mean()
+
+
+def test_widened_frame_restores_the_usual_types(raw):
+    wide = widen_frame(optimize_frame(raw))
+    assert wide["unidades"].dtype == np.int64 and wide["monto"].dtype == np.float64
+    # En int8 este producto desbordaría en silencio
+    assert (wide["unidades"] * 100).max() == raw["unidades"].max() * 100
+    pd.testing.assert_frame_equal(wide, raw, check_dtype=False)
+    assert wide["region"].fillna("N/A").iloc[0] == raw["region"].iloc[0]
+    filtered = wide[wide["region"] != "Norte"]
+    assert sorted(filtered.groupby("region").size().index) == ["Este", "Oeste", "Sur"]
+
+
+def test_lossy_floats_and_small_frames_are_left_alone(monkeypatch, raw):
+    raw["precio"] = np.linspace(0.1, 1.0, len(raw))
+    assert optimize_frame(raw)["precio"].dtype == np.float64
+    assert optimize_frame(raw.head(10)) is not None and optimize_frame(raw.head(10))["monto"].dtype == np.float64
+    monkeypatch.setattr(frame_optimizer, "DOWNCAST_MIN_INT_BITS", 64)
+    assert optimize_frame(raw)["unidades"].dtype == np.int64
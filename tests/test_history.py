@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.history import ConversationHistory, count_tokens
+
+_TABLE = "\n".join(f"fila {i} | norte | {i * 10}" for i in range(400))
+
+
+def test_large_tool_output_is_summarized_with_its_result_handle():
+    history = ConversationHistory(budget_tokens=5000, tool_output_max_tokens=50)
+    history.add_user("totales por region")
+    history.add_assistant(f"Resultado:\n{_TABLE}\nListo.", [_TABLE], ["res_0123456789ab"])
+
+    compact = history.messages[-1]["content"]
+    assert "fila 399" not in compact and "fila 0" in compact
+    assert "ver_resultado" in compact and "res_0123456789ab" in compact
+    assert history.messages[-1]["tokens"] < history.messages[-1]["raw_tokens"]
+
+
+def test_summary_without_handle_does_not_invent_a_reference():
+    history = ConversationHistory(budget_tokens=5000, tool_output_max_tokens=50)
+    history.add_assistant(_TABLE, [_TABLE])
+
+    compact = history.messages[-1]["content"]
+    assert "res_" not in compact and "referencia" not in compact
+    assert "vuelve a ejecutar la herramienta" in compact
+
+
+def test_small_outputs_are_kept_verbatim():
+    history = ConversationHistory(tool_output_max_tokens=50)
+    history.add_assistant("El máximo es 40", ["40"])
+    assert history.messages[-1]["content"] == "El máximo es 40"
+
+
+def test_build_input_respects_the_budget_and_summarizes_dropped_turns():
+    history = ConversationHistory(budget_tokens=300)
+    for i in range(10):
+        history.add_user(f"pregunta {i} " + "x" * 200)
+        history.add_assistant(f"respuesta {i} " + "y" * 200)
+    history.add_user("ultima pregunta")
+
+    payload, stats = history.build_input()
+
+    assert payload[-1] == {"role": "user", "content": "ultima pregunta"}
+    assert payload[0]["content"].startswith("Contexto de turnos anteriores")
+    assert payload[1]["role"] == "user"
+    assert stats["tokens_enviados"] <= 300 + count_tokens(payload[0]["content"])
+    assert stats["turnos_omitidos"] > 0 and stats["tokens_ahorrados"] > 0
+
+
+def test_trim_bounds_the_stored_messages():
+    history = ConversationHistory(budget_tokens=100)
+    for i in range(50):
+        history.add_user("z" * 400)
+    history.trim()
+    assert sum(m["tokens"] for m in history.messages) <= 400
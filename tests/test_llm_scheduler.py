@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+pytest.importorskip("httpx")
+
+from utils.llm_scheduler import (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, LLMQueueFullError, LLMScheduler,
+                                 TokenBucket, find_queue_full)
+
+
+def _occupy(scheduler):
+    """Toma el único turno para que las peticiones siguientes queden en cola."""
+    scheduler.acquire_sync(1, session="ocupada")
+
+
+def _waiters(scheduler, requests):
+    order, threads = [], []
+    for session, priority in requests:
+        def run(session=session, priority=priority):
+            scheduler.acquire_sync(1, priority=priority, session=session)
+            order.append(session)
+            scheduler.release()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        # Se encolan en el orden de la lista
+        deadline = time.monotonic() + 5
+        while scheduler.stats()["en_cola"] < len(threads) and time.monotonic() < deadline:
+            time.sleep(0.001)
+    return order, threads
+
+
+def test_sessions_take_turns_and_interactive_goes_first():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1)
+    _occupy(scheduler)
+    order, threads = _waiters(scheduler, [("a", PRIORITY_INTERACTIVE)] * 3 + [("b", PRIORITY_INTERACTIVE)] * 2
+                              + [("export", PRIORITY_BACKGROUND), ("c", PRIORITY_INTERACTIVE)])
+
+    assert scheduler.position("a") == 1 and scheduler.position("c") == 3 and scheduler.position("export") == 7
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ["a", "b", "c", "a", "b", "a", "export"]
+    assert scheduler.stats()["en_vuelo"] == 0
+
+
+def test_token_bucket_refills_continuously_and_caps_large_requests():
+    bucket = TokenBucket(per_minute=60, burst_seconds=10)
+    assert bucket.wait_time(10, bucket.updated) == 0
+    bucket.take(10)
+    assert bucket.wait_time(1, bucket.updated) == pytest.approx(1.0)
+    assert bucket.wait_time(1, bucket.updated + 0.5) == pytest.approx(0.5)
+    # Más que la ráfaga máxima: espera a tener el bucket lleno, no para siempre
+    assert bucket.wait_time(1000, bucket.updated) == pytest.approx(9.5)
+    assert TokenBucket(per_minute=0).wait_time(10 ** 6, 0) == 0
+
+
+def test_request_bucket_delays_grants():
+    scheduler = LLMScheduler(requests_per_minute=600, tokens_per_minute=0, max_concurrency=10)
+    scheduler.requests.tokens = 0
+    started = time.monotonic()
+    scheduler.acquire_sync(1, session="a")
+    assert time.monotonic() - started >= 0.05
+    scheduler.release()
+
+
+def test_full_session_queue_is_rejected_without_affecting_others():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1, max_queued_per_session=2)
+    _occupy(scheduler)
+    _, threads = _waiters(scheduler, [("a", PRIORITY_INTERACTIVE)] * 2)
+
+    with pytest.raises(LLMQueueFullError, match="Reintenta"):
+        scheduler.acquire_sync(1, session="a")
+    assert scheduler.stats()["rechazadas"] == 1 and scheduler.stats()["en_cola"] == 2
+    _, others = _waiters(scheduler, [("b", PRIORITY_INTERACTIVE)])
+
+    scheduler.release()
+    for thread in threads + others:
+        thread.join(timeout=5)
+    assert scheduler.stats()["en_cola"] == 0
+
+
+def test_wrapped_queue_errors_are_found():
+    try:
+        try:
+            raise LLMQueueFullError("ocupado")
+        except LLMQueueFullError as e:
+            raise ConnectionError("Connection error.") from e
+    except ConnectionError as wrapped:
+        assert str(find_queue_full(wrapped)) == "ocupado"
+    assert find_queue_full(ValueError("otro")) is None
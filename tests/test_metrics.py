@@ -0,0 +1,36 @@
+import os
+import socket
+import sys
+import urllib.request
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.metrics as metrics
+from utils.metrics import record, start_metrics_server
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_metrics_server_is_opt_in(monkeypatch):
+    monkeypatch.setattr(metrics, "_server", None)
+    assert start_metrics_server(port=_free_port(), enabled=False) is None
+    assert metrics._server is None
+
+
+def test_enabled_server_exposes_recorded_stages(monkeypatch):
+    monkeypatch.setattr(metrics, "_server", None)
+    record("prueba_etapa", 0.02)
+    server = start_metrics_server(port=_free_port(), enabled=True)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+        # Una segunda llamada en el mismo proceso reutiliza el servidor
+        assert start_metrics_server(port=_free_port(), enabled=True) is server
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "prueba_etapa" in body
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.openai_agent import AssistantAgent
+
+
+class _Stream:
+    def __init__(self, events, pause=None):
+        self.events = events
+        self.pause = pause
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield event
+        if self.pause is not None:
+            await self.pause.wait()
+
+
+def _delta(text):
+    part = SimpleNamespace(type="text", text=SimpleNamespace(value=text))
+    return SimpleNamespace(event="thread.message.delta", data=SimpleNamespace(delta=SimpleNamespace(content=[part])))
+
+
+def _run_event(name, run_id="run_1"):
+    return SimpleNamespace(event=f"thread.run.{name}", data=SimpleNamespace(id=run_id))
+
+
+class _FakeClient:
+    def __init__(self, events, pause=None):
+        self.created_threads = 0
+        self.cancelled = []
+        client = self
+
+        async def create_thread():
+            client.created_threads += 1
+            await asyncio.sleep(0.01)
+            return SimpleNamespace(id=f"thread_{client.created_threads}")
+
+        async def create_message(**kwargs):
+            return None
+
+        async def create_run(**kwargs):
+            return _Stream(events, pause)
+
+        async def cancel_run(run_id, thread_id):
+            client.cancelled.append((run_id, thread_id))
+
+        self.beta = SimpleNamespace(
+            threads=SimpleNamespace(
+                create=create_thread,
+                messages=SimpleNamespace(create=create_message),
+                runs=SimpleNamespace(create=create_run, cancel=cancel_run),
+            ),
+        )
+
+
+def _agent(client):
+    agent = AssistantAgent("asst_1", client_override=client, id_file=None)
+    agent._assistant_checked = True
+    return agent
+
+
+def test_concurrent_first_messages_of_a_session_share_one_thread():
+    client = _FakeClient([])
+    agent = _agent(client)
+
+    async def main():
+        return await asyncio.gather(*(agent._get_thread("sesion") for _ in range(5)))
+
+    assert set(asyncio.run(main())) == {"thread_1"}
+    assert client.created_threads == 1
+    agent.reset_session("sesion")
+    assert "sesion" not in agent._session_locks
+
+
+def test_completed_run_streams_text_and_is_not_cancelled():
+    client = _FakeClient([_run_event("created"), _delta("Hola"), _delta(" mundo"), _run_event("completed")])
+    agent = _agent(client)
+
+    async def main():
+        return [chunk async for chunk in agent.arun("hola", "sesion")]
+
+    assert "".join(asyncio.run(main())) == "Hola mundo"
+    assert client.cancelled == []
+
+
+def test_abandoned_stream_cancels_the_active_run():
+    async def main():
+        pause = asyncio.Event()
+        client = _FakeClient([_run_event("created"), _delta("Hola")], pause)
+        agent = _agent(client)
+        stream = agent.arun("hola", "sesion")
+        assert await stream.__anext__() == "Hola"
+        # El consumidor deja de leer (p. ej. el usuario detuvo la respuesta)
+        await stream.aclose()
+        return client.cancelled
+
+    assert asyncio.run(main()) == [("run_1", "thread_1")]
@@ -0,0 +1,82 @@
+import os
+import queue
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.prefetch as prefetch
+from utils.prefetch import (PRIORITY_HISTORY, PRIORITY_MESSAGE, _sheet_after, find_mentions, prefetch_from_messages,
+                            schedule)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in ("ventas.xlsx", "2024_ventas.xlsx", "clientes.xlsx"):
+        with pd.ExcelWriter(tmp_path / name) as writer:
+            pd.DataFrame({"a": [1]}).to_excel(writer, sheet_name="Detalle", index=False)
+            pd.DataFrame({"b": [2]}).to_excel(writer, sheet_name="Resumen anual", index=False)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    """Cola propia y sin workers: las pruebas solo miran qué se encola."""
+    pending = queue.PriorityQueue()
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(prefetch, "_queue", pending)
+    monkeypatch.setattr(prefetch, "_queued", set())
+    monkeypatch.setattr(prefetch, "_start_workers", lambda: None)
+
+    def drain():
+        items = []
+        while not pending.empty():
+            priority, _, path, sheet = pending.get_nowait()
+            items.append((priority, os.path.basename(path), sheet))
+        return items
+    return drain
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ventas.xlsx#Resumen anual: totales", "Resumen anual"),
+    ("ventas.xlsx#Detalle, y luego", "Detalle"),
+    ("ventas.xlsx#  ", None),
+    ("ventas.xlsx: totales", None),
+    ("ventas.xlsx", None),
+])
+def test_sheet_after_a_mention(text, expected):
+    assert _sheet_after(text, len("ventas.xlsx")) == expected
+
+
+def test_mentions_are_whole_names_in_order_of_appearance(data_dir):
+    text = "Compara CLIENTES.xlsx con 2024_ventas.xlsx#Resumen anual: y luego ventas.xlsx"
+    assert find_mentions(text, data_dir) == [
+        ("clientes.xlsx", None), ("2024_ventas.xlsx", "Resumen anual"), ("ventas.xlsx", None)]
+    # Sin delimitador la hoja se lleva el resto de la frase; se recorta al resolverla contra el catálogo
+    assert find_mentions("ventas.xlsx#Resumen anual por mes", data_dir) == [("ventas.xlsx", "Resumen anual por mes")]
+    assert find_mentions("solo 2024_ventas.xlsx", data_dir) == [("2024_ventas.xlsx", None)]
+    assert find_mentions("sin archivos", data_dir) == []
+    assert len(find_mentions(text, data_dir, limit=2)) == 2
+
+
+def test_queue_is_keyed_on_the_resolved_sheet(data_dir, queued):
+    path = os.path.join(data_dir, "ventas.xlsx")
+    assert schedule(path, "resumen ANUAL")
+    assert not schedule(path, "Resumen anual")
+    assert not schedule(path, "2")
+    # La primera hoja por nombre es la misma entrada que la hoja por defecto
+    assert schedule(path, None)
+    assert not schedule(path, "Detalle")
+    # Una hoja con texto de más después del nombre se recorta al nombre más largo que encaja
+    assert not schedule(path, "Resumen anual de ventas")
+
+    assert queued() == [(PRIORITY_MESSAGE, "ventas.xlsx", "Resumen anual"), (PRIORITY_MESSAGE, "ventas.xlsx", 0)]
+
+
+def test_messages_queue_current_mentions_before_history(data_dir, queued):
+    count = prefetch_from_messages("analiza ventas.xlsx", ["antes vimos clientes.xlsx#Detalle"], data_dir)
+
+    assert count == 2
+    assert sorted(queued()) == [(PRIORITY_MESSAGE, "ventas.xlsx", 0), (PRIORITY_HISTORY, "clientes.xlsx", 0)]
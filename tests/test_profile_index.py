@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.frame_optimizer as frame_optimizer
+import utils.profile_index as profile_index
+from utils.profile_index import approx_distinct, build_profile, format_profile, get_profile
+
+
+@pytest.fixture(autouse=True)
+def optimize_small_frames(monkeypatch):
+    monkeypatch.setattr(frame_optimizer, "OPTIMIZE_MIN_ROWS", 1)
+    profile_index._memory.clear()
+    yield
+    profile_index._memory.clear()
+
+
+def _write_book(path, resumen=3):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({"estado": ["activo", "baja"] * 5, "monto": np.arange(10) + 0.5}).to_excel(
+            writer, sheet_name="Ventas", index=False)
+        pd.DataFrame({"total": [resumen]}).to_excel(writer, sheet_name="Resumen", index=False)
+
+
+def test_distinct_count_is_exact_above_the_hashing_threshold(monkeypatch):
+    monkeypatch.setattr(profile_index, "EXACT_DISTINCT_MAX_ROWS", 10)
+    series = pd.Series(np.arange(5000) % 1297).astype(str)
+    assert approx_distinct(series) == 1297
+    assert approx_distinct(pd.Series([1, None, 1, 2])) == 2
+
+
+def test_profile_reports_the_optimized_dtypes_with_plain_statistics(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+
+    ventas = build_profile(path)["hojas"]["Ventas"]
+    columns = {c["nombre"]: c for c in ventas["columnas"]}
+
+    assert columns["estado"]["tipo"] == "category"
+    assert (columns["estado"]["minimo"], columns["estado"]["maximo"]) == ("activo", "baja")
+    assert columns["monto"]["tipo"] == "float32"
+    assert (columns["monto"]["minimo"], columns["monto"]["maximo"]) == (0.5, 9.5)
+    assert ventas["filas"] == 10 and ventas["memoria_bytes"] > 0
+    assert "MB en memoria" in format_profile(get_profile(path))
+
+
+def test_only_changed_sheets_are_profiled_again(tmp_path, monkeypatch):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+    build_profile(path)
+    read = []
+    original = profile_index.read_excel_columnar
+    monkeypatch.setattr(profile_index, "read_excel_columnar", lambda p, s: read.append(s) or original(p, s))
+
+    _write_book(path, resumen=4)
+    assert get_profile(path, build=False) is None
+    profile = get_profile(path)
+
+    assert read == ["Resumen"]
+    assert profile["hojas"]["Resumen"]["columnas"][0]["maximo"] == 4
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.query_planner import plan_query, resolve_column, try_fast_path
+
+
+@pytest.fixture
+def ventas():
+    return pd.DataFrame({
+        "Región": ["Norte", "Sur", "Norte", "Este"],
+        "Ventas Totales": [10, 20, 30, 40],
+        "Unidades": [1, 2, 3, 4],
+    })
+
+
+def test_resolves_columns_by_accentless_partial_and_fuzzy_names(ventas):
+    columns = list(ventas.columns)
+    assert resolve_column("region", columns) == "Región"
+    assert resolve_column("ventas", columns) == "Ventas Totales"
+    assert resolve_column("unidade", columns) == "Unidades"
+    assert resolve_column("precio", columns) is None
+
+
+def test_simple_aggregations_match_pandas(ventas):
+    assert try_fast_path("¿Cuál es el máximo de Ventas Totales?", ventas) == 40
+    assert try_fast_path("promedio de unidades", ventas) == 2.5
+    assert try_fast_path("cuantas filas hay", ventas) == 4
+
+
+def test_grouped_sum_and_filter(ventas):
+    grouped = try_fast_path("suma de ventas por region", ventas).set_index("Región")["Ventas Totales"]
+    assert grouped.to_dict() == {"Este": 40, "Norte": 40, "Sur": 20}
+
+    filtered = try_fast_path("filas donde region es norte", ventas)
+    assert filtered["Ventas Totales"].tolist() == [10, 30]
+
+
+def test_per_column_aggregate(ventas):
+    result = try_fast_path("suma por columna", ventas).set_index("columna")["sum"]
+    assert result.to_dict() == {"Ventas Totales": 100, "Unidades": 10}
+
+
+def test_unrecognized_or_unsafe_queries_fall_back(ventas):
+    assert plan_query("grafica las ventas por mes", ventas) is None
+    # Suma de texto: no se adivina, decide PandasAI
+    assert plan_query("suma de region", ventas) is None
+    assert try_fast_path("filas donde region es oeste", ventas) is None
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.result_cache as result_cache_module
+from utils.result_cache import ResultCache, content_fingerprint, is_cacheable_result, normalize_instruction
+
+
+def test_normalized_instructions_share_an_entry(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    cache.put("ventas.xlsx", "abc", "Valores máximos por columna", 42)
+
+    assert normalize_instruction("  ¿Valores  MAXIMOS por columna? ") == "valores maximos por columna"
+    assert cache.get("abc", "valores  maximos por columna.") == 42
+    assert cache.get("otra-huella", "valores maximos por columna") is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_dataframes_round_trip_and_new_version_drops_old_answers(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    frame = pd.DataFrame({"region": ["norte", "sur"], "total": [1.5, 2.5]})
+    cache.put("ventas.xlsx", "v1", "totales por region", frame)
+    pd.testing.assert_frame_equal(cache.get("v1", "totales por region"), frame, check_dtype=False)
+
+    cache.put("ventas.xlsx", "v2", "otra pregunta", 1)
+    assert cache.get("v1", "totales por region") is None
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"), ttl=60)
+    cache.put("ventas.xlsx", "v1", "conteo", 10)
+    cache.ttl = -1
+    assert cache.get("v1", "conteo") is None
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"), max_bytes=2500)
+    for name in ("a", "b"):
+        cache.put(f"{name}.xlsx", name, "q", "x" * 1000)
+        time.sleep(0.01)
+    cache.get("a", "q")
+    cache.put("c.xlsx", "c", "q", "x" * 1000)
+
+    assert cache.get("b", "q") is None
+    assert cache.get("a", "q") is not None and cache.get("c", "q") is not None
+
+
+def test_errors_and_chart_paths_are_not_cacheable():
+    assert not is_cacheable_result(None)
+    assert not is_cacheable_result("[Error] algo falló")
+    assert not is_cacheable_result("exports/charts/temp_chart.png")
+    assert is_cacheable_result("El total es 10")
+
+
+def test_fingerprint_memo_is_bounded_and_follows_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache_module, "FINGERPRINT_MEMO_ENTRIES", 2)
+    result_cache_module._fingerprints.clear()
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.xlsx"
+        path.write_bytes(b"contenido %d" % i)
+        paths.append(str(path))
+        content_fingerprint(str(path))
+    assert len(result_cache_module._fingerprints) == 2
+
+    before = content_fingerprint(paths[2])
+    with open(paths[2], "ab") as fh:
+        fh.write(b" cambiado")
+    os.utime(paths[2], ns=(time.time_ns() + 10 ** 9,) * 2)
+    assert content_fingerprint(paths[2]) != before
+    assert len([k for k in result_cache_module._fingerprints if k[0] == os.path.abspath(paths[2])]) == 1
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.result_store import HANDLE_RE, ResultStore, describe_result, find_handles, slice_result
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({"region": ["Norte", "sur", "Sur", "Este"] * 25, "total": range(100)})
+
+
+def test_handles_round_trip_and_large_results_spill_to_disk(tmp_path, frame):
+    store = ResultStore(spill_dir=str(tmp_path), max_bytes=1)
+    first, second = store.put(frame), store.put(frame.head(10))
+
+    assert HANDLE_RE.fullmatch(first) and first != second
+    assert store.stats()["volcados_a_disco"] == 1
+    assert os.path.exists(tmp_path / f"{first}.pkl")
+    pd.testing.assert_frame_equal(store.get(first), frame)
+    assert store.get("res_000000000000") is None
+
+
+def test_expired_results_are_removed(tmp_path, frame):
+    store = ResultStore(spill_dir=str(tmp_path), ttl=60)
+    handle = store.put(frame)
+    store.ttl = -1
+    assert store.get(handle) is None
+    assert store.stats()["total"] == 0
+
+
+def test_slice_filters_case_insensitively_sorts_and_pages(frame):
+    page, total = slice_result(frame, page=2, page_size=10, sort_by="total", descending=True,
+                               filter_column="region", filter_value="SUR")
+    assert total == 50
+    assert page["total"].tolist() == [78, 77, 74, 73, 70, 69, 66, 65, 62, 61]
+
+    with pytest.raises(KeyError):
+        slice_result(frame, sort_by="monto")
+
+
+def test_description_and_handle_extraction(frame):
+    text = describe_result(frame, "res_0123456789ab", preview_rows=3)
+    assert text.startswith("Resultado tabular: 100 filas x 2 columnas.")
+    assert "Primeras 3 filas" in text
+    assert find_handles(f"{text} y otra vez res_0123456789ab, res_ffffffffffff") == [
+        "res_0123456789ab", "res_ffffffffffff"]
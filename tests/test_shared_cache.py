@@ -0,0 +1,105 @@
+import gc
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+pytest.importorskip("pyarrow")
+
+from utils.shared_cache import SharedFrameCache
+
+
+def _frame(seed, rows=5000):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({2024: rng.integers(0, 1000, rows), "region": pd.Categorical(rng.choice(["n", "s"], rows)),
+                         "monto": rng.random(rows)})
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SharedFrameCache(directory=str(tmp_path / "shared"), max_bytes=1 << 30, enabled=True)
+    yield cache
+    cache.release_process()
+
+
+def _refs(cache):
+    with closing(sqlite3.connect(cache.db_path)) as conn:
+        return dict(conn.execute("SELECT key, SUM(count) FROM refs GROUP BY key").fetchall())
+
+
+def test_put_then_attach_round_trips_non_text_labels(cache):
+    df = _frame(1)
+    assert cache.put(("libro.xlsx", 0, "v1"), df, "libro.xlsx", 0, "v1")
+
+    attached = cache.attach(("libro.xlsx", 0, "v1"))
+
+    assert list(attached.columns) == [2024, "region", "monto"]
+    pd.testing.assert_frame_equal(attached, df, check_categorical=False, check_dtype=False)
+    assert cache.attach(("libro.xlsx", 0, "v2")) is None
+
+
+def test_references_follow_the_attached_frames(cache):
+    key = ("libro.xlsx", 0, "v1")
+    cache.put(key, _frame(1), "libro.xlsx", 0, "v1")
+    first, second = cache.attach(key), cache.attach(key)
+    assert _refs(cache) == {cache.make_key(key): 2}
+
+    del first
+    gc.collect()
+    assert _refs(cache) == {cache.make_key(key): 1}
+    del second
+    gc.collect()
+    assert _refs(cache) == {}
+
+
+def test_eviction_skips_entries_in_use(cache):
+    cache.put("a", _frame(1), "a.xlsx")
+    size = cache.stats()["bytes"]
+    cache.max_bytes = int(size * 2.5)
+    in_use = cache.attach("a")
+    cache.put("b", _frame(2), "b.xlsx")
+
+    assert cache.put("c", _frame(3), "c.xlsx")
+
+    assert cache.attach("a") is not None and cache.attach("c") is not None
+    assert cache.attach("b") is None
+    assert in_use is not None
+
+
+def test_nothing_is_evicted_when_the_entry_cannot_fit(cache):
+    cache.put("a", _frame(1), "a.xlsx")
+    cache.max_bytes = int(cache.stats()["bytes"] * 1.5)
+    in_use = cache.attach("a")
+
+    assert not cache.put("b", _frame(2), "b.xlsx")
+    assert cache.stats()["entries"] == 1 and in_use is not None
+
+
+def test_references_of_dead_processes_do_not_block_eviction(cache):
+    cache.put("a", _frame(1), "a.xlsx")
+    cache.max_bytes = int(cache.stats()["bytes"] * 1.5)
+    with closing(sqlite3.connect(cache.db_path)) as conn, conn:
+        conn.execute("INSERT INTO refs VALUES (?, ?, 1)", (cache.make_key("a"), 2 ** 22 + 12345))
+
+    assert cache.put("b", _frame(2), "b.xlsx")
+    assert cache.attach("a") is None
+
+
+def test_a_new_version_of_a_sheet_replaces_the_old_one(cache):
+    cache.put("v1", _frame(1), "libro.xlsx", "Ventas", "v1")
+    cache.put("v2", _frame(2), "libro.xlsx", "Ventas", "v2")
+
+    assert cache.attach("v1") is None and cache.attach("v2") is not None
+    assert cache.stats()["entries"] == 1
+
+
+def test_disabled_cache_is_a_no_op(tmp_path):
+    cache = SharedFrameCache(directory=str(tmp_path / "off"), enabled=False)
+    assert not cache.put("a", _frame(1)) and cache.attach("a") is None
+    assert not os.path.exists(tmp_path / "off")
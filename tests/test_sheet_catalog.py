@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.sheet_catalog import (SheetNotFoundError, canonical_sheet_ref, format_catalog, read_sheet_catalog,
+                                 resolve_sheet, sheet_names)
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        pd.DataFrame({"a": range(10), "b": range(10), "c": range(10)}).to_excel(writer, sheet_name="Ventas", index=False)
+        pd.DataFrame({"total": [1, 2]}).to_excel(writer, sheet_name="Año Fiscal", index=False)
+        pd.DataFrame({"x": [1]}).to_excel(writer, sheet_name="Notas", index=False)
+    workbook = load_workbook(path)
+    workbook["Notas"].sheet_state = "hidden"
+    workbook.save(path)
+    return path
+
+
+def test_catalog_reports_sheets_and_dimensions_without_loading_them(book):
+    catalog = read_sheet_catalog(book)
+
+    assert [s["nombre"] for s in catalog] == ["Ventas", "Año Fiscal", "Notas"]
+    assert (catalog[0]["dimension"], catalog[0]["filas"], catalog[0]["columnas"]) == ("A1:C11", 10, 3)
+    assert catalog[1]["filas"] == 2 and catalog[0]["crc"] is not None
+    assert [s["visible"] for s in catalog] == [True, True, False]
+    assert format_catalog(catalog) == ("Ventas (10 filas, 3 columnas), Año Fiscal (2 filas, 1 columnas), "
+                                       "Notas (1 filas, 1 columnas; oculta)")
+
+
+def test_catalog_follows_changes_to_the_file(book):
+    assert sheet_names(book) == ["Ventas", "Año Fiscal", "Notas"]
+    with pd.ExcelWriter(book, engine="openpyxl") as writer:
+        pd.DataFrame({"a": [1]}).to_excel(writer, sheet_name="Nueva", index=False)
+    os.utime(book, ns=(os.stat(book).st_mtime_ns + 10 ** 9,) * 2)
+    assert sheet_names(book) == ["Nueva"]
+
+
+@pytest.mark.parametrize("ref, expected", [
+    ("Ventas", "Ventas"),
+    ("ano fiscal", "Año Fiscal"),
+    ("  'AÑO   FISCAL' ", "Año Fiscal"),
+    ("3", "Notas"),
+    (0, "Ventas"),
+    (2, "Notas"),
+])
+def test_resolve_sheet_accepts_names_positions_and_loose_spelling(book, ref, expected):
+    assert resolve_sheet(book, ref) == expected
+
+
+@pytest.mark.parametrize("ref", ["Compras", "4", 3, -1])
+def test_missing_sheets_list_the_available_ones(book, ref):
+    with pytest.raises(SheetNotFoundError, match="Hojas disponibles: Ventas, Año Fiscal, Notas"):
+        resolve_sheet(book, ref)
+
+
+def test_canonical_ref_is_zero_for_the_first_sheet_and_the_name_otherwise(book, tmp_path):
+    assert canonical_sheet_ref(book, "Ventas") == canonical_sheet_ref(book, 0) == 0
+    assert canonical_sheet_ref(book, 1) == canonical_sheet_ref(book, "Año Fiscal") == "Año Fiscal"
+    assert canonical_sheet_ref(book, "Compras") == "Compras"
+    assert canonical_sheet_ref(str(tmp_path / "no_existe.xlsx"), "Ventas") == "Ventas"
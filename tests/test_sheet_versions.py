@@ -0,0 +1,88 @@
+import itertools
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.sheet_versions import get_manifest, ingest, ingest_report, sheet_version
+from utils.sidecar import ensure_sidecar, is_sidecar_valid
+
+_ticks = itertools.count(1)
+
+
+def _write_book(path, regiones=("norte", "sur"), resumen=3, nota="ok"):
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        pd.DataFrame({"region": list(regiones), "monto": [1.5, 2.5]}).to_excel(writer, sheet_name="Ventas", index=False)
+        pd.DataFrame({"total": [resumen], "nota": [nota]}).to_excel(writer, sheet_name="Resumen", index=False)
+    # Cada reescritura se ve como un archivo distinto aunque caiga en el mismo tick del reloj
+    stamp = os.stat(path).st_mtime_ns + next(_ticks) * 10 ** 9
+    os.utime(path, ns=(stamp, stamp))
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+    return path
+
+
+def _versions(path):
+    return sheet_version(path, "Ventas"), sheet_version(path, "Resumen")
+
+
+def test_first_sheet_by_index_and_name_share_a_version(book):
+    assert sheet_version(book, 0) == sheet_version(book, "Ventas") != sheet_version(book, 1)
+    assert ingest_report(book)["primera_ingesta"]
+
+
+def test_only_the_rewritten_sheet_gets_a_new_version(book):
+    ventas, resumen = _versions(book)
+    _write_book(book, resumen=4)
+
+    assert _versions(book)[0] == ventas and _versions(book)[1] != resumen
+    report = ingest_report(book)
+    assert (report["reutilizadas"], report["reparseadas"]) == (["Ventas"], ["Resumen"])
+
+
+def test_new_shared_strings_keep_sheets_that_do_not_use_them(book):
+    ventas, _ = _versions(book)
+    _write_book(book, nota="revisar")
+    assert _versions(book)[0] == ventas
+    assert ingest_report(book)["reparseadas"] == ["Resumen"]
+
+
+def test_changed_text_behind_identical_sheet_xml_is_detected(book):
+    ventas, resumen = _versions(book)
+    # Mismas posiciones en la tabla de textos, otro texto: el XML de la hoja no cambia
+    _write_book(book, regiones=("norte", "este"))
+    assert _versions(book) != (ventas, resumen)
+    assert "Ventas" in ingest_report(book)["reparseadas"]
+
+
+def test_manifest_is_shared_through_disk(book, tmp_path):
+    manifest = get_manifest(book)
+    assert os.path.exists(tmp_path / ".cache" / "manifests" / "libro.xlsx.json")
+    assert manifest["orden"] == ["Ventas", "Resumen"]
+
+
+def test_files_without_zip_fall_back_to_size_and_mtime(tmp_path):
+    path = tmp_path / "viejo.xls"
+    path.write_bytes(b"no es un zip")
+    stat = os.stat(path)
+    assert sheet_version(str(path)) == f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def test_ingest_rebuilds_only_the_sidecars_in_use_that_changed(book):
+    ensure_sidecar(book, 0)
+    _write_book(book, resumen=5)
+    assert is_sidecar_valid(book, 0)
+    report = ingest(book)
+    assert report["sidecars_reconstruidos"] == 0
+
+    _write_book(book, regiones=("este", "oeste"), resumen=5)
+    assert not is_sidecar_valid(book, 0)
+    assert ingest(book)["sidecars_reconstruidos"] == 1
+    assert is_sidecar_valid(book, 0)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.sidecar import (build_sidecars_for_file, is_sidecar_valid, read_excel_columnar, read_sidecar,
+                           sidecar_paths)
+
+
+def _write_book(path, resumen=3):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({2024: [1, 2], "region": ["norte", "sur"]}).to_excel(writer, sheet_name="Ventas", index=False)
+        pd.DataFrame({"total": [resumen]}).to_excel(writer, sheet_name="Resumen", index=False)
+
+
+def test_lazy_build_then_read_keeps_non_text_headers(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+
+    cold = read_excel_columnar(path, 0)
+    assert is_sidecar_valid(path, 0)
+    warm = read_sidecar(path, 0)
+
+    assert list(warm.columns) == list(cold.columns) == [2024, "region"]
+    pd.testing.assert_frame_equal(warm, cold, check_dtype=False)
+
+
+def test_first_sheet_by_index_and_name_use_the_same_sidecar(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+
+    assert sidecar_paths(path, 0) == sidecar_paths(path, "Ventas")
+    assert sidecar_paths(path, "Resumen") != sidecar_paths(path, 0)
+
+
+def test_sheet_names_that_sanitize_alike_do_not_collide(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    with pd.ExcelWriter(path) as writer:
+        for name in ("Portada", "Hoja 1", "Hoja_1"):
+            pd.DataFrame({"x": [1]}).to_excel(writer, sheet_name=name, index=False)
+
+    assert sidecar_paths(path, "Hoja 1")["data"] != sidecar_paths(path, "Hoja_1")["data"]
+
+
+def test_sidecar_is_invalidated_only_for_the_rewritten_sheet(tmp_path):
+    path = str(tmp_path / "libro.xlsx")
+    _write_book(path)
+    result = build_sidecars_for_file(path)
+    assert result["hojas_construidas"] == ["0", "Resumen"]
+
+    _write_book(path, resumen=4)
+
+    assert is_sidecar_valid(path, "Ventas")
+    assert not is_sidecar_valid(path, "Resumen")
+    result = build_sidecars_for_file(path)
+    assert (result["hojas_construidas"], result["hojas_reutilizadas"]) == (["Resumen"], 1)
+    assert read_sidecar(path, "Resumen")["total"].tolist() == [4]
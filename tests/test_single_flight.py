@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.single_flight import SingleFlight, single_flight, single_flight_stats
+
+
+def _run_concurrently(group, key, func, n=5):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(group.do(key, func))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    return results, errors
+
+
+def _slow(value, calls, release):
+    def func():
+        calls.append(1)
+        release.wait(timeout=5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    return func
+
+
+def _release_when_waiting(group, release, waiters):
+    deadline = time.monotonic() + 5
+    while group.stats()["coalescidas"] < waiters and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+
+
+def test_identical_calls_in_flight_run_once_and_share_the_result():
+    group, calls, release = SingleFlight("prueba"), [], threading.Event()
+    threading.Thread(target=_release_when_waiting, args=(group, release, 4)).start()
+
+    results, errors = _run_concurrently(group, "libro", _slow({"filas": 10}, calls, release))
+
+    assert calls == [1] and errors == []
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    assert group.stats() == {"llamadas": 5, "ejecuciones": 1, "coalescidas": 4, "errores": 0, "en_vuelo": 0}
+
+
+def test_errors_reach_every_waiter_and_free_the_key():
+    group, calls, release = SingleFlight("prueba"), [], threading.Event()
+    threading.Thread(target=_release_when_waiting, args=(group, release, 2)).start()
+
+    results, errors = _run_concurrently(group, "libro", _slow(ValueError("roto"), calls, release), n=3)
+
+    assert calls == [1] and results == [] and len(errors) == 3
+    assert all(isinstance(e, ValueError) for e in errors)
+    # La clave se libera: no es una caché, la siguiente llamada vuelve a ejecutar
+    assert group.do("libro", lambda: "otra vez") == "otra vez"
+
+
+def test_distinct_keys_do_not_coalesce():
+    group = SingleFlight("prueba")
+    assert [group.do(k, lambda k=k: k * 2) for k in (1, 2, 2)] == [2, 4, 4]
+    assert group.stats()["ejecuciones"] == 3
+
+
+def test_groups_are_shared_by_name():
+    assert single_flight("prueba_compartida") is single_flight("prueba_compartida")
+    single_flight("prueba_compartida").do("k", lambda: None)
+    assert single_flight_stats()["prueba_compartida"]["llamadas"] >= 1
+
+
+def test_base_exceptions_propagate_too():
+    group = SingleFlight("prueba")
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        group.do("k", interrupted)
+    assert group.stats()["en_vuelo"] == 0
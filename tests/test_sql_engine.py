@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import utils.sql_engine as sql_engine
+from utils.sql_engine import SQLError, _projected, list_tables, resolve_table, run_sql, table_name
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    with pd.ExcelWriter(tmp_path / "Ventas 2025.xlsx") as writer:
+        pd.DataFrame({"id": [1, 2, 3], "paid": [10.0, 20.0, 30.0], "Monto Total": [5, 6, 7]}).to_excel(
+            writer, sheet_name="Detalle", index=False)
+        pd.DataFrame({"id": [1, 2], "región": ["Norte", "Sur"]}).to_excel(writer, sheet_name="Regiones", index=False)
+    pd.DataFrame({"id": [2, 3], "cliente": ["b", "c"]}).to_excel(tmp_path / "clientes.xlsx", index=False)
+    return str(tmp_path)
+
+
+@pytest.fixture(params=["duckdb", "sqlite"])
+def engine(request, monkeypatch):
+    if request.param == "duckdb" and sql_engine.duckdb is None:
+        pytest.skip("duckdb no está instalado")
+    if request.param == "sqlite":
+        monkeypatch.setattr(sql_engine, "duckdb", None)
+    return request.param
+
+
+def test_table_names_and_resolution(data_dir):
+    assert table_name("Ventas 2025.xlsx") == "ventas_2025"
+    assert table_name("Ventas 2025.xlsx", "Regiones") == "ventas_2025__regiones"
+    assert table_name("2025.xlsx") == "t_2025"
+
+    assert resolve_table("VENTAS_2025", data_dir) == (os.path.join(data_dir, "Ventas 2025.xlsx"), 0)
+    # La primera hoja por nombre comparte la referencia 0
+    assert resolve_table("ventas_2025__detalle", data_dir)[1] == 0
+    assert resolve_table("ventas_2025__regiones", data_dir)[1] == "Regiones"
+    assert resolve_table("ventas_2025__otra", data_dir) is None
+    assert resolve_table("compras", data_dir) is None
+
+    tables = {t["tabla"]: t for t in list_tables(data_dir)}
+    assert set(tables) == {"clientes", "ventas_2025", "ventas_2025__regiones"}
+    assert (tables["ventas_2025"]["hoja"], tables["ventas_2025"]["filas"]) == ("Detalle", 3)
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM ventas_2025",
+    "DROP TABLE clientes",
+    "SELECT 1; DROP TABLE clientes",
+    "ATTACH 'otra.db' AS otra",
+])
+def test_only_single_read_queries_are_accepted(data_dir, sql):
+    with pytest.raises(SQLError):
+        run_sql(sql, data_dir)
+
+
+def test_duckdb_cannot_read_outside_the_registered_tables(data_dir, tmp_path):
+    if sql_engine.duckdb is None:
+        pytest.skip("duckdb no está instalado")
+    (tmp_path / "secreto.csv").write_text("a\n1\n")
+    with pytest.raises(SQLError):
+        run_sql(f"SELECT * FROM read_csv('{tmp_path / 'secreto.csv'}')", data_dir)
+
+
+def test_join_across_files_and_sheets(data_dir, engine):
+    df, truncated = run_sql(
+        'SELECT v.id, v."Monto Total" AS monto, r."región", c.cliente FROM ventas_2025 v '
+        "JOIN ventas_2025__regiones r ON r.id = v.id JOIN clientes c ON c.id = v.id", data_dir)
+    assert df.to_dict("records") == [{"id": 2, "monto": 6, "región": "Sur", "cliente": "b"}]
+    assert not truncated
+
+
+def test_results_are_truncated_to_max_rows(data_dir, engine):
+    df, truncated = run_sql("SELECT * FROM ventas_2025 ORDER BY id", data_dir, max_rows=2)
+    assert df["id"].tolist() == [1, 2] and truncated
+
+
+def test_projection_matches_whole_identifiers():
+    df = pd.DataFrame({"id": [1], "paid": [2.0], "Monto Total": [3], "region": ["n"]})
+
+    assert list(_projected(df, "SELECT id FROM t")) == ["id"]
+    assert list(_projected(df, "SELECT \"Monto Total\" AS \"Total\", id FROM t WHERE region = 'paid'")) == [
+        "id", "Monto Total", "region"]
+    assert list(_projected(df, "SELECT x.* FROM t AS x")) == list(df)
+    assert list(_projected(df, 'SELECT "t 1".* FROM t AS "t 1"')) == list(df)
+    # Sin ningún identificador conocido se copia la tabla entera
+    assert list(_projected(df, "SELECT count(*) FROM t")) == list(df)
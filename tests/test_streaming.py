@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.streaming import TokenCoalescer, streaming_stats
+
+
+class _Message:
+    def __init__(self):
+        self.frames = []
+
+    async def stream_token(self, chunk):
+        self.frames.append(chunk)
+
+
+def test_tokens_are_sent_in_batches_by_size():
+    msg = _Message()
+
+    async def main():
+        async with TokenCoalescer(msg, interval_ms=60_000, max_chars=10) as stream:
+            for token in ["ab"] * 12:
+                await stream.push(token)
+            await stream.push("")
+        return stream
+
+    stream = asyncio.run(main())
+    assert msg.frames == ["ab" * 5, "ab" * 5, "ab" * 2]
+    assert stream.text == "ab" * 12 and stream.tokens_received == 12 and stream.frames_sent == 3
+
+
+def test_pending_tokens_are_flushed_by_the_ticker_without_new_input():
+    msg = _Message()
+
+    async def main():
+        async with TokenCoalescer(msg, interval_ms=20, max_chars=1000) as stream:
+            await stream.push("hola")
+            await asyncio.sleep(0.1)
+            frames_before_close = list(msg.frames)
+        return frames_before_close
+
+    assert asyncio.run(main()) == ["hola"]
+    assert msg.frames == ["hola"]
+    assert streaming_stats()["respuestas"] >= 1
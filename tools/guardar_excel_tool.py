@@ -1,58 +1,112 @@
 import os
 import re
 import pandas as pd
-from pandasai import SmartDataframe
-from pandasai.llm import OpenAI
 from langchain.tools import BaseTool
-from typing import Any, ClassVar
+from typing import Any, ClassVar, Optional
+from utils.async_executor import run_tool_async
+from utils.code_sandbox import chat_with_sandbox
+from utils.dataframe_cache import read_excel_cached
+from utils.export_engine import EXPORT_FORMATS, export_dataframe
+from utils.llm_scheduler import PRIORITY_BACKGROUND, llm_priority_scope, pandasai_llms
+from utils.metrics import instrument_llm, record, span
+from utils.result_cache import (content_fingerprint, is_cacheable_result, normalize_instruction, result_cache,
+                                scope_to_sheet)
+from utils.sheet_catalog import SheetNotFoundError, resolve_sheet
+from utils.single_flight import single_flight
+
+_analyses = single_flight("analisis")
 
 class AnalizarYGuardarExcelTool(BaseTool):
     name: ClassVar[str] = "analizar_y_guardar_excel"
     description: ClassVar[str] = (
-        "Analiza un archivo Excel usando PandasAI y guarda el resultado en un nuevo archivo Excel. "
+        "Analiza un archivo Excel usando PandasAI y guarda el resultado en un nuevo archivo en /exports. "
         "Uso: '<archivo_entrada.xlsx>: <instrucción>; guardar como <archivo_salida.xlsx>'. "
+        "Para usar otra hoja que no sea la primera: '<archivo_entrada.xlsx>#<hoja>: ...'. "
+        "La extensión de salida elige el formato: .xlsx, .csv, .parquet o .feather. "
         "Si no se especifica el nombre de salida, el asistente debe pedirlo."
     )
 
     def _run(self, query: str, **kwargs) -> Any:
         """
-        Espera un string con formato: '<archivo_entrada.xlsx>: <instrucción>; guardar como <archivo_salida.xlsx>'
+        Espera un string con formato: '<archivo_entrada.xlsx>[#<hoja>]: <instrucción>; guardar como <archivo_salida.xlsx>'
         """
-        # Extraer archivo de entrada, instrucción y archivo de salida
-        match = re.match(r"(.+\.xlsx|.+\.xls)\s*:\s*(.+?)(?:;\s*guardar como\s*(.+\.xlsx|.+\.xls))?$", query, re.IGNORECASE)
+        # Extraer archivo de entrada, hoja (opcional), instrucción y archivo de salida
+        match = re.match(r"(.+\.xlsx|.+\.xls)(?:#([^:]+))?\s*:\s*(.+?)(?:;\s*guardar como\s*(.+?))?\s*$", query, re.IGNORECASE)
         if not match:
             return ("[Error] Formato incorrecto. Usa: <archivo_entrada.xlsx>: <instrucción>; guardar como <archivo_salida.xlsx> "
                     "(o especifica el nombre de salida cuando se te pida).")
         file_name = match.group(1).strip()
-        instruction = match.group(2).strip()
-        output_file = match.group(3).strip() if match.group(3) else None
+        instruction = match.group(3).strip()
+        output_file = match.group(4).strip() if match.group(4) else None
         file_path = os.path.join("data", file_name)
         if not os.path.exists(file_path):
             return f"[Error] El archivo '{file_path}' no existe."
         if not output_file:
             return ("¿Con qué nombre quieres guardar el archivo de resultado? "
                     "Por favor, responde con el nombre deseado (ejemplo: resultado.xlsx)")
+        # Se valida antes del análisis para no gastar una llamada al modelo en una exportación imposible
+        if not output_file.lower().endswith(EXPORT_FORMATS):
+            return (f"[Error] Formato de salida no soportado: '{output_file}'. "
+                    f"Usa una de estas extensiones: {', '.join(EXPORT_FORMATS)}")
+        sheet = None
+        if match.group(2) and match.group(2).strip():
+            try:
+                sheet = resolve_sheet(file_path, match.group(2))
+            except SheetNotFoundError as e:
+                return f"[Error] {e}"
+            except Exception as e:
+                return f"[Error] No se pudo leer el archivo Excel: {e}"
+        with span("cache.resultados", herramienta=self.name):
+            cache_path, fingerprint = scope_to_sheet(file_path, content_fingerprint(file_path), sheet)
+            result = result_cache.get(fingerprint, instruction)
         try:
-            df = pd.read_excel(file_path)
-        except Exception as e:
-            return f"[Error] No se pudo leer el archivo Excel: {e}"
-        try:
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                return "[Error] No se encontró ninguna API key de OpenAI en las variables de entorno."
-            llm = OpenAI(api_token=api_key)
-            sdf = SmartDataframe(df, config={"llm": llm})
-            result = sdf.chat(instruction)
+            if result is None:
+                # El análisis idéntico en curso se comparte; cada llamada exporta a su propio archivo
+                key = (self.name, fingerprint, normalize_instruction(instruction))
+                error, result = _analyses.do(key, self._compute, file_path, file_name, instruction, fingerprint,
+                                             sheet, cache_path)
+                if error:
+                    return error
             if isinstance(result, pd.DataFrame):
-                output_path = os.path.join("data", output_file)
-                result.to_excel(output_path, index=False)
+                with span("resultado.exportacion", herramienta=self.name, formato=os.path.splitext(output_file)[1]):
+                    job = export_dataframe(result, output_file)
                 preview = result.head(5).to_string(index=False)
-                return (f"Resultado guardado en /data/{output_file}.\nPreview de los primeros registros:\n{preview}")
+                if job["estado"] != "completado":
+                    # Exportación grande: corre en segundo plano y su progreso se muestra en el chat
+                    return (f"Exportación de {job['filas']} filas en curso (trabajo {job['id']}); "
+                            f"el archivo quedará en /exports/{job['archivo']}.\n"
+                            f"Preview de los primeros registros:\n{preview}")
+                split = f" (repartido en {job['hojas']} hojas)" if (job.get("hojas") or 1) > 1 else ""
+                return (f"Resultado guardado en /exports/{job['archivo']}{split}.\nPreview de los primeros registros:\n{preview}")
             else:
-                return ("El resultado del análisis no es una tabla de datos (DataFrame), por lo que no se puede guardar en Excel. "
+                return ("El resultado del análisis no es una tabla de datos (DataFrame), por lo que no se puede guardar en un archivo. "
                         f"Resultado obtenido: {str(result)}")
         except Exception as e:
             return f"[Error] PandasAI falló: {e}"
 
-    def _arun(self, query: str, **kwargs) -> Any:
-        raise NotImplementedError("Esta herramienta no soporta ejecución asíncrona todavía.") 
\ No newline at end of file
+    def _compute(self, file_path: str, file_name: str, instruction: str, fingerprint: str,
+                 sheet: Optional[str] = None, cache_path: Optional[str] = None):
+        """Carga el archivo y ejecuta PandasAI. Devuelve (mensaje de error, None) o (None, resultado)."""
+        sheet_ref = 0 if sheet is None else sheet
+        try:
+            with span("archivo.carga", herramienta=self.name, archivo=file_name):
+                df = read_excel_cached(file_path, sheet_ref)
+        except Exception as e:
+            return f"[Error] No se pudo leer el archivo Excel: {e}", None
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return "[Error] No se encontró ninguna API key de OpenAI en las variables de entorno.", None
+        # Las exportaciones ceden el turno del modelo a las consultas interactivas
+        with pandasai_llms.lease(api_key) as llm, llm_priority_scope(PRIORITY_BACKGROUND):
+            llm_time = instrument_llm(llm)
+            with span("pandasai.chat", herramienta=self.name) as chat_time:
+                # El código generado corre en el pool aislado, con límites de CPU, tiempo y memoria
+                result = chat_with_sandbox(df, instruction, llm, (file_path, sheet_ref))
+        record("pandasai.codigo", chat_time["segundos"] - llm_time["segundos"], herramienta=self.name)
+        if is_cacheable_result(result):
+            result_cache.put(cache_path or file_path, fingerprint, instruction, result)
+        return None, result
+
+    async def _arun(self, query: str, **kwargs) -> Any:
+        """Ejecuta `_run` en el pool de herramientas para no bloquear el event loop."""
+        return await run_tool_async(self.name, self._run, query) 
\ No newline at end of file
@@ -1,48 +1,117 @@
 from langchain.tools import BaseTool
 from typing import Optional, Any, ClassVar
 import pandas as pd
-from pandasai import SmartDataframe
-from pandasai.llm import OpenAI
 import os
 import re
+from utils.async_executor import run_tool_async
+from utils.code_sandbox import chat_with_sandbox
+from utils.dataframe_cache import read_excel_cached
+from utils.excel_stream import MemoryLimitExceeded, aggregate_excel
+from utils.llm_scheduler import pandasai_llms
+from utils.metrics import instrument_llm, record, span
+from utils.query_planner import try_fast_path
+from utils.result_cache import (content_fingerprint, is_cacheable_result, normalize_instruction, result_cache,
+                                scope_to_sheet)
+from utils.result_store import store_and_describe
+from utils.sheet_catalog import SheetNotFoundError, resolve_sheet
+from utils.single_flight import single_flight
+
+_analyses = single_flight("analisis")
 
 class PandasAITool(BaseTool):
     name: ClassVar[str] = "pandasai_tool"
     description: ClassVar[str] = (
         "Herramienta para analizar archivos Excel usando PandasAI. "
-        "Uso: '<archivo.xlsx>: <instrucción en lenguaje natural>'."
+        "Uso: '<archivo.xlsx>: <instrucción en lenguaje natural>'. "
+        "Para analizar otra hoja que no sea la primera: '<archivo.xlsx>#<hoja>: <instrucción>'."
     )
 
     def _run(self, query: str, **kwargs) -> Any:
         """
-        Espera un string con formato: '<archivo.xlsx>: <instrucción>'
+        Espera un string con formato: '<archivo.xlsx>: <instrucción>' o '<archivo.xlsx>#<hoja>: <instrucción>'
         """
-        # Extraer archivo e instrucción
-        match = re.match(r"(.+\.xlsx|.+\.xls)\s*:\s*(.+)", query)
+        # Extraer archivo, hoja (opcional) e instrucción
+        match = re.match(r"(.+\.xlsx|.+\.xls)(?:#([^:]+))?\s*:\s*(.+)", query)
         if not match:
-            return "[Error] Formato incorrecto. Usa: <archivo.xlsx>: <instrucción>"
+            return "[Error] Formato incorrecto. Usa: <archivo.xlsx>: <instrucción> o <archivo.xlsx>#<hoja>: <instrucción>"
         file_name = match.group(1).strip()
-        instruction = match.group(2).strip()
+        instruction = match.group(3).strip()
         file_path = os.path.join("data", file_name)
         if not os.path.exists(file_path):
             return f"[Error] El archivo '{file_path}' no existe."
+        sheet = None
+        if match.group(2) and match.group(2).strip():
+            # Solo se parsea la hoja pedida; el nombre se valida contra el catálogo del libro
+            try:
+                sheet = resolve_sheet(file_path, match.group(2))
+            except SheetNotFoundError as e:
+                return f"[Error] {e}"
+            except Exception as e:
+                return f"[Error] No se pudo leer el archivo Excel: {e}"
+        # Si ya se respondió esta instrucción sobre este mismo contenido, no se vuelve a llamar a PandasAI
+        with span("cache.resultados", herramienta=self.name):
+            cache_path, fingerprint = scope_to_sheet(file_path, content_fingerprint(file_path), sheet)
+            cached = result_cache.get(fingerprint, instruction)
+        if cached is not None:
+            if isinstance(cached, pd.DataFrame):
+                with span("resultado.serializacion", herramienta=self.name):
+                    return store_and_describe(cached)
+            return cached
+        # Consultas idénticas en curso sobre el mismo contenido comparten una sola ejecución
+        key = (self.name, fingerprint, normalize_instruction(instruction))
+        return _analyses.do(key, self._analyze, file_path, file_name, instruction, fingerprint, sheet, cache_path)
+
+    def _analyze(self, file_path: str, file_name: str, instruction: str, fingerprint: str,
+                 sheet: Optional[str] = None, cache_path: Optional[str] = None) -> Any:
+        """Carga, ruta rápida o PandasAI; el resultado se comparte con las llamadas coalescidas."""
+        nota = ""
+        sheet_ref = 0 if sheet is None else sheet
         try:
-            df = pd.read_excel(file_path)
+            with span("archivo.carga", herramienta=self.name, archivo=file_name):
+                df = read_excel_cached(file_path, sheet_ref)
+        except MemoryLimitExceeded:
+            # La hoja no cabe en memoria: se analiza un resumen por columna calculado por bloques
+            try:
+                with span("archivo.resumen_por_bloques", herramienta=self.name, archivo=file_name):
+                    df = aggregate_excel(file_path, sheet_ref)
+            except Exception as e:
+                return f"[Error] No se pudo leer el archivo Excel: {e}"
+            nota = ("[Aviso] El archivo es demasiado grande para cargarlo completo; "
+                    "el análisis se hizo sobre un resumen por columna (conteo, nulos, suma, mínimo, máximo, media).\n")
         except Exception as e:
             return f"[Error] No se pudo leer el archivo Excel: {e}"
+        # Consultas simples (máximos, sumas, conteos, filtros) se resuelven sin LLM
+        if not nota:
+            with span("ruta_rapida", herramienta=self.name):
+                fast_result = try_fast_path(instruction, df)
+            if fast_result is not None:
+                if isinstance(fast_result, pd.DataFrame):
+                    with span("resultado.serializacion", herramienta=self.name):
+                        return store_and_describe(fast_result)
+                return str(fast_result)
         try:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 return "[Error] No se encontró ninguna API key de OpenAI en las variables de entorno."
-            llm = OpenAI(api_token=api_key)
-            sdf = SmartDataframe(df, config={"llm": llm})
-            result = sdf.chat(instruction)
-            # Si el resultado es un DataFrame, conviértelo a string
+            # El LLM sale del pool compartido y cada llamada al modelo pasa por el planificador
+            with pandasai_llms.lease(api_key) as llm:
+                llm_time = instrument_llm(llm)
+                with span("pandasai.chat", herramienta=self.name) as chat_time:
+                    # El código generado corre en el pool aislado, con límites de CPU, tiempo y memoria
+                    result = chat_with_sandbox(df, instruction, llm, None if nota else (file_path, sheet_ref))
+            # Lo que no fue llamada al modelo es generación de prompt y ejecución del código generado
+            record("pandasai.codigo", chat_time["segundos"] - llm_time["segundos"], herramienta=self.name)
+            # Las respuestas sobre el resumen por columna no se guardan: no son del archivo completo
+            if not nota and is_cacheable_result(result):
+                result_cache.put(cache_path or file_path, fingerprint, instruction, result)
+            # Si el resultado es un DataFrame, se guarda en el almacén y se devuelve un resumen con su handle
             if isinstance(result, pd.DataFrame):
-                return result.to_string(index=False)
-            return result
+                with span("resultado.serializacion", herramienta=self.name):
+                    return nota + store_and_describe(result)
+            return f"{nota}{result}" if nota else result
         except Exception as e:
             return f"[Error] PandasAI falló: {e}"
 
-    def _arun(self, query: str, **kwargs) -> Any:
-        raise NotImplementedError("PandasAITool no soporta ejecución asíncrona todavía.") 
\ No newline at end of file
+    async def _arun(self, query: str, **kwargs) -> Any:
+        """Ejecuta `_run` en el pool de herramientas para no bloquear el event loop."""
+        return await run_tool_async(self.name, self._run, query) 
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Ejecución asíncrona de las herramientas de Excel.
+
+El parseo de archivos y las llamadas a PandasAI son bloqueantes; si se ejecutan
+directamente dentro del event loop de Chainlit congelan el streaming de todas las
+sesiones del worker. Aquí se delegan a un pool de hilos acotado, con un límite de
+concurrencia por herramienta, cancelación y métricas de cola.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# Hilos totales dedicados a herramientas de Excel
+TOOL_POOL_WORKERS = int(os.getenv("EXCEL_TOOL_WORKERS", "8"))
+# Ejecuciones simultáneas permitidas por herramienta
+TOOL_CONCURRENCY = int(os.getenv("EXCEL_TOOL_CONCURRENCY", "4"))
+
+_pool = ThreadPoolExecutor(max_workers=TOOL_POOL_WORKERS, thread_name_prefix="excel-tool")
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _tool_stats(tool_name: str) -> Dict[str, int]:
+    with _stats_lock:
+        return _stats.setdefault(tool_name, {
+            "en_cola": 0, "en_ejecucion": 0, "completadas": 0,
+            "fallidas": 0, "canceladas": 0, "max_en_cola": 0,
+        })
+
+
+def _bump(tool_name: str, field: str, delta: int = 1) -> None:
+    stats = _tool_stats(tool_name)
+    with _stats_lock:
+        stats[field] += delta
+        if field == "en_cola":
+            stats["max_en_cola"] = max(stats["max_en_cola"], stats["en_cola"])
+
+
+def _semaphore(tool_name: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(tool_name)
+    if sem is None:
+        sem = _semaphores[tool_name] = asyncio.Semaphore(TOOL_CONCURRENCY)
+    return sem
+
+
+async def run_tool_async(tool_name: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta `func(*args, **kwargs)` en el pool sin bloquear el event loop.
+
+    Si la tarea que espera se cancela (p. ej. el usuario se desconecta), la ejecución
+    se descarta si aún estaba en cola; si ya estaba corriendo, el hilo termina por su
+    cuenta y su resultado se ignora.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    _bump(tool_name, "en_cola")
+    queued = True
+    try:
+        async with _semaphore(tool_name):
+            future = loop.run_in_executor(_pool, lambda: ctx.run(func, *args, **kwargs))
+            _bump(tool_name, "en_cola", -1)
+            queued = False
+            _bump(tool_name, "en_ejecucion")
+            try:
+                result = await future
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            finally:
+                _bump(tool_name, "en_ejecucion", -1)
+        _bump(tool_name, "completadas")
+        return result
+    except asyncio.CancelledError:
+        _bump(tool_name, "canceladas")
+        raise
+    except Exception:
+        _bump(tool_name, "fallidas")
+        raise
+    finally:
+        if queued:
+            _bump(tool_name, "en_cola", -1)
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    """Copia de las métricas por herramienta (profundidad de cola, en ejecución, completadas...)."""
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,369 @@
+"""
+Ejecución aislada del código pandas que genera PandasAI.
+
+`SmartDataframe.chat` ejecuta el código generado dentro del proceso de Chainlit: una
+consulta patológica (un merge cartesiano, un `apply` fila por fila sobre 1M de filas)
+ocupa un núcleo e infla la memoria de todas las sesiones del worker. Aquí el código se
+genera en el proceso principal y se ejecuta en un pool de procesos pre-creados:
+- los workers nacen de un forkserver con pandas y numpy ya importados,
+- los DataFrames con sidecar Arrow se abren por memory-map en el worker (las páginas
+  se comparten a través del page cache en lugar de copiarse por el pipe),
+- cada trabajo tiene límites de tiempo de CPU (RLIMIT_CPU), de reloj y de memoria (RLIMIT_AS);
+  el worker que los excede se termina y se reemplaza,
+- hay a lo sumo un trabajo por worker y los workers se reparten entre los núcleos,
+- el código corre con builtins restringidos: sin `open`, `eval`, `exec` ni acceso a atributos
+  dunder, y solo puede importar los módulos de `SANDBOX_ALLOWED_IMPORTS`.
+
+El pool es un limitador de recursos, no una frontera de seguridad. Los builtins restringidos
+frenan los descuidos habituales del código generado, pero `pd` y `np` siguen dando acceso al
+sistema de archivos (`pd.read_csv`, `df.to_csv`, `pd.io.common.os`...) con los permisos del
+proceso; los gráficos se escriben en disco, así que tampoco se limita la escritura a nivel de
+sistema operativo. Quien necesite aislar el disco debe correr la app con un usuario y un sistema
+de archivos acotados (contenedor, chroot).
+"""
+import ast
+import builtins
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import sys
+import threading
+import traceback
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+from utils.frame_optimizer import optimize_frame, widen_frame
+from utils.metrics import span
+from utils.sidecar import SheetRef, is_sidecar_valid, read_sidecar
+
+SANDBOX_ENABLED = os.getenv("PANDASAI_SANDBOX", "true").lower() in ("1", "true", "yes")
+# Procesos del pool (por defecto, uno por núcleo)
+SANDBOX_WORKERS = int(os.getenv("PANDASAI_SANDBOX_WORKERS", str(os.cpu_count() or 2)))
+# Límites por trabajo
+SANDBOX_CPU_SECONDS = int(os.getenv("PANDASAI_SANDBOX_CPU_SECONDS", "30"))
+SANDBOX_WALL_SECONDS = float(os.getenv("PANDASAI_SANDBOX_WALL_SECONDS", "60"))
+SANDBOX_MEMORY_BYTES = int(os.getenv("PANDASAI_SANDBOX_MEMORY_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Trabajos tras los cuales un worker se recicla (evita acumular memoria fragmentada)
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("PANDASAI_SANDBOX_MAX_JOBS_PER_WORKER", "100"))
+# DataFrames que cada worker mantiene abiertos entre trabajos
+WORKER_FRAME_CACHE = 4
+# Módulos (raíz) que el código generado puede importar, separados por comas
+SANDBOX_ALLOWED_IMPORTS = frozenset(m.strip() for m in os.getenv(
+    "PANDASAI_SANDBOX_ALLOWED_IMPORTS",
+    "pandas,numpy,matplotlib,seaborn,math,datetime,statistics,re,json,collections,itertools,functools,decimal",
+).split(",") if m.strip())
+
+# Builtins que el código generado no puede usar
+_BLOCKED_BUILTINS = frozenset({
+    "open", "eval", "exec", "compile", "input", "breakpoint", "help", "globals", "locals", "vars",
+    "getattr", "setattr", "delattr", "memoryview", "exit", "quit", "copyright", "credits", "license",
+})
+
+
+class SandboxLimitExceeded(RuntimeError):
+    """El código generado excedió un límite de CPU, tiempo o memoria."""
+
+
+class SandboxExecutionError(RuntimeError):
+    """El código generado lanzó una excepción (el mensaje incluye el traceback)."""
+
+
+class SandboxResultError(SandboxExecutionError):
+    """El código generado terminó sin definir `result` con el formato {'type': ..., 'value': ...}."""
+
+
+class SandboxSecurityError(SandboxExecutionError):
+    """El código generado usa un import, builtin o atributo que el sandbox no admite."""
+
+
+class _Blocked(Exception):
+    pass
+
+
+class _MissingResult(Exception):
+    pass
+
+
+# --- Lado del worker ---
+
+def _load_frame(source: Optional[Tuple[str, SheetRef]], payload: Optional[pd.DataFrame],
+                frames: Dict[Tuple, pd.DataFrame]) -> pd.DataFrame:
+    if payload is not None:
+        return payload
+    path, sheet = source
+    key = (os.path.abspath(path), sheet, os.stat(path).st_mtime_ns)
+    df = frames.get(key)
+    if df is None:
+        df = read_sidecar(path, sheet)
+        if df is None:
+            raise FileNotFoundError(f"No hay sidecar válido para '{path}'")
+        # El sidecar guarda la hoja sin optimizar: se repite el camino del proceso principal
+        # (optimizar y ensanchar) para que el código vea los mismos tipos que vio el LLM
+        df = widen_frame(optimize_frame(df, path, sheet))
+        if len(frames) >= WORKER_FRAME_CACHE:
+            frames.pop(next(iter(frames)))
+        frames[key] = df
+    # El código generado puede modificar el DataFrame; la copia superficial protege la caché
+    return df.copy(deep=False)
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name.partition(".")[0] not in SANDBOX_ALLOWED_IMPORTS:
+        raise _Blocked(f"El código generado no puede importar '{name}'")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+def _safe_builtins() -> Dict[str, Any]:
+    safe = {name: value for name, value in vars(builtins).items() if name not in _BLOCKED_BUILTINS}
+    safe["__import__"] = _safe_import
+    return safe
+
+
+def _check_code(tree: ast.AST) -> None:
+    # Los atributos dunder (`__class__`, `__subclasses__`, `__globals__`...) permiten salir de los builtins restringidos
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
+            raise _Blocked(f"El código generado no puede acceder a '{node.attr}'")
+        if isinstance(node, ast.Name) and node.id.startswith("__") and node.id != "__name__":
+            raise _Blocked(f"El código generado no puede usar '{node.id}'")
+
+
+def _execute(code: str, df: pd.DataFrame) -> Dict[str, Any]:
+    import numpy as np
+
+    tree = ast.parse(code, "<codigo_generado>")
+    _check_code(tree)
+    env = {"dfs": [df], "pd": pd, "np": np, "__name__": "__codigo_generado__", "__builtins__": _safe_builtins()}
+    exec(compile(tree, "<codigo_generado>", "exec"), env)
+    result = env.get("result")
+    if not isinstance(result, dict) or "value" not in result:
+        raise _MissingResult("El código generado no definió `result` con el formato {'type': ..., 'value': ...}")
+    return result
+
+
+def _worker_main(conn, core: Optional[int], memory_bytes: int) -> None:
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError:
+            pass
+    if memory_bytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, hard))
+    frames: Dict[Tuple, pd.DataFrame] = {}
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        code, source, payload, cpu_seconds = job
+        # RLIMIT_CPU es acumulado por proceso: el límite se corre con lo ya consumido
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime) + cpu_seconds, hard))
+        try:
+            conn.send(("ok", _execute(code, _load_frame(source, payload, frames))))
+        except MemoryError:
+            frames.clear()
+            conn.send(("memoria", "El código generado excedió el límite de memoria."))
+            return
+        except _Blocked as e:
+            conn.send(("bloqueado", str(e)))
+        except _MissingResult as e:
+            conn.send(("resultado", str(e)))
+        except Exception:
+            conn.send(("error", traceback.format_exc(limit=-3)))
+
+
+# --- Lado del proceso principal ---
+
+def _context():
+    if sys.platform.startswith("linux"):
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["pandas", "numpy", "utils.sidecar", "utils.frame_optimizer"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+class _Worker:
+    def __init__(self, process, conn, core: Optional[int]):
+        self.process = process
+        self.conn = conn
+        self.core = core
+        self.jobs = 0
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    """Pool de procesos pre-creados que ejecutan código generado con límites por trabajo."""
+
+    def __init__(self, workers: int = SANDBOX_WORKERS, memory_bytes: int = SANDBOX_MEMORY_BYTES,
+                 max_jobs_per_worker: int = SANDBOX_MAX_JOBS_PER_WORKER):
+        self.workers = max(1, workers)
+        self.memory_bytes = memory_bytes
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._ctx = None
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {"ejecutados": 0, "errores": 0, "limite_tiempo": 0, "limite_cpu": 0,
+                       "limite_memoria": 0, "reciclados": 0, "sin_resultado": 0, "bloqueados": 0}
+
+    def _spawn(self, core: Optional[int]) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn, core, self.memory_bytes),
+                                    name="pandasai-sandbox", daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn, core)
+
+    def start(self) -> None:
+        """Crea los workers por adelantado (se llama sola en el primer trabajo)."""
+        with self._lock:
+            if self._started:
+                return
+            self._ctx = _context()
+            cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+            for i in range(self.workers):
+                self._idle.put(self._spawn(cores[i % len(cores)] if cores else None))
+            self._started = True
+
+    def _bump(self, field: str) -> None:
+        with self._lock:
+            self._stats[field] += 1
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        self._idle.put(self._spawn(worker.core))
+
+    def run(self, code: str, df: Optional[pd.DataFrame] = None, source: Optional[Tuple[str, SheetRef]] = None,
+            cpu_seconds: int = SANDBOX_CPU_SECONDS, wall_seconds: float = SANDBOX_WALL_SECONDS) -> Dict[str, Any]:
+        """
+        Ejecuta `code` con `dfs = [df]` y devuelve el dict `result` que define el código.
+        Si `source` (archivo, hoja) tiene sidecar válido, el worker abre el DataFrame por
+        memory-map en lugar de recibirlo por el pipe.
+        """
+        self.start()
+        payload = None if source is not None and is_sidecar_valid(*source) else df
+        if payload is None and source is None:
+            raise ValueError("Se necesita un DataFrame o un archivo de origen")
+        # Sin workers libres, el trabajo espera su turno: nunca hay más trabajos que núcleos asignados
+        worker = self._idle.get()
+        try:
+            with span("pandasai.sandbox"):
+                worker.conn.send((code, source if payload is None else None, payload, cpu_seconds))
+                if not worker.conn.poll(wall_seconds):
+                    self._bump("limite_tiempo")
+                    self._replace(worker)
+                    worker = None
+                    raise SandboxLimitExceeded(
+                        f"La consulta superó el límite de {wall_seconds:.0f} s de ejecución y se canceló.")
+                try:
+                    status, value = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(timeout=5)
+                    exitcode = worker.process.exitcode
+                    self._replace(worker)
+                    worker = None
+                    if exitcode == -getattr(signal, "SIGXCPU", 24):
+                        self._bump("limite_cpu")
+                        raise SandboxLimitExceeded(
+                            f"La consulta superó el límite de {cpu_seconds} s de CPU y se canceló.")
+                    self._bump("limite_memoria")
+                    raise SandboxLimitExceeded("El proceso que ejecutaba la consulta terminó (posible falta de memoria).")
+        except BaseException:
+            if worker is not None:
+                # El worker pudo quedar a medio trabajo: se reemplaza por uno limpio
+                self._replace(worker)
+                worker = None
+            raise
+        finally:
+            if worker is not None:
+                worker.jobs += 1
+                if not worker.process.is_alive() or worker.jobs >= self.max_jobs_per_worker:
+                    self._bump("reciclados")
+                    self._replace(worker)
+                else:
+                    self._idle.put(worker)
+
+        if status == "ok":
+            self._bump("ejecutados")
+            return value
+        if status == "memoria":
+            self._bump("limite_memoria")
+            raise SandboxLimitExceeded(value)
+        if status == "resultado":
+            self._bump("sin_resultado")
+            raise SandboxResultError(value)
+        if status == "bloqueado":
+            self._bump("bloqueados")
+            raise SandboxSecurityError(value)
+        self._bump("errores")
+        raise SandboxExecutionError(value)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, workers=self.workers, libres=self._idle.qsize())
+
+    def shutdown(self) -> None:
+        with self._lock:
+            while not self._idle.empty():
+                worker = self._idle.get_nowait()
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.kill()
+            self._started = False
+
+
+sandbox_pool = SandboxPool()
+
+
+def _parse_result(result: Dict[str, Any]) -> Any:
+    # Mismo contrato que el parser de respuestas de PandasAI: tablas, números, texto o ruta del gráfico
+    value = result["value"]
+    if result.get("type") == "dataframe" and not isinstance(value, pd.DataFrame):
+        return pd.DataFrame(value)
+    return value
+
+
+def chat_with_sandbox(df: pd.DataFrame, instruction: str, llm: Any,
+                      source: Optional[Tuple[str, SheetRef]] = None) -> Any:
+    """
+    Equivalente a `SmartDataframe(df).chat(instruction)`, pero el código generado se
+    ejecuta en el pool aislado. Si el código falla, no define `result` o el sandbox lo rechaza,
+    se pide al LLM una corrección una vez.
+    """
+    from pandasai import Agent, SmartDataframe
+
+    # El código generado espera los tipos habituales de pandas, no los compactos de la caché
+    df = widen_frame(df)
+    if not SANDBOX_ENABLED:
+        # En proceso, el código generado podría modificar el DataFrame de la caché
+        return SmartDataframe(df.copy(), config={"llm": llm}).chat(instruction)
+    agent = Agent(df, config={"llm": llm})
+    code = agent.generate_code(instruction)
+    try:
+        return _parse_result(sandbox_pool.run(code, df, source))
+    except SandboxResultError:
+        retry = (f"{instruction}\n\nEl código anterior no definió la variable `result`; termina el código "
+                 "con `result = {'type': ..., 'value': ...}`.")
+    except SandboxSecurityError as e:
+        retry = (f"{instruction}\n\nEl código anterior fue rechazado ({e}); trabaja sobre `dfs[0]` con pandas, "
+                 "numpy y matplotlib, sin importar otros módulos ni usar atributos dunder.")
+    except SandboxExecutionError as e:
+        retry = (f"{instruction}\n\nEl código anterior falló con este error; corrígelo:\n{e}")
+    code = agent.generate_code(retry)
+    return _parse_result(sandbox_pool.run(code, df, source))
@@ -0,0 +1,196 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple, Union
+
+import pandas as pd
+
+from utils.frame_optimizer import optimize_frame
+from utils.shared_cache import shared_cache
+from utils.sheet_catalog import canonical_sheet_ref
+from utils.sheet_versions import sheet_version
+from utils.sidecar import read_excel_columnar
+from utils.single_flight import single_flight
+
+# Límite total (en bytes) de memoria que pueden ocupar los DataFrames cacheados
+DEFAULT_MAX_BYTES = int(os.getenv("EXCEL_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+SheetRef = Union[int, str]
+CacheKey = Tuple[str, str, SheetRef]
+
+
+def file_fingerprint(path: str, sheet_name: SheetRef = 0) -> CacheKey:
+    """
+    Devuelve la huella de una hoja: (ruta absoluta, versión de la hoja, hoja).
+    Si la hoja cambia en disco, la huella cambia y la entrada anterior deja de usarse; si solo
+    cambiaron otras hojas del libro, la huella se mantiene (ver utils/sheet_versions.py).
+    La hoja se normaliza: la primera hoja pedida por índice o por nombre tiene una sola huella.
+    """
+    sheet_name = canonical_sheet_ref(path, sheet_name)
+    return (os.path.abspath(path), sheet_version(path, sheet_name), sheet_name)
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Memoria real ocupada por un DataFrame (incluye el contenido de columnas object)."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+class DataFrameCache:
+    """
+    Caché LRU de DataFrames ya parseados, compartida por todo el proceso.
+    La expulsión se hace por el total de bytes ocupados, no por número de entradas.
+    Las entradas cargadas por el prefetch (ver utils/prefetch.py) se marcan hasta su primer uso:
+    si se usan cuentan como acierto del prefetch y si salen de la caché sin usarse, como desperdicio.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._prefetched: Set[CacheKey] = set()
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+        self.prefetch_wasted_bytes = 0
+
+    def get(self, key: CacheKey) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._claim(key)
+            return entry[0]
+
+    def __contains__(self, key: CacheKey) -> bool:
+        # Consulta sin efectos: no cuenta como acierto ni cambia el orden LRU
+        with self._lock:
+            return key in self._entries
+
+    def claim(self, key: CacheKey) -> None:
+        """Marca como usada una entrada del prefetch (p. ej. tras esperar su carga en curso)."""
+        with self._lock:
+            self._claim(key)
+
+    def _claim(self, key: CacheKey) -> None:
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+            self.prefetch_hits += 1
+
+    def put(self, key: CacheKey, df: pd.DataFrame, prefetched: bool = False) -> None:
+        size = frame_nbytes(df)
+        with self._lock:
+            # Las versiones anteriores del mismo archivo/hoja ya no sirven
+            for old_key in [k for k in self._entries if k[0] == key[0] and k[2] == key[2] and k != key]:
+                self._remove(old_key)
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # Un DataFrame más grande que toda la caché no se guarda
+                return
+            self._entries[key] = (df, size)
+            self._total_bytes += size
+            if prefetched:
+                self._prefetched.add(key)
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: CacheKey) -> None:
+        _, size = self._entries.pop(key)
+        self._total_bytes -= size
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+            self.prefetch_wasted += 1
+            self.prefetch_wasted_bytes += size
+
+    def prefetched_bytes(self) -> int:
+        """Bytes de las entradas del prefetch que todavía no se usaron."""
+        with self._lock:
+            return sum(self._entries[k][1] for k in self._prefetched)
+
+    def discard_stale(self, abs_path: str, versions: Set[str]) -> int:
+        """Quita las hojas de un archivo cuya versión ya no es ninguna de `versions`."""
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == abs_path and k[1] not in versions]
+            for key in stale:
+                self._remove(key)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._prefetched.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "prefetch_hits": self.prefetch_hits,
+                "prefetch_desperdiciadas": self.prefetch_wasted,
+                "prefetch_bytes_desperdiciados": self.prefetch_wasted_bytes,
+                "prefetch_pendientes": len(self._prefetched),
+            }
+
+
+dataframe_cache = DataFrameCache()
+
+
+_loads = single_flight("carga_excel")
+
+
+def _load(key: CacheKey, path: str, sheet_name: SheetRef, prefetched: bool = False) -> pd.DataFrame:
+    # Si otro worker ya cargó la hoja, se adjunta su copia en memoria compartida (ver utils/shared_cache.py)
+    df = shared_cache.attach(key)
+    if df is None:
+        with shared_cache.building(key):
+            df = shared_cache.attach(key)
+            if df is None:
+                # Los tipos compactos permiten mantener más archivos en la caché
+                df = optimize_frame(read_excel_columnar(path, sheet_name), path, sheet_name)
+                if shared_cache.put(key, df, key[0], sheet_name, key[1]):
+                    # Este proceso también usa la copia compartida en lugar de la privada
+                    shared = shared_cache.attach(key)
+                    df = df if shared is None else shared
+    dataframe_cache.put(key, df, prefetched)
+    return df
+
+
+def read_excel_cached(path: str, sheet_name: SheetRef = 0) -> pd.DataFrame:
+    """
+    Lee un archivo Excel pasando por la caché del proceso; en un fallo de caché
+    se carga desde el sidecar columnar (ver utils/sidecar.py).
+    Devuelve el DataFrame cacheado (en memoria compartida, sin copiar): quien lo vaya a modificar
+    debe copiarlo antes, como hace `chat_with_sandbox` con el código generado por PandasAI.
+    """
+    key = file_fingerprint(path, sheet_name)
+    df = dataframe_cache.get(key)
+    if df is None:
+        # Lecturas simultáneas del mismo archivo y hoja comparten un solo parseo
+        df = _loads.do(key, _load, key, path, key[2])
+        # Si la carga la había empezado el prefetch, esta lectura la aprovecha
+        dataframe_cache.claim(key)
+    return df
+
+
+def warm_excel_cache(path: str, sheet_name: SheetRef = 0) -> bool:
+    """
+    Carga una hoja en la caché sin devolver copia, marcada como prefetch.
+    Devuelve False si ya estaba cacheada.
+    """
+    key = file_fingerprint(path, sheet_name)
+    if key in dataframe_cache:
+        return False
+    _loads.do(key, _load, key, path, key[2], True)
+    return True
@@ -0,0 +1,147 @@
+"""
+Lectura por bloques de archivos Excel muy grandes.
+
+`pd.read_excel` materializa toda la hoja y su pico de memoria es varias veces el
+DataFrame final. Aquí se recorre la hoja con openpyxl en modo `read_only`, fila a fila,
+y se entregan DataFrames tipados de tamaño configurable, de forma que se pueden
+calcular agregaciones sin tener la hoja completa en memoria.
+"""
+import os
+from typing import Dict, Iterator, Optional, Set, Union
+
+import numpy as np
+import pandas as pd
+
+# Archivos por encima de este tamaño se leen por bloques en lugar de con pd.read_excel
+STREAMING_THRESHOLD_BYTES = int(os.getenv("EXCEL_STREAMING_THRESHOLD_BYTES", str(50 * 1024 * 1024)))
+# Filas por bloque
+STREAMING_CHUNK_ROWS = int(os.getenv("EXCEL_STREAMING_CHUNK_ROWS", "50000"))
+# Memoria máxima que puede ocupar un DataFrame armado a partir de bloques
+STREAMING_MAX_MEMORY_BYTES = int(os.getenv("EXCEL_STREAMING_MAX_MEMORY_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+SheetRef = Union[int, str]
+
+
+class MemoryLimitExceeded(MemoryError):
+    """La hoja no cabe en el límite de memoria configurado."""
+
+
+def _unique_headers(values) -> list:
+    headers, seen = [], {}
+    for i, value in enumerate(values):
+        name = str(value) if value is not None else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+
+def iter_excel_chunks(path: str, sheet_name: SheetRef = 0,
+                      chunk_rows: int = STREAMING_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Recorre una hoja .xlsx en modo streaming y entrega DataFrames de hasta `chunk_rows` filas.
+    La primera fila se usa como encabezado, igual que `pd.read_excel`.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet_name] if isinstance(sheet_name, int) else wb[sheet_name]
+        rows = ws.iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            return
+        columns = _unique_headers(header_row)
+        width = len(columns)
+        buffer = []
+        for row in rows:
+            buffer.append(row[:width])
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame.from_records(buffer, columns=columns).infer_objects()
+                buffer = []
+        if buffer:
+            yield pd.DataFrame.from_records(buffer, columns=columns).infer_objects()
+    finally:
+        wb.close()
+
+
+def read_excel_streaming(path: str, sheet_name: SheetRef = 0,
+                         chunk_rows: int = STREAMING_CHUNK_ROWS,
+                         max_memory_bytes: int = STREAMING_MAX_MEMORY_BYTES) -> pd.DataFrame:
+    """
+    Arma el DataFrame completo a partir de bloques, con pico de memoria cercano al tamaño final.
+    Lanza MemoryLimitExceeded si el acumulado supera `max_memory_bytes`.
+    """
+    chunks, total = [], 0
+    for chunk in iter_excel_chunks(path, sheet_name, chunk_rows):
+        total += int(chunk.memory_usage(deep=True).sum())
+        if total > max_memory_bytes:
+            raise MemoryLimitExceeded(
+                f"La hoja supera el límite de memoria configurado ({max_memory_bytes} bytes)."
+            )
+        chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_excel_auto(path: str, sheet_name: SheetRef = 0) -> pd.DataFrame:
+    """Usa el lector por bloques para .xlsx que superan el umbral y `pd.read_excel` para el resto."""
+    if path.lower().endswith(".xlsx") and os.path.getsize(path) > STREAMING_THRESHOLD_BYTES:
+        return read_excel_streaming(path, sheet_name)
+    return pd.read_excel(path, sheet_name=sheet_name)
+
+
+class StreamingAggregator:
+    """
+    Acumula estadísticas por columna bloque a bloque: conteo, nulos, suma, mínimo, máximo y media.
+    Solo guarda unos pocos valores por columna, así que la memoria no depende del número de filas.
+    """
+    def __init__(self):
+        self.rows = 0
+        self._stats: Dict[str, Dict[str, object]] = {}
+        # Columnas con números en unos bloques y texto en otros: sin suma, mínimo ni máximo
+        self._mixed: Set[str] = set()
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        self.rows += len(chunk)
+        for column in chunk.columns:
+            series = chunk[column]
+            stats = self._stats.setdefault(column, {"conteo": 0, "nulos": 0, "suma": None, "minimo": None, "maximo": None})
+            non_null = series.dropna()
+            stats["conteo"] += len(non_null)
+            stats["nulos"] += len(series) - len(non_null)
+            if non_null.empty or column in self._mixed:
+                continue
+            try:
+                chunk_min, chunk_max = non_null.min(), non_null.max()
+                minimo = chunk_min if stats["minimo"] is None else min(stats["minimo"], chunk_min)
+                maximo = chunk_max if stats["maximo"] is None else max(stats["maximo"], chunk_max)
+            except TypeError:
+                # Tipos mezclados, dentro del bloque o entre bloques: no tienen orden total
+                self._mixed.add(column)
+                stats["suma"] = stats["minimo"] = stats["maximo"] = None
+                continue
+            stats["minimo"], stats["maximo"] = minimo, maximo
+            if pd.api.types.is_numeric_dtype(non_null) and not pd.api.types.is_bool_dtype(non_null):
+                chunk_sum = non_null.sum()
+                stats["suma"] = chunk_sum if stats["suma"] is None else stats["suma"] + chunk_sum
+
+    def result(self) -> pd.DataFrame:
+        records = []
+        for column, stats in self._stats.items():
+            media = stats["suma"] / stats["conteo"] if stats["suma"] is not None and stats["conteo"] else np.nan
+            records.append({"columna": column, **stats, "media": media})
+        return pd.DataFrame.from_records(records, columns=["columna", "conteo", "nulos", "suma", "minimo", "maximo", "media"])
+
+
+def aggregate_excel(path: str, sheet_name: SheetRef = 0,
+                    chunk_rows: int = STREAMING_CHUNK_ROWS) -> pd.DataFrame:
+    """Resumen por columna de una hoja completa calculado de forma incremental."""
+    aggregator = StreamingAggregator()
+    for chunk in iter_excel_chunks(path, sheet_name, chunk_rows):
+        aggregator.update(chunk)
+    return aggregator.result()
@@ -0,0 +1,244 @@
+"""
+Exportación de resultados a archivo.
+
+El formato se elige por la extensión de salida:
+- .xlsx: escritor en streaming de memoria constante (xlsxwriter `constant_memory`;
+  si no está instalado, openpyxl en modo `write_only`); lo que no cabe en una hoja de Excel
+  (1.048.576 filas con el encabezado) se reparte en varias hojas,
+- .csv, .parquet y .feather: formatos rápidos para resultados grandes.
+
+Las exportaciones grandes se ejecutan como trabajos en segundo plano con progreso
+consultable; la herramienta responde en cuanto el trabajo queda en cola.
+"""
+import itertools
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from utils.session_context import current_session_id
+
+EXPORTS_DIR = "exports"
+EXPORT_FORMATS = (".xlsx", ".csv", ".parquet", ".feather")
+# A partir de este número de filas la exportación se hace en segundo plano
+EXPORT_BACKGROUND_ROWS = int(os.getenv("EXCEL_EXPORT_BACKGROUND_ROWS", "50000"))
+# Filas escritas entre cada actualización de progreso
+EXPORT_PROGRESS_ROWS = 10000
+EXPORT_WORKERS = int(os.getenv("EXCEL_EXPORT_WORKERS", "2"))
+# Segundos que se conserva el estado de un trabajo terminado, y cuántos terminados como máximo
+EXPORT_JOBS_TTL = int(os.getenv("EXCEL_EXPORT_JOBS_TTL", "3600"))
+EXPORT_JOBS_MAX_FINISHED = int(os.getenv("EXCEL_EXPORT_JOBS_MAX_FINISHED", "256"))
+# Límites de una hoja de Excel
+XLSX_MAX_ROWS = 1_048_576
+XLSX_MAX_COLUMNS = 16_384
+_FINISHED = ("completado", "error")
+
+ProgressCallback = Optional[Callable[[float], None]]
+
+
+def _cell(value):
+    # Los escritores de xlsx no aceptan NaN/NaT
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def xlsx_sheet_count(rows: int) -> int:
+    """Hojas que ocupa un resultado de `rows` filas en .xlsx (cada hoja repite el encabezado)."""
+    return max((rows + XLSX_MAX_ROWS - 2) // (XLSX_MAX_ROWS - 1), 1)
+
+
+def _write_xlsx(df: pd.DataFrame, path: str, progress: ProgressCallback) -> None:
+    if len(df.columns) > XLSX_MAX_COLUMNS:
+        raise ValueError(f"El resultado tiene {len(df.columns)} columnas; una hoja de Excel admite "
+                         f"{XLSX_MAX_COLUMNS}. Usa .csv, .parquet o .feather.")
+    total = max(len(df), 1)
+    per_sheet = XLSX_MAX_ROWS - 1
+    header = [str(c) for c in df.columns]
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True,
+                                              "remove_timezone": True})
+        try:
+            date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+            sheet = None
+            for n, row in enumerate(df.itertuples(index=False, name=None)):
+                i = n % per_sheet + 1
+                if i == 1:
+                    sheet = workbook.add_worksheet(f"Hoja{n // per_sheet + 1}")
+                    sheet.write_row(0, 0, header)
+                for j, value in enumerate(row):
+                    value = _cell(value)
+                    if isinstance(value, pd.Timestamp):
+                        status = sheet.write_datetime(i, j, value.to_pydatetime(), date_format)
+                    elif value is not None:
+                        status = sheet.write(i, j, value if isinstance(value, (int, float, str, bool)) else str(value))
+                    else:
+                        continue
+                    # xlsxwriter no lanza excepciones: devuelve -1 (fuera de rango) o -2 (texto truncado)
+                    if status is not None and status < 0:
+                        raise ValueError(f"No se pudo escribir la celda ({i}, {j}) en el .xlsx (código {status}).")
+                if progress and (n + 1) % EXPORT_PROGRESS_ROWS == 0:
+                    progress((n + 1) / total)
+            if sheet is None:
+                workbook.add_worksheet("Hoja1").write_row(0, 0, header)
+        finally:
+            workbook.close()
+        return
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    for n, row in enumerate(df.itertuples(index=False, name=None)):
+        if n % per_sheet == 0:
+            sheet = workbook.create_sheet(f"Hoja{n // per_sheet + 1}")
+            sheet.append(header)
+        sheet.append([_cell(v) for v in row])
+        if progress and (n + 1) % EXPORT_PROGRESS_ROWS == 0:
+            progress((n + 1) / total)
+    if sheet is None:
+        workbook.create_sheet("Hoja1").append(header)
+    workbook.save(path)
+
+
+def _write_csv(df: pd.DataFrame, path: str, progress: ProgressCallback) -> None:
+    total = max(len(df), 1)
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        for start in range(0, max(len(df), 1), EXPORT_PROGRESS_ROWS):
+            df.iloc[start:start + EXPORT_PROGRESS_ROWS].to_csv(fh, index=False, header=start == 0)
+            if progress:
+                progress(min(start + EXPORT_PROGRESS_ROWS, total) / total)
+
+
+def write_result(df: pd.DataFrame, path: str, progress: ProgressCallback = None) -> str:
+    """Escribe el DataFrame en el formato que indica la extensión de `path`."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: '{extension}'. Usa uno de: {', '.join(EXPORT_FORMATS)}")
+    target_dir = os.path.dirname(path) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    # Se escribe a un temporal único en el mismo directorio: nunca queda visible un archivo a medias
+    # y dos exportaciones simultáneas al mismo nombre no escriben sobre el mismo temporal
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix=f".{os.path.basename(path)}.", suffix=".part")
+    os.close(fd)
+    try:
+        if extension == ".xlsx":
+            _write_xlsx(df, tmp_path, progress)
+        elif extension == ".csv":
+            _write_csv(df, tmp_path, progress)
+        elif extension == ".parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if progress:
+        progress(1.0)
+    return path
+
+
+class ExportJobs:
+    """
+    Trabajos de exportación en segundo plano con estado y progreso. Los terminados se olvidan
+    pasado `ttl` segundos o cuando hay más de `max_finished`, empezando por los más antiguos.
+    """
+
+    def __init__(self, workers: int = EXPORT_WORKERS, ttl: int = EXPORT_JOBS_TTL,
+                 max_finished: int = EXPORT_JOBS_MAX_FINISHED):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="excel-export")
+        self._jobs: Dict[str, Dict] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.max_finished = max_finished
+
+    def _prune(self) -> None:
+        now = time.time()
+        finished = sorted((job["terminado"], job_id) for job_id, job in self._jobs.items()
+                          if job["estado"] in _FINISHED)
+        excess = len(finished) - self.max_finished
+        for i, (ended, job_id) in enumerate(finished):
+            if i < excess or now - ended > self.ttl:
+                del self._jobs[job_id]
+
+    def submit(self, df: pd.DataFrame, output_file: str) -> str:
+        job_id = f"exp_{next(self._ids)}"
+        output_file = os.path.basename(output_file)
+        path = os.path.join(EXPORTS_DIR, output_file)
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = {
+                "id": job_id, "archivo": output_file, "ruta": path, "filas": len(df),
+                "hojas": _sheets_for(output_file, len(df)),
+                "estado": "en_cola", "progreso": 0.0, "error": None,
+                "sesion": current_session_id.get(), "creado": time.time(), "terminado": None,
+                "notificado": False,
+            }
+        self._pool.submit(self._run, job_id, df, path)
+        return job_id
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id: str, df: pd.DataFrame, path: str) -> None:
+        self._update(job_id, estado="en_progreso")
+        try:
+            write_result(df, path, lambda p: self._update(job_id, progreso=p))
+            self._update(job_id, estado="completado", progreso=1.0, terminado=time.time())
+        except Exception as e:
+            self._update(job_id, estado="error", error=str(e), terminado=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def for_session(self, session_id: Optional[str], only_unnotified: bool = True) -> List[Dict]:
+        with self._lock:
+            self._prune()
+            return [dict(j) for j in self._jobs.values()
+                    if j["sesion"] == session_id and not (only_unnotified and j["notificado"])]
+
+    def mark_notified(self, job_id: str) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["notificado"] = True
+
+
+def _sheets_for(output_file: str, rows: int) -> Optional[int]:
+    return xlsx_sheet_count(rows) if output_file.lower().endswith(".xlsx") else None
+
+
+export_jobs = ExportJobs()
+
+
+def export_dataframe(df: pd.DataFrame, output_file: str) -> Dict:
+    """
+    Exporta a exports/<output_file>. Los resultados pequeños se escriben en el momento;
+    los grandes se encolan y se devuelve el trabajo sin esperar a que termine.
+    """
+    output_file = os.path.basename(output_file)
+    if len(df) >= EXPORT_BACKGROUND_ROWS:
+        return export_jobs.get(export_jobs.submit(df, output_file))
+    path = write_result(df, os.path.join(EXPORTS_DIR, output_file))
+    return {"id": None, "archivo": output_file, "ruta": path, "filas": len(df),
+            "hojas": _sheets_for(output_file, len(df)), "estado": "completado", "progreso": 1.0, "error": None}
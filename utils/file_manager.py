@@ -1,66 +1,283 @@
+import bisect
+import ctypes
+import ctypes.util
+import fnmatch
 import os
+import struct
+import threading
 import time
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+
+from utils.logger import logger
+from utils.metrics import span
+from utils.single_flight import single_flight
 
 EXCEL_EXTENSIONS = ('.xlsx', '.xls')
 
-class MemoryBank:
+# Cada cuánto se revisa el directorio cuando no hay inotify (segundos)
+POLL_INTERVAL = float(os.getenv("EXCEL_DIR_POLL_INTERVAL", "10"))
+
+# Constantes de inotify (linux/inotify.h)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+               | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Escaneos completos simultáneos del mismo directorio comparten una sola pasada
+_scans = single_flight("escaneo_directorio")
+
+
+def _is_excel(name: str) -> bool:
+    return name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith("~$")
+
+
+def _changed(previous: Optional[Dict], entry: Dict) -> bool:
+    return previous is None or (previous["tamano_bytes"], previous["mtime_ns"]) != (entry["tamano_bytes"], entry["mtime_ns"])
+
+
+class DirectoryIndex:
     """
-    Simple memory bank para cachear resultados de funciones de archivos Excel.
+    Índice en memoria de los archivos Excel de un directorio.
+
+    Se construye con una sola pasada de `os.scandir` y después se mantiene al día de forma
+    incremental con inotify (solo se vuelve a leer el archivo que cambió). Donde inotify no
+    está disponible se revisa el mtime del directorio y se hace un escaneo completo cada
+    `POLL_INTERVAL` segundos. Permite buscar por nombre en O(1), filtrar por prefijo o patrón
+    glob y paginar. Los suscriptores de `add_listener` reciben cada archivo nuevo o modificado.
     """
-    def __init__(self, ttl: int = 10):
-        self.ttl = ttl  # tiempo de vida en segundos
-        self._cache = {}
-        self._timestamps = {}
+    def __init__(self, data_dir: str, poll_interval: float = POLL_INTERVAL):
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+        self._entries: Dict[str, Dict] = {}
+        self._sorted_names: Optional[List[str]] = None
+        self._lock = threading.RLock()
+        self._last_scan = 0.0
+        self._dir_mtime_ns: Optional[int] = None
+        self._scanned = False
+        self._watching = False
+        self.full_scans = 0
+        self.incremental_updates = 0
+        self._listeners: List[Callable[[str], None]] = []
+        self._start_watcher()
+
+    # --- Construcción y actualización ---
+    def _stat_entry(self, name: str, stat: os.stat_result) -> Dict:
+        return {
+            "nombre": name,
+            "tamano_bytes": stat.st_size,
+            "ultima_modificacion": stat.st_mtime,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    def rescan(self) -> None:
+        """Escaneo completo; si ya hay uno en curso para este directorio, se espera ese mismo."""
+        _scans.do(os.path.abspath(self.data_dir), self._rescan)
+
+    def _rescan(self) -> None:
+        """Escaneo completo en una sola pasada de scandir."""
+        entries = {}
+        with span("directorio.escaneo"):
+            try:
+                dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+                with os.scandir(self.data_dir) as it:
+                    for entry in it:
+                        if not _is_excel(entry.name):
+                            continue
+                        try:
+                            if entry.is_file():
+                                entries[entry.name] = self._stat_entry(entry.name, entry.stat())
+                        except OSError:
+                            continue
+            except FileNotFoundError:
+                dir_mtime_ns = None
+        with self._lock:
+            previous = self._entries if self._scanned else None
+            self._entries = entries
+            self._sorted_names = None
+            self._dir_mtime_ns = dir_mtime_ns
+            self._last_scan = time.monotonic()
+            self._scanned = True
+            self.full_scans += 1
+        if previous is not None:
+            self._notify([name for name, entry in entries.items() if _changed(previous.get(name), entry)])
+
+    def _update_one(self, name: str) -> None:
+        """Vuelve a leer un único archivo tras un evento de inotify."""
+        if not _is_excel(name):
+            return
+        path = os.path.join(self.data_dir, name)
+        try:
+            stat = os.stat(path)
+            entry = self._stat_entry(name, stat) if os.path.isfile(path) else None
+        except OSError:
+            entry = None
+        with self._lock:
+            previous = self._entries.get(name)
+            if entry is None:
+                if self._entries.pop(name, None) is not None:
+                    self._sorted_names = None
+            else:
+                if name not in self._entries:
+                    self._sorted_names = None
+                self._entries[name] = entry
+            self.incremental_updates += 1
+        if entry is not None and _changed(previous, entry):
+            self._notify([name])
 
-    def get(self, key: str) -> Optional[object]:
-        if key in self._cache and (time.time() - self._timestamps[key] < self.ttl):
-            return self._cache[key]
-        return None
+    # --- Suscriptores ---
+    def add_listener(self, func: Callable[[str], None]) -> None:
+        """Registra una función que recibe el nombre de cada archivo nuevo o modificado."""
+        with self._lock:
+            self._listeners.append(func)
+        # Sin inotify, los cambios solo se ven al escanear: se revisa desde ya
+        self._ensure_fresh()
 
-    def set(self, key: str, value: object):
-        self._cache[key] = value
-        self._timestamps[key] = time.time()
+    def _notify(self, names: List[str]) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+        for name in names:
+            for func in listeners:
+                try:
+                    func(name)
+                except Exception as e:
+                    logger.warning("Falló el aviso de cambio de '{}': {}", name, e)
 
-memory_bank = MemoryBank(ttl=10)
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            if not self._scanned:
+                needs_scan = True
+            elif self._watching:
+                needs_scan = False
+            else:
+                needs_scan = time.monotonic() - self._last_scan >= self.poll_interval
+                if not needs_scan:
+                    # Altas, bajas y renombres cambian el mtime del directorio
+                    try:
+                        needs_scan = os.stat(self.data_dir).st_mtime_ns != self._dir_mtime_ns
+                    except FileNotFoundError:
+                        needs_scan = self._dir_mtime_ns is not None
+        if needs_scan:
+            self.rescan()
 
-def list_excel_files(data_dir: str = "data") -> List[str]:
+    # --- inotify ---
+    def _start_watcher(self) -> None:
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name or not os.path.isdir(self.data_dir):
+            return
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return
+            wd = libc.inotify_add_watch(fd, os.fsencode(self.data_dir), _WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                return
+        except (AttributeError, OSError):
+            # Plataforma sin inotify: se usa el sondeo por mtime
+            return
+        self._watching = True
+        threading.Thread(target=self._watch_loop, args=(fd,), name=f"dir-index:{self.data_dir}", daemon=True).start()
+
+    def _watch_loop(self, fd: int) -> None:
+        try:
+            while True:
+                buffer = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset < len(buffer):
+                    _, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    raw_name = buffer[offset + _EVENT_HEADER.size: offset + _EVENT_HEADER.size + length]
+                    offset += _EVENT_HEADER.size + length
+                    if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                        # El directorio desapareció: se vuelve al sondeo
+                        return
+                    if mask & _IN_Q_OVERFLOW:
+                        self.rescan()
+                        continue
+                    name = os.fsdecode(raw_name.rstrip(b"\0"))
+                    if name:
+                        self._update_one(name)
+        except OSError:
+            pass
+        finally:
+            self._watching = False
+            os.close(fd)
+
+    # --- Consultas ---
+    def get(self, name: str) -> Optional[Dict]:
+        """Metadata de un archivo por nombre, en O(1)."""
+        self._ensure_fresh()
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def names(self, prefix: Optional[str] = None, pattern: Optional[str] = None,
+              offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Nombres ordenados, opcionalmente filtrados por prefijo o patrón glob y paginados."""
+        self._ensure_fresh()
+        with self._lock:
+            if self._sorted_names is None:
+                self._sorted_names = sorted(self._entries)
+            names = self._sorted_names
+        if prefix:
+            start = bisect.bisect_left(names, prefix)
+            end = bisect.bisect_left(names, prefix + "\U0010ffff")
+            names = names[start:end]
+        if pattern:
+            names = [n for n in names if fnmatch.fnmatch(n.lower(), pattern.lower())]
+        end = None if limit is None else offset + limit
+        return names[offset:end]
+
+    def entries(self, prefix: Optional[str] = None, pattern: Optional[str] = None,
+                offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        names = self.names(prefix, pattern, offset, limit)
+        with self._lock:
+            return [dict(self._entries[n]) for n in names if n in self._entries]
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        with self._lock:
+            return len(self._entries)
+
+
+_indexes: Dict[str, DirectoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_directory_index(data_dir: str = "data") -> DirectoryIndex:
+    """Índice compartido (uno por directorio) para todo el proceso."""
+    key = os.path.abspath(data_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DirectoryIndex(data_dir)
+        return index
+
+
+def list_excel_files(data_dir: str = "data", pattern: Optional[str] = None,
+                     offset: int = 0, limit: Optional[int] = None) -> List[str]:
     """
-    Lista todos los archivos Excel en el directorio especificado.
+    Lista los archivos Excel en el directorio especificado.
+    Acepta un patrón glob opcional (ej. 'ventas_*.xlsx') y paginación con offset/limit.
     """
-    cache_key = f"list_excel_files:{data_dir}"
-    cached = memory_bank.get(cache_key)
-    if cached is not None:
-        return cached
-    if not os.path.exists(data_dir):
-        return []
-    files = [f for f in os.listdir(data_dir)
-             if f.lower().endswith(EXCEL_EXTENSIONS) and os.path.isfile(os.path.join(data_dir, f))]
-    memory_bank.set(cache_key, files)
-    return files
-
-def get_excel_files_metadata(data_dir: str = "data") -> List[Dict]:
+    with span("directorio.listado"):
+        return get_directory_index(data_dir).names(pattern=pattern, offset=offset, limit=limit)
+
+def get_excel_files_metadata(data_dir: str = "data", pattern: Optional[str] = None,
+                             offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
     """
     Devuelve una lista de diccionarios con metadata de los archivos Excel en el directorio.
-    Cada diccionario contiene: nombre, tamaño (bytes), fecha de última modificación (ISO).
+    Cada diccionario contiene: nombre, tamaño (bytes), fecha de última modificación (timestamp) y mtime_ns.
     """
-    cache_key = f"get_excel_files_metadata:{data_dir}"
-    cached = memory_bank.get(cache_key)
-    if cached is not None:
-        return cached
-    files = list_excel_files(data_dir)
-    metadata = []
-    for f in files:
-        path = os.path.join(data_dir, f)
-        try:
-            stat = os.stat(path)
-            metadata.append({
-                "nombre": f,
-                "tamano_bytes": stat.st_size,
-                "ultima_modificacion":  os.path.getmtime(path)
-            })
-        except Exception as e:
-            # Si hay error, lo ignoramos para este archivo
-            continue
-    memory_bank.set(cache_key, metadata)
-    return metadata 
\ No newline at end of file
+    with span("directorio.metadata"):
+        return get_directory_index(data_dir).entries(pattern=pattern, offset=offset, limit=limit)
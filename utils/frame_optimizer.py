@@ -0,0 +1,182 @@
+"""
+Representación compacta en memoria de los DataFrames cargados.
+
+`pd.read_excel` devuelve texto como `object` y números como float64/int64. En nuestros
+extractos abundan nombres de instituciones, claves de estado y enteros pequeños, así que
+tras cargar cada hoja:
+- el texto de baja cardinalidad pasa a `category`,
+- los enteros se reducen al tipo más chico que los contiene (con un piso configurable),
+- los flotantes pasan a float32 solo si la conversión no pierde ningún valor,
+- opcionalmente, el resto del texto usa `string[pyarrow]`.
+
+Cada optimización se registra con la memoria antes y después. La caché guarda la versión
+compacta, que sirve para guardar y filtrar pero no para calcular: un int8 desborda en silencio
+con productos y una suma acumulada en float32 pierde precisión aunque cada valor sea exacto.
+Todo cálculo (la ruta rápida, SQL, el código que genera PandasAI) trabaja sobre columnas
+ensanchadas con `widen_series`/`widen_frame`, que devuelven texto y números a sus tipos
+habituales; con `category`, además, `fillna('N/A')` lanza TypeError y `groupby` lista también
+las categorías filtradas.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.logger import logger
+
+OPTIMIZE_FRAMES = os.getenv("EXCEL_OPTIMIZE_FRAMES", "true").lower() in ("1", "true", "yes")
+# Hojas con menos filas se dejan como están (el ahorro no compensa)
+OPTIMIZE_MIN_ROWS = int(os.getenv("EXCEL_OPTIMIZE_MIN_ROWS", "1000"))
+# Una columna de texto pasa a `category` si sus valores distintos no superan esta fracción de las filas
+CATEGORY_MAX_RATIO = float(os.getenv("EXCEL_CATEGORY_MAX_RATIO", "0.5"))
+DOWNCAST_NUMERIC = os.getenv("EXCEL_DOWNCAST_NUMERIC", "true").lower() in ("1", "true", "yes")
+# Ancho mínimo de los enteros reducidos (8, 16, 32 o 64 bits; 64 desactiva la reducción)
+DOWNCAST_MIN_INT_BITS = int(os.getenv("EXCEL_DOWNCAST_MIN_INT_BITS", "8"))
+ARROW_STRINGS = os.getenv("EXCEL_ARROW_STRINGS", "false").lower() in ("1", "true", "yes")
+# Reportes por archivo que se conservan para consulta
+MAX_REPORTS = 256
+
+_INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+_reports: "OrderedDict[Tuple[str, Any], Dict[str, Any]]" = OrderedDict()
+_totals = {"hojas": 0, "bytes_antes": 0, "bytes_despues": 0}
+_lock = threading.Lock()
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:  # pyarrow es opcional
+    _HAS_PYARROW = False
+
+
+def _nbytes(series: pd.Series) -> int:
+    return int(series.memory_usage(deep=True, index=False))
+
+
+def _is_text(series: pd.Series) -> bool:
+    if isinstance(series.dtype, pd.StringDtype):
+        return True
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string"
+
+
+def _downcast_int(series: pd.Series) -> Optional[pd.Series]:
+    if series.empty:
+        return None
+    low, high = series.min(), series.max()
+    for dtype in _INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.bits < DOWNCAST_MIN_INT_BITS:
+            continue
+        if info.bits >= series.dtype.itemsize * 8:
+            return None
+        if info.min <= low and high <= info.max:
+            return series.astype(dtype)
+    return None
+
+
+def _downcast_float(series: pd.Series) -> Optional[pd.Series]:
+    if series.dtype != np.float64:
+        return None
+    reduced = series.astype(np.float32)
+    # Solo si todos los valores sobreviven exactos al ida y vuelta
+    if ((reduced.astype(np.float64) == series) | series.isna()).all():
+        return reduced
+    return None
+
+
+def optimize_frame(df: pd.DataFrame, path: Optional[str] = None, sheet_name: Any = 0) -> pd.DataFrame:
+    """Devuelve el DataFrame con tipos compactos y registra el ahorro de memoria."""
+    if not OPTIMIZE_FRAMES or len(df) < OPTIMIZE_MIN_ROWS:
+        return df
+    before = int(df.memory_usage(deep=True).sum())
+    changed: Dict[str, List[str]] = {"categoria": [], "reducidas": [], "arrow": []}
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        new, kind = None, None
+        if _is_text(series):
+            non_null = series.count()
+            if non_null and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * non_null:
+                new, kind = series.astype("category"), "categoria"
+            elif ARROW_STRINGS and _HAS_PYARROW and series.dtype == object:
+                new, kind = series.astype("string[pyarrow]"), "arrow"
+        elif DOWNCAST_NUMERIC and series.dtype.kind == "i":
+            new, kind = _downcast_int(series), "reducidas"
+        elif DOWNCAST_NUMERIC and series.dtype.kind == "f":
+            new, kind = _downcast_float(series), "reducidas"
+        if new is not None and _nbytes(new) < _nbytes(series):
+            columns[column] = new
+            changed[kind].append(str(column))
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for column, series in columns.items():
+        df[column] = series
+    after = int(df.memory_usage(deep=True).sum())
+    report = {
+        "archivo": os.path.basename(path) if path else None, "hoja": sheet_name,
+        "filas": len(df), "bytes_antes": before, "bytes_despues": after,
+        "columnas_categoria": changed["categoria"], "columnas_reducidas": changed["reducidas"],
+        "columnas_arrow": changed["arrow"],
+    }
+    with _lock:
+        key = (os.path.abspath(path) if path else None, sheet_name)
+        _reports[key] = report
+        _reports.move_to_end(key)
+        while len(_reports) > MAX_REPORTS:
+            _reports.popitem(last=False)
+        _totals["hojas"] += 1
+        _totals["bytes_antes"] += before
+        _totals["bytes_despues"] += after
+    logger.info("Optimización de memoria archivo={} hoja={} antes_mb={:.1f} despues_mb={:.1f} "
+                "categorias={} reducidas={} arrow={}", report["archivo"], sheet_name, before / 2 ** 20,
+                after / 2 ** 20, len(changed["categoria"]), len(changed["reducidas"]), len(changed["arrow"]))
+    return df
+
+
+def widen_series(series: pd.Series) -> pd.Series:
+    """La columna con el tipo que tendría sin optimizar (texto en lugar de `category`, int64, float64)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+    if series.dtype.kind in "iu" and series.dtype.itemsize < 8:
+        return series.astype(np.int64)
+    if series.dtype == np.float32:
+        return series.astype(np.float64)
+    return series
+
+
+def widen_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copia del DataFrame con los tipos compactos deshechos, para el código generado. Las
+    columnas que no cambian se comparten; si no hay nada que ensanchar, devuelve el mismo objeto.
+    """
+    columns = {}
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        widened = widen_series(series)
+        if widened is not series:
+            columns[i] = widened
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for i, series in columns.items():
+        df.isetitem(i, series)
+    return df
+
+
+def optimization_report(path: str, sheet_name: Any = 0) -> Optional[Dict[str, Any]]:
+    """Último reporte de optimización de un archivo y hoja (None si no se optimizó)."""
+    with _lock:
+        report = _reports.get((os.path.abspath(path), sheet_name))
+        return dict(report) if report else None
+
+
+def optimizer_stats() -> Dict[str, float]:
+    """Totales del proceso: hojas optimizadas, bytes antes/después y fracción ahorrada."""
+    with _lock:
+        stats: Dict[str, float] = dict(_totals)
+    stats["ahorro"] = 1 - stats["bytes_despues"] / stats["bytes_antes"] if stats["bytes_antes"] else 0.0
+    return stats
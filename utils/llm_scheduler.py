@@ -0,0 +1,548 @@
+"""
+Planificador central de las llamadas a los modelos de OpenAI.
+
+Todas las llamadas salientes pasan por aquí: las del SDK de agentes (`Runner.run_streamed`), las de
+`AssistantAgent` y las de langchain, a través de clientes compartidos cuyo transporte HTTP pide turno
+antes de cada petición; y las de PandasAI, a través de un pool de LLMs cuya `call` también pide turno.
+
+- Dos token buckets (`LLM_REQUESTS_PER_MINUTE`, `LLM_TOKENS_PER_MINUTE`) evitan chocar con los
+  límites del proveedor; los tokens de cada petición se estiman por el tamaño del prompt más el
+  máximo de salida pedido.
+- La cola es justa por sesión: dentro de una prioridad, las sesiones con peticiones en espera se
+  atienden por turnos, así que un usuario con muchas llamadas no bloquea a los demás. Las consultas
+  interactivas van antes que los trabajos en segundo plano (exportaciones). Cada sesión puede tener
+  a lo sumo `LLM_MAX_QUEUED_PER_SESSION` peticiones en espera; la siguiente falla enseguida con
+  `LLMQueueFullError` ("ocupado, reintenta") en lugar de alargar la cola sin límite.
+- Un 429 pausa a todas las peticiones el tiempo que indique `retry-after`; los 429, 5xx y errores de
+  conexión se reintentan con backoff exponencial con jitter (`LLM_MAX_RETRIES`).
+- `position(session_id)` da la posición de una sesión en la cola para mostrarla en el chat, y el
+  tiempo de espera de cada petición se registra como la etapa `llm.espera_cola`.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import httpx
+
+from utils.metrics import record
+from utils.session_context import current_session_id
+
+# Límites del proveedor (0 = sin límite)
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+# Peticiones que pueden estar esperando la respuesta del modelo a la vez
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Peticiones en espera por sesión antes de rechazar las nuevas (0 = sin límite)
+LLM_MAX_QUEUED_PER_SESSION = int(os.getenv("LLM_MAX_QUEUED_PER_SESSION", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+# Tokens de salida que se suponen cuando la petición no fija un máximo
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1024"))
+# LLMs de PandasAI que se mantienen creados para reutilizar entre herramientas
+LLM_CLIENT_POOL_SIZE = int(os.getenv("LLM_CLIENT_POOL_SIZE", "8"))
+# Segundos de capacidad acumulable de cada bucket (ráfaga máxima)
+_BURST_SECONDS = 10
+_CHARS_PER_TOKEN = 4
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactiva", PRIORITY_BACKGROUND: "segundo_plano"}
+
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+_RETRYABLE_ERRORS = ("RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError")
+
+# Prioridad de las llamadas hechas desde el contexto actual (las herramientas la heredan)
+llm_priority: "contextvars.ContextVar[int]" = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def llm_priority_scope(priority: int) -> Iterator[None]:
+    """Las llamadas al modelo dentro del bloque usan `priority`."""
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+class LLMQueueFullError(RuntimeError):
+    """La sesión ya tiene demasiadas peticiones al modelo en espera (el mensaje es apto para el usuario)."""
+
+
+def find_queue_full(error: BaseException) -> Optional[LLMQueueFullError]:
+    """El `LLMQueueFullError` que originó `error`, aunque un cliente lo haya envuelto en otra excepción."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, LLMQueueFullError):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class TokenBucket:
+    """Bucket que se rellena de forma continua a `per_minute` unidades por minuto."""
+
+    def __init__(self, per_minute: int, burst_seconds: float = _BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Segundos hasta que haya `amount` unidades (0 si ya las hay o si no hay límite)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        # Una petición más grande que la ráfaga máxima espera a tener el bucket lleno, no para siempre
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _Ticket:
+    __slots__ = ("session", "priority", "tokens", "enqueued", "wake", "granted")
+
+    def __init__(self, session: str, priority: int, tokens: int, wake: Callable[[], None]):
+        self.session = session
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.perf_counter()
+        self.wake = wake
+        self.granted = False
+
+
+class LLMScheduler:
+    """Cola justa por sesión con prioridades, límite de concurrencia y token buckets."""
+
+    def __init__(self, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_queued_per_session: int = LLM_MAX_QUEUED_PER_SESSION):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queued_per_session = max_queued_per_session
+        # prioridad -> sesión -> peticiones en espera; el orden de las sesiones es el turno
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._stats = {"concedidas": 0, "en_cola": 0, "max_en_cola": 0, "reintentos": 0,
+                       "limitadas_429": 0, "rechazadas": 0, "espera_max_ms": 0.0}
+
+    # --- Cola ---
+    def _enqueue(self, ticket: _Ticket) -> None:
+        with self._lock:
+            if self.max_queued_per_session > 0:
+                waiting = sum(len(sessions.get(ticket.session, ())) for sessions in self._queues.values())
+                if waiting >= self.max_queued_per_session:
+                    self._stats["rechazadas"] += 1
+                    raise LLMQueueFullError(
+                        f"El modelo está ocupado: esta sesión ya tiene {waiting} peticiones en espera. "
+                        "Reintenta en unos segundos.")
+            sessions = self._queues.setdefault(ticket.priority, OrderedDict())
+            sessions.setdefault(ticket.session, deque()).append(ticket)
+            self._stats["en_cola"] += 1
+            self._stats["max_en_cola"] = max(self._stats["max_en_cola"], self._stats["en_cola"])
+        self._dispatch()
+
+    def _head(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _pop(self, ticket: _Ticket) -> None:
+        sessions = self._queues[ticket.priority]
+        pending = sessions[ticket.session]
+        pending.remove(ticket)
+        # La sesión atendida pasa al final del turno
+        if pending:
+            sessions.move_to_end(ticket.session)
+        else:
+            del sessions[ticket.session]
+        self._stats["en_cola"] -= 1
+
+    def _dispatch(self) -> None:
+        granted: List[_Ticket] = []
+        with self._lock:
+            while self._in_flight < self.max_concurrency:
+                ticket = self._head()
+                if ticket is None:
+                    break
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self.requests.wait_time(1, now),
+                           self.tokens.wait_time(ticket.tokens, now))
+                if wait > 0:
+                    self._schedule_dispatch(wait)
+                    break
+                self.requests.take(1)
+                self.tokens.take(ticket.tokens)
+                self._pop(ticket)
+                ticket.granted = True
+                self._in_flight += 1
+                self._stats["concedidas"] += 1
+                granted.append(ticket)
+        for ticket in granted:
+            ticket.wake()
+
+    def _record_wait(self, ticket: _Ticket) -> None:
+        # Se registra desde quien esperaba, para que la espera quede en la traza de su turno
+        waited = time.perf_counter() - ticket.enqueued
+        with self._lock:
+            self._stats["espera_max_ms"] = max(self._stats["espera_max_ms"], waited * 1000)
+        record("llm.espera_cola", waited, prioridad=_PRIORITY_NAMES.get(ticket.priority, ticket.priority))
+
+    def _schedule_dispatch(self, delay: float) -> None:
+        # Un solo temporizador: se vuelve a intentar cuando los buckets tengan capacidad
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self._dispatch()
+
+    def _new_ticket(self, tokens: int, priority: Optional[int], session: Optional[str],
+                    wake: Callable[[], None]) -> _Ticket:
+        session = session or current_session_id.get() or "_sin_sesion"
+        return _Ticket(session, llm_priority.get() if priority is None else priority, max(int(tokens), 1), wake)
+
+    # --- Turnos ---
+    def acquire_sync(self, tokens: int, priority: Optional[int] = None, session: Optional[str] = None) -> None:
+        """
+        Bloquea el hilo hasta que la petición tenga turno. Hay que llamar a `release` al terminar.
+        Lanza `LLMQueueFullError` si la sesión ya tiene la cola llena.
+        """
+        event = threading.Event()
+        ticket = self._new_ticket(tokens, priority, session, event.set)
+        self._enqueue(ticket)
+        event.wait()
+        self._record_wait(ticket)
+
+    async def acquire(self, tokens: int, priority: Optional[int] = None, session: Optional[str] = None) -> None:
+        """Versión asíncrona de `acquire_sync`: espera sin bloquear el event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._new_ticket(tokens, priority, session, wake)
+        self._enqueue(ticket)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Si el turno ya se había concedido se devuelve; si no, la petición sale de la cola
+            with self._lock:
+                queued = not ticket.granted
+                if queued:
+                    self._pop(ticket)
+            if not queued:
+                self.release()
+            raise
+        self._record_wait(ticket)
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._dispatch()
+
+    @contextmanager
+    def slot(self, tokens: int, priority: Optional[int] = None) -> Iterator[None]:
+        self.acquire_sync(tokens, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def pause(self, seconds: float) -> None:
+        """Detiene todas las peticiones durante `seconds` (el proveedor respondió 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats["limitadas_429"] += 1
+
+    def count_retry(self) -> None:
+        with self._lock:
+            self._stats["reintentos"] += 1
+
+    def position(self, session_id: str) -> Optional[int]:
+        """Posición (desde 1) de la primera petición en espera de la sesión, o None si no tiene ninguna."""
+        with self._lock:
+            position = 0
+            for priority in sorted(self._queues):
+                sessions = self._queues[priority]
+                if session_id in sessions:
+                    # Cada turno atiende una petición por sesión, en el orden actual de las sesiones
+                    ahead = list(sessions).index(session_id)
+                    return position + ahead + 1
+                position += sum(len(pending) for pending in sessions.values())
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["en_vuelo"] = self._in_flight
+            stats["sesiones_en_cola"] = sum(len(sessions) for sessions in self._queues.values())
+            stats["pausa_restante_s"] = max(self._paused_until - time.monotonic(), 0.0)
+        return stats
+
+
+llm_scheduler = LLMScheduler()
+
+
+def llm_scheduler_stats() -> Dict[str, Any]:
+    return llm_scheduler.stats()
+
+
+# --- Reintentos ---
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Backoff exponencial con jitter completo; si el proveedor indicó `retry-after`, se respeta."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, LLM_RETRY_BASE_SECONDS)
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in RETRY_STATUS or type(error).__name__ in _RETRYABLE_ERRORS
+
+
+def estimate_tokens(text: str, completion_tokens: int = LLM_COMPLETION_TOKENS_ESTIMATE) -> int:
+    return len(text) // _CHARS_PER_TOKEN + completion_tokens
+
+
+def _request_tokens(request: httpx.Request) -> int:
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        return LLM_COMPLETION_TOKENS_ESTIMATE
+    if not body:
+        return 1
+    completion = LLM_COMPLETION_TOKENS_ESTIMATE
+    try:
+        payload = json.loads(body)
+        for field in ("max_completion_tokens", "max_output_tokens", "max_tokens"):
+            if isinstance(payload.get(field), int):
+                completion = payload[field]
+                break
+    except (ValueError, AttributeError):
+        pass
+    return len(body) // _CHARS_PER_TOKEN + completion
+
+
+# --- Transportes HTTP para los clientes de OpenAI ---
+class ScheduledAsyncTransport(httpx.AsyncBaseTransport):
+    """Transporte que pide turno antes de cada petición y reintenta 429/5xx con backoff."""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = _request_tokens(request)
+        for attempt in itertools.count():
+            await llm_scheduler.acquire(tokens)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                if attempt >= LLM_MAX_RETRIES:
+                    raise
+                response = None
+            finally:
+                # El turno cubre hasta tener los encabezados: un stream largo no ocupa la concurrencia
+                llm_scheduler.release()
+            if response is not None and (response.status_code not in RETRY_STATUS or attempt >= LLM_MAX_RETRIES):
+                return response
+            retry_after = None
+            if response is not None:
+                retry_after = _retry_after(response.headers)
+                if response.status_code == 429:
+                    llm_scheduler.pause(retry_after if retry_after is not None else retry_delay(attempt))
+                await response.aclose()
+            llm_scheduler.count_retry()
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+        raise AssertionError("inalcanzable")
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """Versión síncrona de `ScheduledAsyncTransport` (clientes usados desde hilos)."""
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = _request_tokens(request)
+        for attempt in itertools.count():
+            llm_scheduler.acquire_sync(tokens)
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError:
+                if attempt >= LLM_MAX_RETRIES:
+                    raise
+                response = None
+            finally:
+                llm_scheduler.release()
+            if response is not None and (response.status_code not in RETRY_STATUS or attempt >= LLM_MAX_RETRIES):
+                return response
+            retry_after = None
+            if response is not None:
+                retry_after = _retry_after(response.headers)
+                if response.status_code == 429:
+                    llm_scheduler.pause(retry_after if retry_after is not None else retry_delay(attempt))
+                response.close()
+            llm_scheduler.count_retry()
+            time.sleep(retry_delay(attempt, retry_after))
+        raise AssertionError("inalcanzable")
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+# --- Clientes compartidos ---
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _shared(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def scheduled_http_client() -> httpx.Client:
+    """Cliente httpx síncrono compartido cuyas peticiones pasan por el planificador."""
+    from openai import DefaultHttpxClient
+    return _shared("http", lambda: DefaultHttpxClient(transport=ScheduledTransport()))
+
+
+def scheduled_async_http_client() -> httpx.AsyncClient:
+    """Cliente httpx asíncrono compartido cuyas peticiones pasan por el planificador."""
+    from openai import DefaultAsyncHttpxClient
+    return _shared("http_async", lambda: DefaultAsyncHttpxClient(transport=ScheduledAsyncTransport()))
+
+
+def get_async_openai_client():
+    """
+    Cliente `AsyncOpenAI` compartido por el SDK de agentes y `AssistantAgent` (respeta OPENAI_BASE_URL).
+    Los reintentos los hace el transporte, con la cola, así que el cliente no reintenta por su cuenta.
+    """
+    def factory():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                           http_client=scheduled_async_http_client())
+    return _shared("openai_async", factory)
+
+
+class PandasAILLMPool:
+    """
+    LLMs de PandasAI reutilizables: en lugar de crear uno por consulta, cada herramienta toma uno
+    del pool mientras dura su análisis. Cada `call` pide turno al planificador y se reintenta
+    con backoff si el proveedor la limita.
+    """
+
+    def __init__(self, size: int = LLM_CLIENT_POOL_SIZE):
+        self.size = size
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _new_llm(self, api_key: str):
+        from pandasai.llm import OpenAI
+        llm = OpenAI(api_token=api_key, max_retries=0)
+        # No todas las versiones de PandasAI pasan `max_retries` al cliente de OpenAI: si el SDK
+        # reintentara por su cuenta, cada reintento ocuparía el turno sin pasar por el planificador
+        if getattr(llm, "max_retries", 0):
+            llm.max_retries = 0
+        client = getattr(llm, "client", None)
+        # `client` suele ser `OpenAI(...).chat.completions`, que guarda su cliente en `_client`
+        root = getattr(client, "_client", client)
+        if getattr(root, "max_retries", 0) and hasattr(root, "with_options"):
+            fresh = root.with_options(max_retries=0)
+            llm.client = fresh if client is root else fresh.chat.completions
+        return llm
+
+    def _create(self, api_key: str):
+        llm = self._new_llm(api_key)
+        call = llm.call
+
+        def scheduled_call(instruction, *args, **kwargs):
+            prompt = instruction.to_string() if hasattr(instruction, "to_string") else str(instruction)
+            for attempt in itertools.count():
+                try:
+                    with llm_scheduler.slot(estimate_tokens(prompt)):
+                        return call(instruction, *args, **kwargs)
+                except Exception as e:
+                    if attempt >= LLM_MAX_RETRIES or not is_retryable(e):
+                        raise
+                    retry_after = _retry_after(getattr(getattr(e, "response", None), "headers", None))
+                    if getattr(e, "status_code", None) == 429:
+                        llm_scheduler.pause(retry_after if retry_after is not None else retry_delay(attempt))
+                    llm_scheduler.count_retry()
+                    time.sleep(retry_delay(attempt, retry_after))
+
+        llm.call = scheduled_call
+        llm._pool_api_key = api_key
+        with self._lock:
+            self.created += 1
+        return llm
+
+    @contextmanager
+    def lease(self, api_key: str) -> Iterator[Any]:
+        with self._lock:
+            llm = next((c for c in self._idle if c._pool_api_key == api_key), None)
+            if llm is not None:
+                self._idle.remove(llm)
+        if llm is None:
+            llm = self._create(api_key)
+        try:
+            yield llm
+        finally:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(llm)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"creados": self.created, "libres": len(self._idle)}
+
+
+pandasai_llms = PandasAILLMPool()
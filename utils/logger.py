@@ -0,0 +1,18 @@
+"""
+Logger de la aplicación.
+
+Usa loguru con `enqueue=True`: los mensajes se escriben desde un hilo aparte, así que
+registrar desde el event loop de Chainlit no bloquea en escrituras a stdout/stderr.
+El nivel se controla con la variable de entorno LOG_LEVEL (por defecto INFO).
+"""
+import os
+import sys
+
+from loguru import logger
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+logger.remove()
+logger.add(sys.stderr, level=LOG_LEVEL, enqueue=True, backtrace=False, diagnose=False)
+
+__all__ = ["logger", "LOG_LEVEL"]
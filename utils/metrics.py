@@ -0,0 +1,303 @@
+"""
+Instrumentación de latencia por etapa.
+
+Cada etapa (parseo del archivo, llamada al LLM de PandasAI, ejecución del código generado,
+serialización del resultado, streaming...) se mide con `span`. Las duraciones:
+- se agregan en histogramas por etapa (p50/p95/p99) con conteo de ejecuciones en curso,
+- se anotan en la traza de la solicitud actual (para mostrar el desglose en Chainlit),
+- y se registran como líneas estructuradas `clave=valor` en el log.
+
+Los histogramas, junto con las estadísticas de cachés y colas registradas con
+`register_collector`, se exponen en formato Prometheus en http://METRICS_HOST:METRICS_PORT/metrics
+cuando METRICS_SERVER=true. Cada proceso tiene sus propias métricas: con varios workers, el
+endpoint se activa en uno solo o con un METRICS_PORT distinto por proceso.
+"""
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.logger import logger
+
+# El endpoint de métricas se levanta solo si se pide explícitamente
+METRICS_SERVER = os.getenv("METRICS_SERVER", "false").lower() in ("1", "true", "yes")
+# Puerto del endpoint de métricas (0 lo desactiva)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Duraciones recientes que se conservan por etapa para calcular percentiles
+METRICS_SAMPLES = int(os.getenv("METRICS_SAMPLES", "2048"))
+# Límites (segundos) de los buckets del histograma
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Traza de la solicitud en curso; las herramientas la heredan vía `run_tool_async`
+current_trace: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "current_trace", default=None)
+# Segundos de LLM acumulados por la herramienta en curso (ver `instrument_llm`)
+_llm_seconds: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("llm_seconds", default=None)
+
+
+class Histogram:
+    def __init__(self, samples: int = METRICS_SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent: deque = deque(maxlen=samples)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self.recent)
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class Metrics:
+    """Histogramas y ejecuciones en curso por etapa."""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self, stage: str) -> None:
+        with self._lock:
+            self._in_flight[stage] = self._in_flight.get(stage, 0) + 1
+
+    def exit(self, stage: str) -> None:
+        with self._lock:
+            self._in_flight[stage] -= 1
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Conteo, suma, percentiles y en curso por etapa."""
+        with self._lock:
+            result = {}
+            for stage in sorted(set(self._histograms) | set(self._in_flight)):
+                histogram = self._histograms.get(stage) or Histogram()
+                quantiles = histogram.quantiles()
+                result[stage] = {
+                    "conteo": histogram.count, "suma_s": round(histogram.total, 6),
+                    "p50_s": quantiles[0.5], "p95_s": quantiles[0.95], "p99_s": quantiles[0.99],
+                    "en_curso": self._in_flight.get(stage, 0),
+                }
+            return result
+
+    def _render_histograms(self) -> List[str]:
+        lines = ["# HELP excel_etapa_segundos Duración de cada etapa del procesamiento.",
+                 "# TYPE excel_etapa_segundos histogram"]
+        quantile_lines = ["# HELP excel_etapa_cuantil_segundos Percentiles recientes por etapa.",
+                          "# TYPE excel_etapa_cuantil_segundos gauge"]
+        in_flight_lines = ["# HELP excel_etapa_en_curso Ejecuciones en curso por etapa.",
+                           "# TYPE excel_etapa_en_curso gauge"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                label = _escape(stage)
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f'excel_etapa_segundos_bucket{{etapa="{label}",le="{bound}"}} {count}')
+                lines.append(f'excel_etapa_segundos_bucket{{etapa="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'excel_etapa_segundos_sum{{etapa="{label}"}} {histogram.total:.6f}')
+                lines.append(f'excel_etapa_segundos_count{{etapa="{label}"}} {histogram.count}')
+                for q, value in histogram.quantiles().items():
+                    quantile_lines.append(f'excel_etapa_cuantil_segundos{{etapa="{label}",quantile="{q}"}} {value:.6f}')
+            for stage, count in sorted(self._in_flight.items()):
+                in_flight_lines.append(f'excel_etapa_en_curso{{etapa="{_escape(stage)}"}} {count}')
+        return lines + quantile_lines + in_flight_lines
+
+
+metrics = Metrics()
+
+_collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_collector(name: str, func: Callable[[], Dict[str, Any]]) -> None:
+    """
+    Registra una función de estadísticas (p. ej. `dataframe_cache.stats`) para exportarla.
+    Los valores numéricos se exportan como gauges `excel_<name>_<campo>`; los diccionarios
+    anidados usan la clave exterior como etiqueta. Si hay `hits` y `misses` se agrega la tasa de aciertos.
+    """
+    _collectors[name] = func
+
+
+def register_lazy_collector(name: str, module: str, attr: str) -> None:
+    """
+    Como `register_collector`, pero sin importar `module`: mientras nadie lo haya importado
+    no se reporta nada (evita cargar pandas al arrancar solo para registrar métricas).
+    """
+    def collect() -> Dict[str, Any]:
+        target = sys.modules.get(module)
+        if target is None:
+            return {}
+        for part in attr.split("."):
+            target = getattr(target, part)
+        return target()
+
+    register_collector(name, collect)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(("excel",) + parts))
+
+
+def _render_collector(name: str, stats: Dict[str, Any], labels: str = "") -> List[str]:
+    lines = []
+    numeric = {k: v for k, v in stats.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    if "hits" in numeric and "misses" in numeric:
+        total = numeric["hits"] + numeric["misses"]
+        numeric["tasa_aciertos"] = numeric["hits"] / total if total else 0.0
+    for field, value in numeric.items():
+        lines.append(f"{_metric_name(name, field)}{labels} {value}")
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            lines.extend(_render_collector(name, value, f'{{clave="{_escape(key)}"}}'))
+    return lines
+
+
+def render_prometheus() -> str:
+    """Todas las métricas en formato de texto de Prometheus."""
+    lines = metrics._render_histograms()
+    for name, func in sorted(_collectors.items()):
+        try:
+            lines.extend(_render_collector(name, func()))
+        except Exception as e:
+            logger.warning("No se pudieron recolectar las métricas de '{}': {}", name, e)
+    return "\n".join(lines) + "\n"
+
+
+def _record(stage: str, seconds: float, fields: Dict[str, Any]) -> None:
+    metrics.observe(stage, seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.append({"etapa": stage, "ms": seconds * 1000, **fields})
+    logger.opt(lazy=True).debug("metrica etapa={} duracion_ms={} {}", lambda: stage,
+                                lambda: f"{seconds * 1000:.1f}", lambda: format_fields(fields))
+
+
+def record(stage: str, seconds: float, **fields) -> None:
+    """Registra una duración medida por otros medios (p. ej. derivada de otras etapas)."""
+    _record(stage, max(seconds, 0.0), fields)
+
+
+@contextmanager
+def span(stage: str, **fields) -> Iterator[Dict[str, float]]:
+    """
+    Mide el bloque como la etapa `stage`. Devuelve un dict cuyo campo `segundos`
+    queda disponible al salir del bloque.
+    """
+    start = time.perf_counter()
+    timing = {"segundos": 0.0, "inicio": start}
+    metrics.enter(stage)
+    try:
+        yield timing
+    finally:
+        timing["segundos"] = time.perf_counter() - start
+        metrics.exit(stage)
+        _record(stage, timing["segundos"], fields)
+
+
+def instrument_llm(llm: Any, stage: str = "pandasai.llm") -> Dict[str, float]:
+    """
+    Mide cada llamada de un LLM de PandasAI como la etapa `stage`. Devuelve el acumulado
+    de segundos de las llamadas hechas desde el contexto actual, para separar el tiempo del
+    modelo del de ejecución del código. El LLM puede ser compartido (ver utils/llm_scheduler.py):
+    su `call` se envuelve una sola vez y cada herramienta acumula solo sus propias llamadas.
+    """
+    total = {"segundos": 0.0}
+    _llm_seconds.set(total)
+    if getattr(llm, "_instrumented_stage", None) == stage:
+        return total
+    call = llm.call
+
+    def measured_call(*args, **kwargs):
+        with span(stage) as timing:
+            try:
+                return call(*args, **kwargs)
+            finally:
+                accumulated = _llm_seconds.get()
+                if accumulated is not None:
+                    accumulated["segundos"] += time.perf_counter() - timing["inicio"]
+
+    llm.call = measured_call
+    llm._instrumented_stage = stage
+    return total
+
+
+def start_trace() -> List[Dict[str, Any]]:
+    """Inicia la traza de la solicitud actual y la devuelve."""
+    trace: List[Dict[str, Any]] = []
+    current_trace.set(trace)
+    return trace
+
+
+def format_fields(fields: Dict[str, Any]) -> str:
+    return " ".join(f"{k}={v}" for k, v in fields.items())
+
+
+def log_trace(trace: List[Dict[str, Any]], **fields) -> None:
+    """Una línea estructurada con el desglose completo de la solicitud."""
+    stages = " ".join(f"{item['etapa']}={item['ms']:.1f}" for item in trace)
+    logger.info("solicitud {} {}", format_fields(fields), stages)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT,
+                         enabled: bool = METRICS_SERVER) -> Optional[ThreadingHTTPServer]:
+    """Levanta (una sola vez por proceso) el endpoint /metrics en un hilo aparte, si está activado."""
+    global _server
+    if not enabled or not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # Otro proceso ya ocupa el puerto: este sigue sin endpoint propio
+                logger.warning("No se pudo abrir el endpoint de métricas en {}:{} (¿varios workers con "
+                               "METRICS_SERVER=true y el mismo METRICS_PORT?): {}", host, port, e)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info("Métricas en http://{}:{}/metrics", host, _server.server_address[1])
+        return _server
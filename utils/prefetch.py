@@ -0,0 +1,253 @@
+"""
+Prefetch en segundo plano de los libros que probablemente se van a analizar.
+
+Después de listar archivos o de nombrar uno en el chat, la siguiente pregunta casi siempre es
+un análisis de ese archivo. Los nombres de archivo (con `#hoja` opcional) que aparecen en el
+mensaje del usuario, en sus mensajes recientes o en un listado corto se cargan a la caché de
+DataFrames antes de que el agente los pida, en hilos de baja prioridad:
+
+- Un solo worker por defecto (`EXCEL_PREFETCH_WORKERS`), con prioridad de planificación baja
+  (nice) para no competir con las cargas que sí espera un usuario.
+- Presupuesto de memoria (`EXCEL_PREFETCH_MAX_BYTES`): los DataFrames cargados por el prefetch que
+  aún nadie usó no pueden superarlo; lo que no cabe según el catálogo del libro no se carga.
+- La cola es por prioridad: primero lo que nombra el mensaje actual, después el historial, los
+  listados y por último el conjunto caliente (`EXCEL_PREFETCH_HOT_SET`) que se calienta al arrancar.
+
+Los aciertos (entradas del prefetch que luego usó una herramienta) y el desperdicio (las que
+salieron de la caché sin usarse) los cuenta la caché de DataFrames; `prefetch_stats` los reúne.
+"""
+import fnmatch
+import itertools
+import os
+import queue
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.dataframe_cache import dataframe_cache, warm_excel_cache
+from utils.file_manager import get_directory_index
+from utils.logger import logger
+from utils.sheet_catalog import SheetNotFoundError, SheetRef, canonical_sheet_ref, read_sheet_catalog, resolve_sheet
+
+PREFETCH_ENABLED = os.getenv("EXCEL_PREFETCH", "true").lower() in ("1", "true", "yes")
+PREFETCH_WORKERS = int(os.getenv("EXCEL_PREFETCH_WORKERS", "1"))
+# Bytes máximos de DataFrames cargados por el prefetch y todavía sin usar (por defecto, 1/4 de la caché)
+PREFETCH_MAX_BYTES = int(os.getenv("EXCEL_PREFETCH_MAX_BYTES", str(dataframe_cache.max_bytes // 4)))
+# Archivos que se precargan como máximo por mensaje
+PREFETCH_MAX_FILES = int(os.getenv("EXCEL_PREFETCH_MAX_FILES", "3"))
+# Mensajes anteriores del usuario en los que también se buscan nombres de archivo
+PREFETCH_HISTORY_MESSAGES = int(os.getenv("EXCEL_PREFETCH_HISTORY_MESSAGES", "3"))
+# Un listado con hasta estos archivos se precarga completo; uno más largo no dice cuál se va a usar
+PREFETCH_LISTING_MAX = int(os.getenv("EXCEL_PREFETCH_LISTING_MAX", "3"))
+# Archivos (patrones glob, con '#hoja' opcional) que se calientan al arrancar, separados por comas
+PREFETCH_HOT_SET = [p.strip() for p in os.getenv("EXCEL_PREFETCH_HOT_SET", "").split(",") if p.strip()]
+# Aumento de nice de los workers (Linux: la prioridad es por hilo)
+PREFETCH_NICE = int(os.getenv("EXCEL_PREFETCH_NICE", "10"))
+# Bytes estimados por celda para decidir si una hoja cabe en el presupuesto antes de cargarla
+_BYTES_PER_CELL = 16
+
+PRIORITY_MESSAGE = 0
+PRIORITY_HISTORY = 1
+PRIORITY_LISTING = 2
+PRIORITY_HOT_SET = 3
+
+# Caracteres que pueden formar parte de un nombre de archivo: delimitan las menciones
+_NAME_CHARS = set("abcdefghijklmnopqrstuvwxyz0123456789_-.")
+_SHEET_STOP = ":;,\n?!\"'`)"
+
+_queue: "queue.PriorityQueue[Tuple[int, int, str, SheetRef]]" = queue.PriorityQueue()
+_counter = itertools.count()
+_queued: set = set()
+_workers: List[threading.Thread] = []
+_lock = threading.Lock()
+_stats = {"programadas": 0, "cargadas": 0, "ya_en_cache": 0, "sin_presupuesto": 0, "errores": 0}
+
+
+def _bump(field: str, amount: int = 1) -> None:
+    with _lock:
+        _stats[field] += amount
+
+
+def _is_name_char(char: str) -> bool:
+    return char.casefold() in _NAME_CHARS or char.isalnum()
+
+
+def _sheet_after(text: str, start: int) -> Optional[str]:
+    # 'ventas.xlsx#Resumen anual: ...' -> 'Resumen anual'; se resuelve contra el catálogo al encolar
+    if start >= len(text) or text[start] != "#":
+        return None
+    end = start + 1
+    while end < len(text) and text[end] not in _SHEET_STOP:
+        end += 1
+    return text[start + 1:end].strip() or None
+
+
+def find_mentions(text: str, data_dir: str = "data", limit: int = PREFETCH_MAX_FILES) -> List[Tuple[str, Optional[str]]]:
+    """(archivo, hoja o None) de los archivos de `data_dir` que se nombran en `text`, en orden de aparición."""
+    folded = text.casefold()
+    if ".xls" not in folded:
+        return []
+    found = []
+    for name in get_directory_index(data_dir).names():
+        wanted = name.casefold()
+        pos = folded.find(wanted)
+        while pos != -1:
+            end = pos + len(wanted)
+            # 'ventas.xlsx' no cuenta como mención dentro de '2024_ventas.xlsx'
+            if (pos == 0 or not _is_name_char(folded[pos - 1])) and (end == len(folded) or not _is_name_char(folded[end])):
+                found.append((pos, name, _sheet_after(text, end)))
+                break
+            pos = folded.find(wanted, pos + 1)
+    found.sort()
+    return [(name, sheet) for _, name, sheet in found[:limit]]
+
+
+def _resolve(path: str, sheet: Optional[SheetRef]) -> SheetRef:
+    if sheet is None or sheet == 0:
+        return 0
+    try:
+        name = resolve_sheet(path, sheet)
+    except SheetNotFoundError:
+        # 'ventas.xlsx#Resumen anual de ventas' con hoja 'Resumen anual': se toma el nombre más largo que encaje
+        folded = sheet.casefold()
+        names = [s["nombre"] for s in read_sheet_catalog(path) if folded.startswith(s["nombre"].casefold())]
+        if not names:
+            return 0
+        name = max(names, key=len)
+    # La primera hoja se comparte con la entrada que usan las herramientas por defecto
+    return canonical_sheet_ref(path, name)
+
+
+def _estimated_bytes(path: str, sheet_ref) -> int:
+    try:
+        catalog = read_sheet_catalog(path)
+    except Exception:
+        return 0
+    for sheet in catalog:
+        if sheet_ref == sheet["indice"] or sheet_ref == sheet["nombre"]:
+            if sheet["filas"] is not None and sheet["columnas"] is not None:
+                return sheet["filas"] * sheet["columnas"] * _BYTES_PER_CELL
+    return 0
+
+
+def _lower_priority() -> None:
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def _worker() -> None:
+    _lower_priority()
+    while True:
+        _, _, path, sheet = _queue.get()
+        try:
+            _prefetch_one(path, sheet)
+        except Exception as e:
+            _bump("errores")
+            logger.opt(lazy=True).debug("Prefetch de {} falló: {}", lambda: os.path.basename(path), lambda: e)
+        finally:
+            with _lock:
+                _queued.discard((path, sheet))
+            _queue.task_done()
+
+
+def _prefetch_one(path: str, sheet_ref: SheetRef) -> None:
+    if not os.path.exists(path):
+        return
+    if dataframe_cache.prefetched_bytes() + _estimated_bytes(path, sheet_ref) > PREFETCH_MAX_BYTES:
+        _bump("sin_presupuesto")
+        return
+    if warm_excel_cache(path, sheet_ref):
+        _bump("cargadas")
+    else:
+        _bump("ya_en_cache")
+
+
+def _start_workers() -> None:
+    with _lock:
+        if _workers:
+            return
+        for i in range(max(PREFETCH_WORKERS, 1)):
+            thread = threading.Thread(target=_worker, name=f"excel-prefetch-{i}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def schedule(path: str, sheet: Optional[SheetRef] = None, priority: int = PRIORITY_MESSAGE) -> bool:
+    """Encola la carga de una hoja (por defecto, la primera). False si el prefetch está desactivado o ya estaba en cola."""
+    if not PREFETCH_ENABLED:
+        return False
+    # La cola se indexa por la hoja resuelta: 'resumen', 'Resumen' y '2' son una sola carga
+    try:
+        sheet_ref = _resolve(path, sheet)
+    except Exception:
+        # Libro ilegible o inexistente: el worker lo descarta
+        sheet_ref = sheet if sheet is not None else 0
+    item = (os.path.abspath(path), sheet_ref)
+    with _lock:
+        if item in _queued:
+            return False
+        _queued.add(item)
+        _stats["programadas"] += 1
+    _start_workers()
+    _queue.put((priority, next(_counter), *item))
+    return True
+
+
+def prefetch_from_messages(message: str, history: Iterable[str] = (), data_dir: str = "data") -> int:
+    """
+    Encola los archivos nombrados en el mensaje actual y, con menos prioridad, en los mensajes
+    anteriores del usuario (del más reciente al más antiguo). Devuelve cuántos se encolaron.
+    """
+    if not PREFETCH_ENABLED:
+        return 0
+    recent = list(history)[-PREFETCH_HISTORY_MESSAGES:] if PREFETCH_HISTORY_MESSAGES > 0 else []
+    texts = [(message, PRIORITY_MESSAGE)] + [(text, PRIORITY_HISTORY) for text in reversed(recent)]
+    seen = set()
+    scheduled = 0
+    for text, priority in texts:
+        for name, sheet in find_mentions(text, data_dir):
+            if (name, sheet) in seen or len(seen) >= PREFETCH_MAX_FILES:
+                continue
+            seen.add((name, sheet))
+            scheduled += schedule(os.path.join(data_dir, name), sheet, priority)
+    return scheduled
+
+
+def prefetch_listing(names: List[str], data_dir: str = "data") -> int:
+    """Encola los archivos de un listado corto (p. ej. filtrado por patrón); uno largo se ignora."""
+    if not PREFETCH_ENABLED or not names or len(names) > PREFETCH_LISTING_MAX:
+        return 0
+    return sum(schedule(os.path.join(data_dir, name), None, PRIORITY_LISTING) for name in names)
+
+
+def warm_hot_set(data_dir: str = "data", patterns: Optional[List[str]] = None) -> int:
+    """Encola los archivos del conjunto caliente configurado ('ventas_*.xlsx', 'informe.xlsx#Resumen')."""
+    patterns = PREFETCH_HOT_SET if patterns is None else patterns
+    if not PREFETCH_ENABLED or not patterns:
+        return 0
+    names = get_directory_index(data_dir).names()
+    scheduled = 0
+    for pattern in patterns:
+        pattern, _, sheet = pattern.partition("#")
+        for name in fnmatch.filter(names, pattern):
+            scheduled += schedule(os.path.join(data_dir, name), sheet or None, PRIORITY_HOT_SET)
+    if scheduled:
+        logger.info("Conjunto caliente: {} hojas en cola de prefetch", scheduled)
+    return scheduled
+
+
+def prefetch_stats() -> Dict[str, float]:
+    cache = dataframe_cache.stats()
+    with _lock:
+        stats: Dict[str, float] = dict(_stats)
+        stats["en_cola"] = len(_queued)
+    stats["aciertos"] = cache["prefetch_hits"]
+    stats["desperdiciadas"] = cache["prefetch_desperdiciadas"]
+    stats["bytes_desperdiciados"] = cache["prefetch_bytes_desperdiciados"]
+    stats["sin_usar"] = cache["prefetch_pendientes"]
+    stats["bytes_sin_usar"] = dataframe_cache.prefetched_bytes()
+    stats["presupuesto_bytes"] = PREFETCH_MAX_BYTES
+    resolved = stats["aciertos"] + stats["desperdiciadas"]
+    stats["tasa_acierto"] = stats["aciertos"] / resolved if resolved else 0.0
+    return stats
@@ -0,0 +1,261 @@
+"""
+Índice persistente de esquema y estadísticas por archivo y hoja.
+
+Para cada versión de un archivo (tamaño + mtime) se calcula una sola vez: columnas,
+tipos, número de filas, memoria, nulos, mínimo/máximo, distintos y valores más frecuentes.
+Se perfila el mismo DataFrame optimizado que usan las herramientas (ver utils/frame_optimizer.py),
+así que los tipos y la memoria son los del análisis. El resultado se guarda en `data/.cache/profiles/` y se mantiene en memoria,
+de modo que el agente puede conocer la estructura de un archivo sin parsearlo ni llamar al LLM.
+Cuando el archivo cambia, solo se vuelven a perfilar las hojas cuya versión cambió.
+"""
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.dataframe_cache import read_excel_cached
+from utils.frame_optimizer import optimize_frame, widen_series
+from utils.sheet_catalog import sheet_names
+from utils.sheet_versions import sheet_version
+from utils.sidecar import SIDECAR_DIRNAME, read_excel_columnar
+
+PROFILE_DIRNAME = "profiles"
+# Cambia cuando cambia lo que se guarda en un perfil: los perfiles de otro formato se recalculan
+PROFILE_FORMAT = 2
+# Valores más frecuentes que se guardan por columna
+TOP_VALUES = 5
+# Por encima de este número de filas los distintos se cuentan sobre hashes de 64 bits
+EXACT_DISTINCT_MAX_ROWS = 100_000
+# Procesos que calculan perfiles en segundo plano (un solo pool para todo el proceso)
+PROFILE_WORKERS = int(os.getenv("EXCEL_PROFILE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_memory: Dict[str, Dict[str, Any]] = {}
+_memory_lock = threading.Lock()
+_building: set = set()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _profile_path(path: str) -> str:
+    data_dir, file_name = os.path.split(os.path.abspath(path))
+    return os.path.join(data_dir, SIDECAR_DIRNAME, PROFILE_DIRNAME, f"{file_name}.json")
+
+
+def _source_signature(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"tamano_bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _jsonable(value: Any) -> Any:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    return value if isinstance(value, (int, float, str, bool)) else str(value)
+
+
+def approx_distinct(series: pd.Series) -> int:
+    """
+    Distintos de una columna. En las series grandes se cuentan los hashes de 64 bits de los
+    valores (una tabla hash de enteros en lugar de objetos); las colisiones son despreciables.
+    """
+    series = series.dropna()
+    if len(series) <= EXACT_DISTINCT_MAX_ROWS:
+        return int(series.nunique())
+    return int(len(pd.unique(pd.util.hash_pandas_object(series, index=False).to_numpy())))
+
+
+def profile_frame(df: pd.DataFrame) -> Dict[str, Any]:
+    """Perfil de un DataFrame: filas, memoria y estadísticas por columna."""
+    columns: List[Dict[str, Any]] = []
+    for name in df.columns:
+        # El tipo es el del DataFrame cacheado; las estadísticas, sobre los valores sin compactar
+        # (una `category` sin orden no tiene mínimo ni máximo)
+        series = widen_series(df[name])
+        info: Dict[str, Any] = {
+            "nombre": str(name),
+            "tipo": str(df[name].dtype),
+            "nulos": int(series.isna().sum()),
+            "distintos_aprox": approx_distinct(series),
+            "minimo": None,
+            "maximo": None,
+        }
+        non_null = series.dropna()
+        if not non_null.empty:
+            try:
+                info["minimo"] = _jsonable(non_null.min())
+                info["maximo"] = _jsonable(non_null.max())
+            except TypeError:
+                pass
+            top = non_null.value_counts().head(TOP_VALUES)
+            info["top_valores"] = [[_jsonable(v), int(c)] for v, c in top.items()]
+        columns.append(info)
+    return {"filas": int(len(df)), "memoria_bytes": int(df.memory_usage(deep=True).sum()), "columnas": columns}
+
+
+def _read_profile_file(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_profile_path(path), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def has_profile(path: str) -> bool:
+    """Si el archivo tiene un perfil guardado (vigente o no)."""
+    return os.path.exists(_profile_path(path))
+
+
+def build_profile(path: str) -> Dict[str, Any]:
+    """
+    Calcula y guarda el perfil de todas las hojas de un archivo. Las hojas cuya versión no
+    cambió desde el perfil anterior se copian de él sin volver a leerlas.
+    """
+    signature = _source_signature(path)
+    previous = _read_profile_file(path) or {}
+    if previous.get("formato") != PROFILE_FORMAT:
+        previous = {}
+    previous_sheets = previous.get("hojas") or {}
+    previous_versions = previous.get("versiones") or {}
+    sheets = {}
+    versions = {}
+    for sheet in sheet_names(path):
+        versions[sheet] = sheet_version(path, sheet)
+        if sheet in previous_sheets and previous_versions.get(sheet) == versions[sheet]:
+            sheets[sheet] = previous_sheets[sheet]
+        else:
+            # Los mismos tipos compactos que la caché de DataFrames, sin guardar la hoja en ella
+            sheets[sheet] = profile_frame(optimize_frame(read_excel_columnar(path, sheet), path, sheet))
+    profile = {"archivo": os.path.basename(path), "source": signature, "hojas": sheets, "versiones": versions,
+               "formato": PROFILE_FORMAT}
+    target = _profile_path(path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(profile, fh, ensure_ascii=False)
+    os.replace(tmp, target)
+    with _memory_lock:
+        _memory[os.path.abspath(path)] = profile
+    return profile
+
+
+def get_profile(path: str, build: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Perfil vigente de un archivo. Se sirve desde memoria o desde disco si la versión coincide;
+    si está desactualizado se reconstruye (solo cuando `build` es True).
+    """
+    abs_path = os.path.abspath(path)
+    signature = _source_signature(path)
+    with _memory_lock:
+        profile = _memory.get(abs_path)
+    if profile is not None and profile.get("source") == signature:
+        return profile
+    profile = _read_profile_file(path)
+    if profile is not None and profile.get("source") == signature and profile.get("formato") == PROFILE_FORMAT:
+        with _memory_lock:
+            _memory[abs_path] = profile
+        return profile
+    return build_profile(path) if build else None
+
+
+def get_sheet_profile(path: str, sheet: str) -> Dict[str, Any]:
+    """
+    Perfil de una sola hoja. Si el perfil del archivo completo está vigente se toma de ahí;
+    si no, se parsea solo esa hoja (y queda en la caché de DataFrames para el análisis).
+    """
+    profile = get_profile(path, build=False)
+    if profile is not None and sheet in profile["hojas"]:
+        return {"archivo": profile["archivo"], "source": profile["source"],
+                "hojas": {sheet: profile["hojas"][sheet]}}
+    return {"archivo": os.path.basename(path), "source": _source_signature(path),
+            "hojas": {sheet: profile_frame(read_excel_cached(path, sheet))}, "formato": PROFILE_FORMAT}
+
+
+def _build_profile_worker(path: str) -> str:
+    build_profile(path)
+    return path
+
+
+def _profile_pool() -> ProcessPoolExecutor:
+    # Se crea en el primer uso y se reutiliza: arrancar procesos con spawn cuesta segundos
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max(PROFILE_WORKERS, 1),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def refresh_profiles_async(paths: List[str]) -> None:
+    """
+    Calcula en segundo plano, repartidos entre procesos, los perfiles que falten o estén
+    desactualizados. No bloquea: las consultas siguientes los encontrarán en el índice.
+    """
+    stale = []
+    for path in paths:
+        try:
+            if get_profile(path, build=False) is None:
+                stale.append(os.path.abspath(path))
+        except OSError:
+            continue
+    with _memory_lock:
+        pending = [p for p in stale if p not in _building]
+        _building.update(pending)
+    if not pending:
+        return
+
+    def _done(path, future):
+        try:
+            # Cargar en la memoria de este proceso lo que calcularon los workers
+            future.result()
+            get_profile(path, build=False)
+        except Exception:
+            pass
+        finally:
+            with _memory_lock:
+                _building.discard(path)
+
+    pool = _profile_pool()
+    for i, path in enumerate(pending):
+        try:
+            future = pool.submit(_build_profile_worker, path)
+        except RuntimeError:
+            # Pool roto (un worker murió): se descarta y el siguiente llamado crea otro
+            _discard_pool(pool)
+            with _memory_lock:
+                _building.difference_update(pending[i:])
+            return
+        future.add_done_callback(lambda f, p=path: _done(p, f))
+
+
+def format_profile(profile: Dict[str, Any], sheet: Optional[str] = None) -> str:
+    """Texto compacto con el esquema de un archivo para el agente."""
+    lines = [f"Esquema de {profile['archivo']}:"]
+    for sheet_name, info in profile["hojas"].items():
+        if sheet is not None and sheet_name != sheet:
+            continue
+        memoria = f", {info['memoria_bytes'] / 2 ** 20:.1f} MB en memoria" if info.get("memoria_bytes") is not None else ""
+        lines.append(f"Hoja '{sheet_name}' ({info['filas']} filas{memoria}):")
+        for col in info["columnas"]:
+            rango = f" | rango: {col['minimo']} – {col['maximo']}" if col["minimo"] is not None else ""
+            top = ", ".join(str(v) for v, _ in col.get("top_valores", [])[:3])
+            lines.append(
+                f"- {col['nombre']} ({col['tipo']}) | nulos: {col['nulos']} | "
+                f"distintos≈{col['distintos_aprox']}{rango}" + (f" | frecuentes: {top}" if top else "")
+            )
+    return "\n".join(lines)
@@ -0,0 +1,185 @@
+"""
+Ruta rápida determinista para consultas simples.
+
+Reconoce en español e inglés agregaciones (máximo, mínimo, promedio, suma, conteo),
+conteo de filas, sumas agrupadas y filtros de igualdad, resuelve los nombres de
+columna de forma aproximada contra el DataFrame y las ejecuta con pandas vectorizado,
+sin llamar al LLM. Si la instrucción no se entiende con seguridad se devuelve None
+y la herramienta sigue por PandasAI.
+"""
+import difflib
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from utils.frame_optimizer import widen_frame, widen_series
+from utils.result_cache import normalize_instruction
+
+# Similitud mínima para aceptar un nombre de columna aproximado
+COLUMN_MATCH_CUTOFF = 0.8
+
+_OPERATIONS = {
+    "max": ["valor maximo", "valores maximos", "maximo", "maxima", "maximos", "max", "maximum", "mayor", "highest", "largest"],
+    "min": ["valor minimo", "valores minimos", "minimo", "minima", "minimos", "min", "minimum", "menor", "lowest", "smallest"],
+    "mean": ["promedio", "media", "mean", "average", "avg"],
+    "sum": ["suma", "sum", "total"],
+    "count": ["conteo", "count", "cantidad de valores"],
+}
+_OPERATION_WORDS = {word: op for op, words in _OPERATIONS.items() for word in words}
+_OPERATION_ALT = "|".join(sorted((re.escape(w) for w in _OPERATION_WORDS), key=len, reverse=True))
+
+_PREFIX = r"(?:(?:cual es|cuales son|dame|calcula|obten|muestra|muestrame|dime|what is|what are|get|compute|show|give me|find)\s+)?"
+_ARTICLE = r"(?:(?:el|la|los|las|the)\s+)?"
+_EACH_COLUMN = r"(?:por columna|de cada columna|de todas las columnas|por cada columna|per column|of each column|for each column|of all columns)"
+
+_AGG_RE = re.compile(
+    rf"^{_PREFIX}{_ARTICLE}(?P<op>{_OPERATION_ALT})\s+(?:(?:de|del|of|en|in)\s+)?{_ARTICLE}"
+    rf"(?:(?:columna|column)\s+)?(?P<col>.+?)"
+    rf"(?:\s+(?:por|agrupad[oa]s? por|by|per|grouped by)\s+{_ARTICLE}(?:(?:columna|column)\s+)?(?P<by>.+))?$"
+)
+_AGG_ALL_RE = re.compile(rf"^{_PREFIX}{_ARTICLE}(?P<op>{_OPERATION_ALT})\s+{_EACH_COLUMN}$")
+_ROWS_RE = re.compile(
+    r"^(?:cuantas|cuantos|numero de|cantidad de|total de|how many|count of|number of|count)\s+"
+    r"(?:filas|registros|renglones|rows|records)"
+    r"(?:\s+(?:hay|tiene|tiene el archivo|hay en el archivo|are there|does it have|in the file|en el archivo))?$"
+)
+_FILTER_RE = re.compile(
+    rf"^(?:(?:filtra|filtrar|muestra|muestrame|dame|show|filter|get|list|lista)\s+)?{_ARTICLE}"
+    r"(?:(?:filas|registros|renglones|rows|records)\s+)?"
+    r"(?:donde|en las que|en los que|cuyo|cuya|con|where|with)\s+"
+    rf"{_ARTICLE}(?:(?:columna|column)\s+)?(?P<col>.+?)\s+"
+    r"(?:==|=|es igual a|igual a|sea|es|is equal to|equals|equal to|is)\s+(?P<val>.+)$"
+)
+
+_stats = {"consultas": 0, "ruta_rapida": 0, "fallback": 0}
+_stats_lock = threading.Lock()
+
+
+def resolve_column(name: str, columns: List[Any]) -> Optional[Any]:
+    """Busca una columna por nombre exacto normalizado y, si no hay, por similitud."""
+    wanted = normalize_instruction(name).strip("'\"`")
+    normalized = {normalize_instruction(str(c)): c for c in columns}
+    if wanted in normalized:
+        return normalized[wanted]
+    # Nombre parcial: todas sus palabras aparecen en una sola columna ("ventas" -> "Ventas Totales")
+    wanted_words = set(wanted.split())
+    containing = [key for key in normalized if wanted_words and wanted_words <= set(key.split())]
+    if len(containing) == 1:
+        return normalized[containing[0]]
+    close = difflib.get_close_matches(wanted, list(normalized), n=2, cutoff=COLUMN_MATCH_CUTOFF)
+    # Si dos columnas empatan en similitud la consulta es ambigua
+    if len(close) == 1 or (len(close) == 2 and
+                           difflib.SequenceMatcher(None, wanted, close[0]).ratio()
+                           > difflib.SequenceMatcher(None, wanted, close[1]).ratio()):
+        return normalized[close[0]]
+    return None
+
+
+@dataclass
+class QueryPlan:
+    kind: str
+    operation: Optional[str] = None
+    column: Any = None
+    by: Any = None
+    value: Any = None
+
+    def execute(self, df: pd.DataFrame) -> Any:
+        if self.kind == "rows":
+            return int(len(df))
+        if self.kind == "aggregate_all":
+            # Se agrega sobre los tipos anchos: sumar en float32 o int8 pierde precisión o desborda
+            numeric = widen_frame(df.select_dtypes("number"))
+            if self.operation == "count":
+                return df.count().rename_axis("columna").reset_index(name="count")
+            return getattr(numeric, self.operation)().rename_axis("columna").reset_index(name=self.operation)
+        if self.kind == "aggregate":
+            if self.by is not None:
+                # observed=True: las categorías sin filas no aparecen como grupos vacíos
+                values = widen_series(df[self.column]).groupby(df[self.by], dropna=False, observed=True)
+                return widen_frame(getattr(values, self.operation)().reset_index())
+            value = getattr(widen_series(df[self.column]), self.operation)()
+            return value.item() if hasattr(value, "item") else value
+        if self.kind == "filter":
+            return widen_frame(df[df[self.column] == self.value])
+        raise ValueError(f"Plan desconocido: {self.kind}")
+
+
+def _coerce_value(raw: str, series: pd.Series) -> Optional[Any]:
+    raw = raw.strip().strip("'\"`")
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        try:
+            number = float(raw.replace(",", ""))
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() and pd.api.types.is_integer_dtype(series) else number
+    # Se busca el valor real de la columna que coincide sin distinguir mayúsculas ni acentos
+    wanted = normalize_instruction(raw)
+    for candidate in series.dropna().unique():
+        if normalize_instruction(str(candidate)) == wanted:
+            return candidate
+    return None
+
+
+def plan_query(instruction: str, df: pd.DataFrame) -> Optional[QueryPlan]:
+    """Devuelve un plan si la instrucción es una consulta simple reconocible; None en otro caso."""
+    text = normalize_instruction(instruction)
+    columns = list(df.columns)
+
+    if _ROWS_RE.match(text):
+        return QueryPlan(kind="rows")
+
+    match = _AGG_ALL_RE.match(text)
+    if match:
+        return QueryPlan(kind="aggregate_all", operation=_OPERATION_WORDS[match.group("op")])
+
+    match = _FILTER_RE.match(text)
+    if match:
+        column = resolve_column(match.group("col"), columns)
+        if column is not None:
+            value = _coerce_value(match.group("val"), df[column])
+            if value is not None:
+                return QueryPlan(kind="filter", column=column, value=value)
+        return None
+
+    match = _AGG_RE.match(text)
+    if match:
+        operation = _OPERATION_WORDS[match.group("op")]
+        column = resolve_column(match.group("col"), columns)
+        by = resolve_column(match.group("by"), columns) if match.group("by") else None
+        if column is None or (match.group("by") and by is None):
+            return None
+        numeric = pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])
+        if operation in ("sum", "mean") and not numeric:
+            return None
+        return QueryPlan(kind="aggregate", operation=operation, column=column, by=by)
+    return None
+
+
+def try_fast_path(instruction: str, df: pd.DataFrame) -> Optional[Any]:
+    """
+    Ejecuta la instrucción por la ruta rápida si se puede; None si debe ir a PandasAI.
+    Cualquier error al ejecutar el plan también cae a PandasAI.
+    """
+    with _stats_lock:
+        _stats["consultas"] += 1
+    result = None
+    plan = plan_query(instruction, df)
+    if plan is not None:
+        try:
+            result = plan.execute(df)
+        except (KeyError, TypeError, ValueError):
+            result = None
+    with _stats_lock:
+        _stats["ruta_rapida" if result is not None else "fallback"] += 1
+    return result
+
+
+def fast_path_stats() -> Dict[str, float]:
+    """Contadores de la ruta rápida y su tasa de aciertos."""
+    with _stats_lock:
+        stats: Dict[str, float] = dict(_stats)
+    stats["tasa_ruta_rapida"] = stats["ruta_rapida"] / stats["consultas"] if stats["consultas"] else 0.0
+    return stats
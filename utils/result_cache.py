@@ -0,0 +1,207 @@
+"""
+Caché persistente (SQLite) de respuestas de PandasAI.
+
+La llave es la huella del contenido del archivo (SHA-256) más la instrucción
+normalizada (sin mayúsculas, acentos ni espacios repetidos), de modo que
+"Valores máximos por columna" y "valores  maximos por columna" comparten entrada.
+Si el archivo cambia, su huella cambia y las entradas anteriores se eliminan.
+"""
+import hashlib
+import io
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+RESULT_CACHE_PATH = os.getenv("EXCEL_RESULT_CACHE_PATH", os.path.join("data", ".cache", "results.sqlite"))
+# Tiempo de vida de cada respuesta (segundos)
+RESULT_CACHE_TTL = int(os.getenv("EXCEL_RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+# Tamaño máximo total de las respuestas guardadas (bytes)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("EXCEL_RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Huellas memorizadas (una por archivo y versión en disco); las menos usadas se descartan
+FINGERPRINT_MEMO_ENTRIES = int(os.getenv("EXCEL_FINGERPRINT_MEMO_ENTRIES", "1024"))
+
+_fingerprints: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_fingerprints_lock = threading.Lock()
+
+
+def normalize_instruction(text: str) -> str:
+    """Normaliza una instrucción: minúsculas, sin acentos, espacios colapsados y sin puntuación final."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return text.strip("¿?¡!. ")
+
+
+def content_fingerprint(path: str) -> str:
+    """
+    SHA-256 del contenido del archivo. Se memoriza por (ruta, tamaño, mtime_ns)
+    para no volver a leer el archivo completo mientras no cambie.
+    """
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        digest = _fingerprints.get(stat_key)
+        if digest is not None:
+            _fingerprints.move_to_end(stat_key)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    with _fingerprints_lock:
+        # Las huellas de versiones anteriores del mismo archivo ya no sirven
+        for old_key in [k for k in _fingerprints if k[0] == stat_key[0] and k != stat_key]:
+            del _fingerprints[old_key]
+        _fingerprints[stat_key] = digest
+        while len(_fingerprints) > FINGERPRINT_MEMO_ENTRIES:
+            _fingerprints.popitem(last=False)
+    return digest
+
+
+def scope_to_sheet(path: str, fingerprint: str, sheet: Optional[str]) -> Tuple[str, str]:
+    """
+    Ruta y huella con que se guardan las respuestas sobre una hoja concreta (`archivo.xlsx#Hoja3`).
+    Sin hoja se usa la primera del libro y la llave es la de siempre.
+    """
+    if sheet is None:
+        return path, fingerprint
+    return f"{path}#{sheet}", f"{fingerprint}#{sheet}"
+
+
+def _serialize(value: Any) -> Tuple[str, bytes]:
+    if isinstance(value, pd.DataFrame):
+        try:
+            buffer = io.BytesIO()
+            value.to_parquet(buffer, index=False)
+            return "dataframe_parquet", buffer.getvalue()
+        except (ImportError, ValueError, TypeError):
+            # Sin pyarrow o con columnas no representables en Parquet
+            pass
+    return "pickle", pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _deserialize(kind: str, payload: bytes) -> Any:
+    if kind == "dataframe_parquet":
+        return pd.read_parquet(io.BytesIO(payload))
+    return pickle.loads(payload)
+
+
+class ResultCache:
+    """Respuestas de PandasAI en SQLite con TTL y expulsión LRU por tamaño total."""
+
+    def __init__(self, db_path: str = RESULT_CACHE_PATH, ttl: int = RESULT_CACHE_TTL,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._initialized = False
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, path TEXT, fingerprint TEXT, instruction TEXT,"
+                " kind TEXT, payload BLOB, size INTEGER, created REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results(last_access)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def make_key(fingerprint: str, instruction: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\0{normalize_instruction(instruction)}".encode("utf-8")).hexdigest()
+
+    def get(self, fingerprint: str, instruction: str) -> Optional[Any]:
+        key = self.make_key(fingerprint, instruction)
+        now = time.time()
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                with closing(self._connect()) as conn, conn:
+                    row = conn.execute("SELECT kind, payload, created FROM results WHERE key = ?", (key,)).fetchone()
+                    if row is not None and now - row[2] > self.ttl:
+                        conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                        row = None
+                    if row is not None:
+                        conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            except (OSError, sqlite3.Error):
+                # Un fallo de la caché nunca debe impedir el análisis
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _deserialize(row[0], row[1])
+
+    def put(self, path: str, fingerprint: str, instruction: str, value: Any) -> None:
+        kind, payload = _serialize(value)
+        if len(payload) > self.max_bytes:
+            return
+        key = self.make_key(fingerprint, instruction)
+        now = time.time()
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                with closing(self._connect()) as conn, conn:
+                    # Las respuestas sobre versiones anteriores del archivo ya no son válidas
+                    conn.execute("DELETE FROM results WHERE path = ? AND fingerprint != ?", (abs_path, fingerprint))
+                    conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, abs_path, fingerprint, normalize_instruction(instruction),
+                         kind, payload, len(payload), now, now),
+                    )
+                    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                    while total > self.max_bytes:
+                        oldest = conn.execute("SELECT key, size FROM results ORDER BY last_access LIMIT 1").fetchone()
+                        if oldest is None:
+                            break
+                        conn.execute("DELETE FROM results WHERE key = ?", (oldest[0],))
+                        total -= oldest[1]
+            except (OSError, sqlite3.Error):
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute("DELETE FROM results")
+            except (OSError, sqlite3.Error):
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache()
+
+
+def is_cacheable_result(value: Any) -> bool:
+    """
+    Los errores de PandasAI llegan como texto y los gráficos como la ruta de una imagen
+    temporal que se sobrescribe; ninguno de los dos se guarda.
+    """
+    if value is None:
+        return False
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        return not (lowered.startswith("[error]") or lowered.startswith("unfortunately")
+                    or lowered.endswith(".png"))
+    return True
@@ -0,0 +1,157 @@
+"""
+Almacén de resultados tabulares del lado del servidor.
+
+Cuando PandasAI devuelve un DataFrame, en lugar de mandar la tabla completa al modelo
+se guarda aquí bajo un handle opaco y la herramienta devuelve solo forma, tipos, una vista
+previa y el handle. Las páginas siguientes, ordenamientos, filtros y descargas se sirven
+desde el almacén sin otra llamada al LLM. Los resultados se mantienen en memoria hasta un
+límite de bytes; los más antiguos se vuelcan a disco.
+"""
+import os
+import pickle
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from utils.dataframe_cache import frame_nbytes
+from utils.export_engine import EXPORTS_DIR, write_result
+
+RESULT_STORE_DIR = os.getenv("EXCEL_RESULT_STORE_DIR", os.path.join("data", ".cache", "results"))
+# Memoria máxima de resultados en RAM antes de volcar a disco
+RESULT_STORE_MAX_BYTES = int(os.getenv("EXCEL_RESULT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Tiempo que se conserva un resultado (segundos)
+RESULT_STORE_TTL = int(os.getenv("EXCEL_RESULT_STORE_TTL", str(24 * 3600)))
+# Filas de la vista previa que se devuelven al modelo
+PREVIEW_ROWS = int(os.getenv("EXCEL_RESULT_PREVIEW_ROWS", "10"))
+
+HANDLE_RE = re.compile(r"\bres_[0-9a-f]{12}\b")
+
+
+class ResultStore:
+    def __init__(self, spill_dir: str = RESULT_STORE_DIR, max_bytes: int = RESULT_STORE_MAX_BYTES,
+                 ttl: int = RESULT_STORE_TTL):
+        self.spill_dir = spill_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._created: Dict[str, float] = {}
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self.spilled = 0
+
+    def _spill_path(self, handle: str) -> str:
+        return os.path.join(self.spill_dir, f"{handle}.pkl")
+
+    def put(self, df: pd.DataFrame) -> str:
+        """Guarda un DataFrame y devuelve su handle."""
+        handle = f"res_{secrets.token_hex(6)}"
+        size = frame_nbytes(df)
+        with self._lock:
+            self._purge_expired()
+            self._memory[handle] = (df, size)
+            self._created[handle] = time.time()
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+                self._spill(next(iter(self._memory)))
+        return handle
+
+    def _spill(self, handle: str) -> None:
+        df, size = self._memory.pop(handle)
+        self._memory_bytes -= size
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            df.to_pickle(self._spill_path(handle))
+            self.spilled += 1
+        except (OSError, pickle.PicklingError):
+            self._created.pop(handle, None)
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        for handle in [h for h, created in self._created.items() if now - created > self.ttl]:
+            self._created.pop(handle, None)
+            entry = self._memory.pop(handle, None)
+            if entry is not None:
+                self._memory_bytes -= entry[1]
+            else:
+                try:
+                    os.remove(self._spill_path(handle))
+                except OSError:
+                    pass
+
+    def get(self, handle: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            self._purge_expired()
+            entry = self._memory.get(handle)
+            if entry is not None:
+                self._memory.move_to_end(handle)
+                return entry[0]
+            if handle not in self._created:
+                return None
+        try:
+            return pd.read_pickle(self._spill_path(handle))
+        except (OSError, pickle.UnpicklingError):
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"en_memoria": len(self._memory), "bytes_en_memoria": self._memory_bytes,
+                    "total": len(self._created), "volcados_a_disco": self.spilled}
+
+
+result_store = ResultStore()
+
+
+def describe_result(df: pd.DataFrame, handle: str, preview_rows: int = PREVIEW_ROWS) -> str:
+    """Texto compacto para el modelo: forma, tipos, vista previa y handle."""
+    dtypes = ", ".join(f"{col} ({dtype})" for col, dtype in df.dtypes.astype(str).items())
+    preview = df.head(preview_rows).to_string(index=False)
+    return (f"Resultado tabular: {len(df)} filas x {len(df.columns)} columnas.\n"
+            f"Columnas: {dtypes}\n"
+            f"Primeras {min(preview_rows, len(df))} filas:\n{preview}\n"
+            f"handle: {handle} (usa `ver_resultado` con este handle para ver más páginas, ordenar, filtrar o descargar)")
+
+
+def store_and_describe(df: pd.DataFrame) -> str:
+    """
+    Tablas pequeñas se devuelven completas; las grandes se guardan en el almacén
+    y se describen con su handle.
+    """
+    if len(df) <= PREVIEW_ROWS:
+        return df.to_string(index=False)
+    return describe_result(df, result_store.put(df))
+
+
+def slice_result(df: pd.DataFrame, page: int = 1, page_size: int = 50,
+                 sort_by: Optional[str] = None, descending: bool = False,
+                 filter_column: Optional[str] = None, filter_value: Optional[str] = None) -> Tuple[pd.DataFrame, int]:
+    """Aplica filtro de igualdad, orden y paginación. Devuelve la página y el total de filas tras filtrar."""
+    if filter_column:
+        if filter_column not in df.columns:
+            raise KeyError(filter_column)
+        column = df[filter_column]
+        df = df[column.astype(str).str.casefold() == str(filter_value).casefold()]
+    if sort_by:
+        if sort_by not in df.columns:
+            raise KeyError(sort_by)
+        df = df.sort_values(sort_by, ascending=not descending, kind="stable")
+    page = max(page, 1)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], len(df)
+
+
+def export_result(handle: str, fmt: str = "csv") -> Optional[str]:
+    """Escribe el resultado completo en exports/ y devuelve la ruta."""
+    df = result_store.get(handle)
+    if df is None:
+        return None
+    return write_result(df, os.path.join(EXPORTS_DIR, f"{handle}.{fmt}"))
+
+
+def find_handles(text: str) -> List[str]:
+    """Handles de resultados mencionados en un texto, sin repetir y en orden."""
+    return list(dict.fromkeys(HANDLE_RE.findall(text or "")))
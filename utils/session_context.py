@@ -0,0 +1,11 @@
+"""
+Contexto de la sesión de chat que origina cada operación.
+
+Chainlit fija `current_session_id` al recibir un mensaje; como `run_tool_async` copia el
+contexto al hilo de la herramienta, el código que corre en el pool puede saber a qué
+sesión pertenece (p. ej. para reportar el progreso de una exportación en su chat).
+"""
+import contextvars
+from typing import Optional
+
+current_session_id: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("current_session_id", default=None)
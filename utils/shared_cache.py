@@ -0,0 +1,301 @@
+"""
+Caché de DataFrames compartida entre procesos (varios workers de Chainlit en la misma máquina).
+
+Cada hoja ya parseada y optimizada se guarda una sola vez como Arrow IPC sin compresión en
+memoria compartida (`/dev/shm` por defecto) y cualquier worker la abre con memory-map: las
+columnas numéricas sin nulos y el texto respaldado por Arrow se usan sin copiar, así que las
+páginas son las mismas para todos los procesos y la caché se calienta una sola vez.
+
+Un índice SQLite en el mismo directorio guarda las entradas (tamaño, último acceso) y cuántas
+referencias tiene cada proceso. Mientras un proceso tiene una entrada adjunta no se expulsa; al
+superar `EXCEL_SHARED_CACHE_MAX_BYTES` se expulsan las demás por antigüedad de uso. La construcción
+de una entrada toma un lock de archivo, de modo que si dos workers piden la misma hoja a la vez
+solo uno la parsea y el otro la adjunta. Las referencias de procesos que ya no existen se limpian
+en la siguiente expulsión.
+"""
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import closing, contextmanager
+from typing import Dict, Hashable, Iterator, Optional
+
+import pandas as pd
+
+from utils.sidecar import frame_from_table, table_from_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow es opcional: sin él cada proceso mantiene solo su caché local
+    pa = None
+    ipc = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (a lo sumo, dos workers parsean la misma hoja)
+    fcntl = None
+
+SHARED_CACHE_ENABLED = os.getenv("EXCEL_SHARED_CACHE", "true").lower() in ("1", "true", "yes")
+_DEFAULT_DIR = "/dev/shm/excel-chainlit" if os.path.isdir("/dev/shm") else os.path.join("data", ".cache", "shared")
+SHARED_CACHE_DIR = os.getenv("EXCEL_SHARED_CACHE_DIR", _DEFAULT_DIR)
+# Tamaño máximo de todas las entradas compartidas (bytes de los archivos Arrow)
+SHARED_CACHE_MAX_BYTES = int(os.getenv("EXCEL_SHARED_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+_stats = {"adjuntadas": 0, "fallos": 0, "guardadas": 0, "expulsadas": 0, "errores": 0}
+_stats_lock = threading.Lock()
+
+
+def _bump(field: str) -> None:
+    with _stats_lock:
+        _stats[field] += 1
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe pero pertenece a otro usuario
+        return True
+    return True
+
+
+class SharedFrameCache:
+    """Entradas Arrow IPC en un directorio compartido, indexadas en SQLite con conteo de referencias."""
+
+    def __init__(self, directory: str = SHARED_CACHE_DIR, max_bytes: int = SHARED_CACHE_MAX_BYTES,
+                 enabled: bool = SHARED_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled and pa is not None
+        self.db_path = os.path.join(directory, "index.sqlite")
+        self._initialized = False
+
+    @property
+    def _pid(self) -> int:
+        # Los workers pueden crearse con fork después de importar este módulo
+        return os.getpid()
+
+    # --- Índice ---
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.join(self.directory, "locks"), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, path TEXT, sheet TEXT, version TEXT,"
+                " size INTEGER, created REAL, last_access REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (key TEXT, pid INTEGER, count INTEGER, PRIMARY KEY (key, pid))")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def make_key(key: Hashable) -> str:
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+
+    def _data_path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.arrow")
+
+    # --- Lectura ---
+    def attach(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """DataFrame de la entrada abierto con memory-map (sin copiar lo que Arrow permite), o None."""
+        if not self.enabled:
+            return None
+        digest = self.make_key(key)
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    found = conn.execute("SELECT 1 FROM entries WHERE key = ?", (digest,)).fetchone()
+                    if found is not None:
+                        # La referencia se toma antes de abrir el archivo para que nadie lo expulse entretanto
+                        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), digest))
+                        conn.execute("INSERT INTO refs VALUES (?, ?, 1) ON CONFLICT(key, pid) DO UPDATE SET count = count + 1",
+                                     (digest, self._pid))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            if found is None:
+                _bump("fallos")
+                return None
+            df = self._open(digest)
+        except (OSError, sqlite3.Error, pa.ArrowInvalid):
+            _bump("errores")
+            self._release(digest)
+            return None
+        # La referencia se libera cuando el proceso suelta el DataFrame (p. ej. al salir de la caché local)
+        weakref.finalize(df, self._release, digest).atexit = False
+        _bump("adjuntadas")
+        return df
+
+    def _open(self, digest: str) -> pd.DataFrame:
+        source = pa.memory_map(self._data_path(digest), "r")
+        table = ipc.open_file(source).read_all()
+        # split_blocks evita consolidar columnas: las que no necesitan conversión quedan sobre el mapa
+        return frame_from_table(table, split_blocks=True)
+
+    def _release(self, digest: str) -> None:
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("UPDATE refs SET count = count - 1 WHERE key = ? AND pid = ?", (digest, self._pid))
+                conn.execute("DELETE FROM refs WHERE count <= 0")
+        except (OSError, sqlite3.Error):
+            pass
+
+    def release_process(self) -> None:
+        """Suelta todas las referencias de este proceso (al salir)."""
+        if not self.enabled or not self._initialized:
+            return
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM refs WHERE pid = ?", (self._pid,))
+        except (OSError, sqlite3.Error):
+            pass
+
+    # --- Escritura ---
+    @contextmanager
+    def building(self, key: Hashable) -> Iterator[None]:
+        """Lock entre procesos mientras se construye una entrada; el segundo en llegar espera y la adjunta."""
+        if not self.enabled or fcntl is None:
+            yield
+            return
+        try:
+            self._connect().close()
+            fh = open(os.path.join(self.directory, "locks", f"{self.make_key(key)}.lock"), "a+b")
+        except (OSError, sqlite3.Error):
+            yield
+            return
+        with fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def put(self, key: Hashable, df: pd.DataFrame, path: str = "", sheet: object = "", version: str = "") -> bool:
+        """
+        Guarda el DataFrame como entrada compartida. Las versiones anteriores de la misma hoja se
+        quitan del índice. False si no cabe, si Arrow no representa sus columnas o etiquetas o si el
+        directorio falla.
+        """
+        if not self.enabled:
+            return False
+        digest = self.make_key(key)
+        target = self._data_path(digest)
+        # Las etiquetas de columna que no son texto (2024, fechas) viajan en la metadata del esquema
+        table = table_from_frame(df)
+        if table is None:
+            return False
+        tmp = f"{target}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with pa.OSFile(tmp, "wb") as sink:
+                with ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            size = os.path.getsize(tmp)
+            if size > self.max_bytes:
+                os.remove(tmp)
+                return False
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    stale = [row[0] for row in conn.execute(
+                        "SELECT key FROM entries WHERE path = ? AND sheet = ? AND key != ?", (path, str(sheet), digest))]
+                    for old in stale:
+                        self._delete(conn, old)
+                    if not self._make_room(conn, size, digest):
+                        conn.execute("ROLLBACK")
+                        os.remove(tmp)
+                        return False
+                    os.replace(tmp, target)
+                    now = time.time()
+                    conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (digest, path, str(sheet), version, size, now, now))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except (OSError, sqlite3.Error):
+            # Directorio lleno (p. ej. /dev/shm pequeño en un contenedor) o sin permisos
+            _bump("errores")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        _bump("guardadas")
+        return True
+
+    def _delete(self, conn: sqlite3.Connection, digest: str) -> None:
+        # En Linux, borrar un archivo mapeado es seguro: los procesos que lo tienen abierto lo siguen leyendo
+        conn.execute("DELETE FROM entries WHERE key = ?", (digest,))
+        try:
+            os.remove(self._data_path(digest))
+        except OSError:
+            pass
+
+    def _make_room(self, conn: sqlite3.Connection, size: int, keep: str) -> bool:
+        # Las referencias de procesos muertos no deben impedir la expulsión
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM refs").fetchall():
+            if pid != self._pid and not _pid_alive(pid):
+                conn.execute("DELETE FROM refs WHERE pid = ?", (pid,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE key != ?", (keep,)).fetchone()[0]
+        if total + size <= self.max_bytes:
+            return True
+        candidates = conn.execute(
+            "SELECT key, size FROM entries WHERE key != ? AND key NOT IN (SELECT key FROM refs)"
+            " ORDER BY last_access", (keep,)).fetchall()
+        if total - sum(entry_size for _, entry_size in candidates) + size > self.max_bytes:
+            # Ni expulsando todo lo que no está en uso alcanzaría: no se expulsa nada
+            return False
+        for digest, entry_size in candidates:
+            self._delete(conn, digest)
+            _bump("expulsadas")
+            total -= entry_size
+            if total + size <= self.max_bytes:
+                break
+        return True
+
+    def clear(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            with closing(self._connect()) as conn:
+                for (digest,) in conn.execute("SELECT key FROM entries").fetchall():
+                    self._delete(conn, digest)
+                conn.execute("DELETE FROM refs")
+        except (OSError, sqlite3.Error):
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        with _stats_lock:
+            stats = dict(_stats)
+        stats["entries"] = stats["bytes"] = stats["referenciadas"] = 0
+        stats["max_bytes"] = self.max_bytes
+        if self.enabled and self._initialized:
+            try:
+                with closing(self._connect()) as conn:
+                    stats["entries"], stats["bytes"] = conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                    stats["referenciadas"] = conn.execute("SELECT COUNT(DISTINCT key) FROM refs").fetchone()[0]
+            except (OSError, sqlite3.Error):
+                pass
+        return stats
+
+
+shared_cache = SharedFrameCache()
+atexit.register(shared_cache.release_process)
+
+
+def shared_cache_stats() -> Dict[str, int]:
+    return shared_cache.stats()
@@ -0,0 +1,195 @@
+"""
+Catálogo de hojas de un libro Excel sin parsear las celdas.
+
+Un .xlsx es un zip: `xl/workbook.xml` lista las hojas (nombre, estado, relación) y
+`xl/_rels/workbook.xml.rels` dice en qué parte del zip está cada una. El elemento
+`<dimension ref="A1:K500"/>` va al principio del XML de cada hoja, así que basta con
+descomprimir los primeros kilobytes para conocer su tamaño. Con esto se puede responder
+qué hojas tiene un libro (y cuántas filas y columnas) sin cargar ninguna en pandas.
+
+Las herramientas aceptan `archivo.xlsx#Hoja3`: solo esa hoja se parsea y se cachea.
+"""
+import os
+import re
+import threading
+import unicodedata
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+SheetRef = Union[int, str]
+
+# Bytes descomprimidos del XML de cada hoja que se leen buscando `<dimension>`
+DIMENSION_SCAN_BYTES = 64 * 1024
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\s+ref="([^"]+)"')
+_CELL_RE = re.compile(r"([A-Z]+)(\d+)")
+
+_catalogs: Dict[Tuple[str, int, int], List[Dict[str, Any]]] = {}
+_catalogs_lock = threading.Lock()
+
+
+class SheetNotFoundError(LookupError):
+    """La hoja pedida no existe en el libro (el mensaje lista las disponibles)."""
+
+
+def _column_number(letters: str) -> int:
+    number = 0
+    for char in letters:
+        number = number * 26 + ord(char) - ord("A") + 1
+    return number
+
+
+def _parse_dimension(ref: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """'A1:K500' -> (500, 11): filas (encabezado incluido) y columnas del rango usado."""
+    if not ref:
+        return None, None
+    cells = [_CELL_RE.match(part) for part in ref.replace("$", "").upper().split(":")]
+    if not all(cells):
+        return None, None
+    start, end = cells[0], cells[-1]
+    rows = int(end.group(2)) - int(start.group(2)) + 1
+    cols = _column_number(end.group(1)) - _column_number(start.group(1)) + 1
+    return rows, cols
+
+
+def _read_dimension(archive: zipfile.ZipFile, part: str) -> Optional[str]:
+    try:
+        with archive.open(part) as fh:
+            head = fh.read(DIMENSION_SCAN_BYTES)
+    except KeyError:
+        return None
+    match = _DIMENSION_RE.search(head)
+    return match.group(1).decode("ascii", "replace") if match else None
+
+
+def _xlsx_catalog(path: str) -> List[Dict[str, Any]]:
+    with zipfile.ZipFile(path) as archive:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        try:
+            rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+            targets = {rel.get("Id"): rel.get("Target", "") for rel in rels.iter(f"{_NS_PKG_REL}Relationship")}
+        except KeyError:
+            targets = {}
+        catalog = []
+        for position, sheet in enumerate(workbook.iter(f"{_NS_MAIN}sheet")):
+            target = targets.get(sheet.get(f"{_NS_REL}id"), "")
+            # Los destinos son relativos a xl/ salvo que empiecen con '/'
+            part = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+            dimension = _read_dimension(archive, part) if target else None
+            rows, cols = _parse_dimension(dimension)
+            try:
+                info = archive.getinfo(part)
+            except KeyError:
+                info = None
+            catalog.append({
+                "nombre": sheet.get("name"),
+                "indice": position,
+                "visible": sheet.get("state", "visible") == "visible",
+                "dimension": dimension,
+                # La primera fila es el encabezado, igual que en `pd.read_excel`
+                "filas": max(rows - 1, 0) if rows is not None else None,
+                "columnas": cols,
+                # CRC32 y tamaño de la parte según el directorio central del zip (sin descomprimirla)
+                "parte": part if info else None,
+                "crc": info.CRC if info else None,
+                "tamano_xml": info.file_size if info else None,
+            })
+        return catalog
+
+
+def _xls_catalog(path: str) -> List[Dict[str, Any]]:
+    # El formato binario no tiene catálogo separado: xlrd abre el libro pero solo se piden los nombres
+    import pandas as pd
+
+    with pd.ExcelFile(path) as workbook:
+        names = list(workbook.sheet_names)
+    return [{"nombre": name, "indice": i, "visible": True, "dimension": None, "filas": None, "columnas": None,
+             "parte": None, "crc": None, "tamano_xml": None}
+            for i, name in enumerate(names)]
+
+
+def read_sheet_catalog(path: str) -> List[Dict[str, Any]]:
+    """
+    Hojas del libro en orden: nombre, índice, visibilidad, dimensión ('A1:K500'), filas de
+    datos, columnas y la parte del zip con su CRC32. Se memoriza por (ruta, tamaño, mtime_ns).
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = _xlsx_catalog(path) if zipfile.is_zipfile(path) else _xls_catalog(path)
+        with _catalogs_lock:
+            for old_key in [k for k in _catalogs if k[0] == key[0]]:
+                del _catalogs[old_key]
+            _catalogs[key] = catalog
+    return [dict(sheet) for sheet in catalog]
+
+
+def sheet_names(path: str) -> List[str]:
+    return [sheet["nombre"] for sheet in read_sheet_catalog(path)]
+
+
+def _normalize(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", name.casefold()).strip()
+
+
+def resolve_sheet(path: str, sheet: SheetRef) -> str:
+    """
+    Nombre exacto de la hoja pedida. Acepta el nombre tal cual, el nombre sin distinguir
+    mayúsculas ni acentos, o la posición empezando en 1 ('3' es la tercera hoja).
+    """
+    names = sheet_names(path)
+    if isinstance(sheet, int):
+        if 0 <= sheet < len(names):
+            return names[sheet]
+    else:
+        sheet = sheet.strip().strip("'\"")
+        if sheet in names:
+            return sheet
+        wanted = _normalize(sheet)
+        for name in names:
+            if _normalize(name) == wanted:
+                return name
+        if sheet.isdigit() and 1 <= int(sheet) <= len(names):
+            return names[int(sheet) - 1]
+    raise SheetNotFoundError(
+        f"La hoja '{sheet}' no existe en '{os.path.basename(path)}'. Hojas disponibles: {', '.join(names)}")
+
+
+def canonical_sheet_ref(path: str, sheet: SheetRef) -> SheetRef:
+    """
+    Una sola referencia por hoja para las cachés: 0 para la primera (lo que usan las herramientas
+    por defecto) y el nombre exacto para las demás, así `0`, `'Ventas'` y `1` no cargan ni guardan
+    dos veces la misma hoja. Si el libro no se puede leer o la hoja no existe, se devuelve tal cual.
+    """
+    try:
+        names = sheet_names(path)
+    except Exception:
+        return sheet
+    if isinstance(sheet, int):
+        name = names[sheet] if 0 <= sheet < len(names) else None
+    else:
+        name = sheet if sheet in names else None
+    if name is None:
+        return sheet
+    return 0 if name == names[0] else name
+
+
+def format_catalog(catalog: List[Dict[str, Any]]) -> str:
+    """'Ventas (500 filas, 11 columnas), Resumen (oculta)' para mostrar al agente."""
+    parts = []
+    for sheet in catalog:
+        details = []
+        if sheet["filas"] is not None:
+            details.append(f"{sheet['filas']} filas, {sheet['columnas']} columnas")
+        if not sheet["visible"]:
+            details.append("oculta")
+        parts.append(f"{sheet['nombre']} ({'; '.join(details)})" if details else sheet["nombre"])
+    return ", ".join(parts)
@@ -0,0 +1,338 @@
+"""
+Versiones por hoja de los libros .xlsx: al reescribir un libro solo se re-parsean las hojas que cambiaron.
+
+Un .xlsx guarda cada hoja en su propia parte del zip y el directorio central del zip trae el
+CRC32 y el tamaño de cada parte, así que comparar esos valores con los de la ingesta anterior
+dice qué hojas cambiaron sin descomprimir ninguna. Cada hoja tiene una versión que solo cambia
+cuando cambia su contenido; la caché de DataFrames, los sidecars y los perfiles se indexan por
+esa versión en lugar del tamaño+mtime del archivo.
+
+Dos partes son comunes a todo el libro:
+- `xl/sharedStrings.xml`: las celdas de texto apuntan a sus entradas por posición. Se guarda un
+  hash de 8 bytes por texto; si la tabla cambió, de cada hoja con XML idéntico se extraen (con
+  una expresión regular, sin parsear celdas) los índices que usa, y se reutiliza solo si todos
+  siguen apuntando al mismo texto.
+- `xl/styles.xml`: decide qué números son fechas; si cambió se re-parsean todas las hojas.
+
+El estado de la última ingesta de cada libro se guarda en `data/.cache/manifests/`, compartido
+por todos los procesos. Los libros .xls (sin zip) siguen versionándose por tamaño+mtime.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from utils.logger import logger
+from utils.sheet_catalog import read_sheet_catalog
+from utils.single_flight import single_flight
+
+SheetRef = Union[int, str]
+
+MANIFEST_DIRNAME = os.path.join(".cache", "manifests")
+# Segundos sin eventos del archivo antes de re-ingestarlo (un libro a medio escribir genera muchos)
+INGEST_DEBOUNCE_SECONDS = float(os.getenv("EXCEL_INGEST_DEBOUNCE_SECONDS", "2"))
+# Reportes de ingesta que se conservan para consulta
+MAX_REPORTS = 256
+
+_SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+_STYLES_PART = "xl/styles.xml"
+_SI_TAG = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}si"
+# Celdas de texto compartido: <c r="A1" t="s"><v>12</v></c>
+_SHARED_CELL_RE = re.compile(rb'<(?:\w+:)?c\b[^>]*?\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+_HASH_SIZE = 8
+_SCAN_BLOCK_BYTES = 4 * 1024 * 1024
+
+# Manifiesto vigente por archivo: ruta absoluta -> (tamaño, mtime_ns, manifiesto)
+_current: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+_reports: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_totals = {"ingestas": 0, "hojas_reutilizadas": 0, "hojas_reparseadas": 0, "sidecars_reconstruidos": 0}
+_lock = threading.Lock()
+_refreshes = single_flight("versiones_hojas")
+# Las re-ingestas en segundo plano corren de a una para no competir con las consultas
+_ingest_lock = threading.Lock()
+_timers: Dict[str, threading.Timer] = {}
+_watched: set = set()
+
+
+def _manifest_path(path: str) -> str:
+    data_dir, file_name = os.path.split(os.path.abspath(path))
+    return os.path.join(data_dir, MANIFEST_DIRNAME, f"{file_name}.json")
+
+
+def _load_manifest(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_manifest_path(path), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    target = _manifest_path(path)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, ensure_ascii=False)
+        os.replace(tmp, target)
+    except OSError:
+        # Sin manifiesto en disco se compara solo dentro de este proceso
+        pass
+
+
+def _hashes_path(path: str) -> str:
+    return _manifest_path(path)[:-len(".json")] + ".sst"
+
+
+def _load_hashes(path: str) -> Optional[bytes]:
+    try:
+        with open(_hashes_path(path), "rb") as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+def _save_hashes(path: str, hashes: bytes) -> None:
+    target = _hashes_path(path)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(hashes)
+        os.replace(tmp, target)
+    except OSError:
+        pass
+
+
+def _shared_string_hashes(archive: zipfile.ZipFile) -> bytes:
+    """Hash de 8 bytes de cada texto compartido, concatenados en orden."""
+    out = bytearray()
+    with archive.open(_SHARED_STRINGS_PART) as fh:
+        for _, elem in ET.iterparse(fh):
+            if elem.tag == _SI_TAG:
+                out += hashlib.blake2b("".join(elem.itertext()).encode("utf-8"), digest_size=_HASH_SIZE).digest()
+                elem.clear()
+    return bytes(out)
+
+
+def _referenced_strings(archive: zipfile.ZipFile, part: str) -> set:
+    """Índices de textos compartidos que usa una hoja (regex sobre el XML, por bloques)."""
+    indices = set()
+    tail = b""
+    with archive.open(part) as fh:
+        for block in iter(lambda: fh.read(_SCAN_BLOCK_BYTES), b""):
+            buffer = tail + block
+            # Se procesa hasta la última celda cerrada; el resto pasa al siguiente bloque
+            cut = buffer.rfind(b"</c>") + len(b"</c>")
+            indices.update(int(i) for i in _SHARED_CELL_RE.findall(buffer, 0, cut))
+            tail = buffer[cut:]
+    indices.update(int(i) for i in _SHARED_CELL_RE.findall(tail))
+    return indices
+
+
+def _same_strings(archive: zipfile.ZipFile, part: str, old: bytes, new: bytes) -> bool:
+    for i in _referenced_strings(archive, part):
+        start = i * _HASH_SIZE
+        if start + _HASH_SIZE > len(old) or old[start:start + _HASH_SIZE] != new[start:start + _HASH_SIZE]:
+            return False
+    return True
+
+
+def _version(sheet: Dict[str, Any], styles_crc: Optional[int], shared_digest: Optional[str]) -> str:
+    raw = f"{sheet['parte']}:{sheet['crc']}:{sheet['tamano_xml']}:{styles_crc}:{shared_digest}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _compare(path: str, old: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Manifiesto nuevo del libro y reporte de qué hojas se reutilizan y cuáles hay que re-parsear."""
+    catalog = read_sheet_catalog(path)
+    old = old or {}
+    old_shared = old.get("compartidos") or {}
+    old_sheets = old.get("hojas") or {}
+    sheets: Dict[str, Dict[str, Any]] = {}
+    reused: List[str] = []
+    reparsed: List[str] = []
+    with zipfile.ZipFile(path) as archive:
+        infos = {info.filename: info for info in archive.infolist()}
+        styles = infos.get(_STYLES_PART)
+        styles_crc = styles.CRC if styles else None
+        styles_ok = bool(old) and old.get("estilos") == styles_crc
+        shared_info = infos.get(_SHARED_STRINGS_PART)
+        shared = {"crc": shared_info.CRC if shared_info else None,
+                  "tamano": shared_info.file_size if shared_info else None}
+        shared_same = bool(old) and all(old_shared.get(k) == v for k, v in shared.items())
+        old_hashes = None if shared_same else _load_hashes(path)
+        if shared_same and os.path.exists(_hashes_path(path)):
+            new_hashes = None
+            shared["digest"] = old_shared.get("digest")
+        else:
+            new_hashes = _shared_string_hashes(archive) if shared_info else b""
+            shared["digest"] = hashlib.sha1(new_hashes).hexdigest()
+        for sheet in catalog:
+            previous = old_sheets.get(sheet["nombre"])
+            same = (previous is not None and styles_ok and sheet["parte"] is not None
+                    and all(previous.get(k) == sheet[k] for k in ("parte", "crc", "tamano_xml")))
+            if same and not shared_same:
+                # XML idéntico pero la tabla de textos cambió: se revisan solo los textos que usa esta hoja
+                same = old_hashes is not None and _same_strings(archive, sheet["parte"], old_hashes, new_hashes)
+            version = previous["version"] if same else _version(sheet, styles_crc, shared["digest"])
+            sheets[sheet["nombre"]] = {"parte": sheet["parte"], "crc": sheet["crc"],
+                                       "tamano_xml": sheet["tamano_xml"], "version": version}
+            (reused if same else reparsed).append(sheet["nombre"])
+    if new_hashes is not None:
+        _save_hashes(path, new_hashes)
+    manifest = {"orden": [s["nombre"] for s in catalog], "estilos": styles_crc,
+                "compartidos": shared, "hojas": sheets}
+    report = {"archivo": os.path.basename(path), "reutilizadas": reused, "reparseadas": reparsed,
+              "eliminadas": [name for name in old_sheets if name not in sheets],
+              "primera_ingesta": not old}
+    return manifest, report
+
+
+def _discard_stale_frames(path: str, manifest: Dict[str, Any]) -> None:
+    # Solo si la caché ya está cargada: esto no debe importar pandas
+    module = sys.modules.get("utils.dataframe_cache")
+    if module is not None:
+        versions = {sheet["version"] for sheet in manifest["hojas"].values()}
+        module.dataframe_cache.discard_stale(os.path.abspath(path), versions)
+
+
+def _refresh(path: str, size: int, mtime_ns: int) -> Dict[str, Any]:
+    source = {"tamano_bytes": size, "mtime_ns": mtime_ns}
+    old = _load_manifest(path)
+    if old is not None and old.get("source") == source:
+        # Otro proceso ya ingirió esta versión del archivo
+        manifest = old
+    else:
+        manifest, report = _compare(path, old)
+        manifest["source"] = source
+        _save_manifest(path, manifest)
+        _discard_stale_frames(path, manifest)
+        with _lock:
+            _reports[os.path.abspath(path)] = report
+            _reports.move_to_end(os.path.abspath(path))
+            while len(_reports) > MAX_REPORTS:
+                _reports.popitem(last=False)
+            if not report["primera_ingesta"]:
+                _totals["ingestas"] += 1
+                _totals["hojas_reutilizadas"] += len(report["reutilizadas"])
+                _totals["hojas_reparseadas"] += len(report["reparseadas"])
+        if not report["primera_ingesta"]:
+            logger.info("Re-ingesta archivo={} reutilizadas={} reparseadas={} eliminadas={}", report["archivo"],
+                        len(report["reutilizadas"]), len(report["reparseadas"]), len(report["eliminadas"]))
+    with _lock:
+        _current[os.path.abspath(path)] = (size, mtime_ns, manifest)
+    return manifest
+
+
+def get_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Manifiesto vigente de un .xlsx (se recalcula si el archivo cambió); None para otros formatos."""
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    with _lock:
+        current = _current.get(abs_path)
+    if current is not None and current[0] == stat.st_size and current[1] == stat.st_mtime_ns:
+        return current[2]
+    if not zipfile.is_zipfile(path):
+        return None
+    return _refreshes.do((abs_path, stat.st_size, stat.st_mtime_ns), _refresh, path, stat.st_size, stat.st_mtime_ns)
+
+
+def sheet_version(path: str, sheet_name: SheetRef = 0) -> str:
+    """
+    Versión del contenido de una hoja: no cambia mientras la hoja no cambie, aunque se
+    reescriban otras hojas del mismo libro.
+    """
+    manifest = get_manifest(path)
+    if manifest is not None:
+        if isinstance(sheet_name, int):
+            order = manifest["orden"]
+            sheet_name = order[sheet_name] if 0 <= sheet_name < len(order) else None
+        sheet = manifest["hojas"].get(sheet_name)
+        if sheet is not None:
+            return sheet["version"]
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def ingest(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Re-ingesta de un libro que cambió: compara sus hojas con la ingesta anterior, descarta lo
+    calculado para las hojas modificadas y vuelve a construir ya mismo los sidecars y el perfil
+    que estaban en uso. Las hojas sin cambios conservan su caché. Devuelve el reporte.
+    """
+    from utils.profile_index import get_profile, has_profile
+    from utils.sidecar import ensure_sidecar, is_sidecar_valid, sidecar_paths
+
+    abs_path = os.path.abspath(path)
+    manifest = get_manifest(path)
+    with _lock:
+        report = _reports.get(abs_path)
+    if manifest is None or report is None or report["primera_ingesta"]:
+        return dict(report) if report else None
+    rebuilt = 0
+    for name in report["reparseadas"]:
+        # sidecar_paths lleva la primera hoja al sidecar de índice 0, el que usan las herramientas
+        if (os.path.exists(sidecar_paths(path, name)["data"]) and not is_sidecar_valid(path, name)
+                and ensure_sidecar(path, name)):
+            rebuilt += 1
+    if has_profile(path):
+        # El perfil se reconstruye de forma incremental: solo las hojas modificadas
+        get_profile(path)
+    with _lock:
+        _totals["sidecars_reconstruidos"] += rebuilt
+        report["sidecars_reconstruidos"] = report.get("sidecars_reconstruidos", 0) + rebuilt
+        return dict(report)
+
+
+def ingest_report(path: str) -> Optional[Dict[str, Any]]:
+    """Último reporte de ingesta de un archivo: hojas reutilizadas, re-parseadas y eliminadas."""
+    with _lock:
+        report = _reports.get(os.path.abspath(path))
+        return dict(report) if report else None
+
+
+def ingest_stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_totals)
+
+
+def _run_ingest(path: str) -> None:
+    with _lock:
+        _timers.pop(path, None)
+    if not path.lower().endswith(".xlsx") or not os.path.isfile(path):
+        return
+    with _ingest_lock:
+        try:
+            ingest(path)
+        except (OSError, zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+            logger.warning("No se pudo re-ingestar '{}': {}", os.path.basename(path), e)
+
+
+def schedule_ingest(path: str, delay: float = INGEST_DEBOUNCE_SECONDS) -> None:
+    """Programa la re-ingesta de un archivo; cada nuevo evento del mismo archivo reinicia la espera."""
+    with _lock:
+        timer = _timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        timer = _timers[path] = threading.Timer(delay, _run_ingest, args=(path,))
+        timer.daemon = True
+    timer.start()
+
+
+def watch_directory(data_dir: str = "data") -> None:
+    """Re-ingesta en segundo plano cada libro que el índice de `data_dir` vea cambiar."""
+    from utils.file_manager import get_directory_index
+
+    key = os.path.abspath(data_dir)
+    with _lock:
+        if key in _watched:
+            return
+        _watched.add(key)
+    get_directory_index(data_dir).add_listener(lambda name: schedule_ingest(os.path.join(data_dir, name)))
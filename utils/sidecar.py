@@ -0,0 +1,247 @@
+"""
+Sidecars columnares para los archivos Excel de /data.
+
+Cada hoja se convierte una sola vez a Arrow IPC (sin compresión) dentro de
+`data/.cache/`, junto con un JSON que guarda la versión de la hoja de origen (ver
+utils/sheet_versions.py). Mientras esa hoja no cambie, aunque se reescriban otras del mismo
+libro, las lecturas posteriores abren el sidecar con memory-map en lugar de volver a parsear el XML.
+
+Uso desde línea de comandos (pre-construye todos los sidecars en paralelo):
+    python -m utils.sidecar [directorio] [--workers N] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.excel_stream import read_excel_auto
+from utils.file_manager import EXCEL_EXTENSIONS
+from utils.sheet_catalog import canonical_sheet_ref, sheet_names
+from utils.sheet_versions import sheet_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow es opcional: sin él se lee siempre el Excel
+    pa = None
+    ipc = None
+
+SIDECAR_DIRNAME = ".cache"
+
+SheetRef = Union[int, str]
+
+
+# Clave de la metadata del esquema Arrow con las etiquetas originales de las columnas
+COLUMN_LABELS_KEY = b"excel_chainlit.columns"
+
+
+def sidecar_paths(path: str, sheet_name: SheetRef = 0) -> Dict[str, str]:
+    """Rutas del sidecar (.arrow) y de su metadata (.json) para un archivo y hoja."""
+    # La primera hoja pedida por índice o por nombre comparte un solo sidecar
+    sheet_name = canonical_sheet_ref(path, sheet_name)
+    data_dir, file_name = os.path.split(os.path.abspath(path))
+    safe_sheet = re.sub(r"[^\w\-]", "_", str(sheet_name))
+    # El hash distingue el índice 0 de una hoja llamada "0", y "Hoja 1" de "Hoja_1"
+    digest = hashlib.sha1(repr(sheet_name).encode("utf-8")).hexdigest()[:8]
+    base = os.path.join(data_dir, SIDECAR_DIRNAME, f"{file_name}.{safe_sheet}.{digest}")
+    return {"data": base + ".arrow", "meta": base + ".json"}
+
+
+def _encode_label(label: Any) -> Optional[List[Any]]:
+    if isinstance(label, str):
+        return ["str", label]
+    if isinstance(label, (bool, np.bool_)):
+        return ["bool", bool(label)]
+    if isinstance(label, (int, np.integer)):
+        return ["int", int(label)]
+    if isinstance(label, (float, np.floating)):
+        return ["float", float(label)]
+    if isinstance(label, (pd.Timestamp, np.datetime64)) or hasattr(label, "isoformat"):
+        return ["timestamp", pd.Timestamp(label).isoformat()]
+    return None
+
+
+def _decode_label(encoded: List[Any]) -> Any:
+    kind, value = encoded
+    return pd.Timestamp(value) if kind == "timestamp" else value
+
+
+def table_from_frame(df: pd.DataFrame) -> Optional["pa.Table"]:
+    """
+    Tabla Arrow de un DataFrame que conserva las etiquetas de columna que no son texto (2024,
+    fechas) en la metadata del esquema; Arrow por sí solo las convierte en texto. None si
+    alguna columna o etiqueta no se puede representar.
+    """
+    encoded = [_encode_label(label) for label in df.columns]
+    if any(label is None for label in encoded):
+        return None
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    if any(kind != "str" for kind, _ in encoded):
+        metadata = dict(table.schema.metadata or {})
+        metadata[COLUMN_LABELS_KEY] = json.dumps(encoded).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+    return table
+
+
+def frame_from_table(table: "pa.Table", **to_pandas_kwargs) -> pd.DataFrame:
+    """Inverso de `table_from_frame`: restaura las etiquetas originales de las columnas."""
+    df = table.to_pandas(**to_pandas_kwargs)
+    labels = (table.schema.metadata or {}).get(COLUMN_LABELS_KEY)
+    if labels is not None:
+        df.columns = [_decode_label(label) for label in json.loads(labels)]
+    return df
+
+
+def _source_signature(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"tamano_bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_sidecar_valid(path: str, sheet_name: SheetRef = 0) -> bool:
+    """Un sidecar es válido si existe y su metadata coincide con la versión actual de la hoja."""
+    paths = sidecar_paths(path, sheet_name)
+    if not os.path.exists(paths["data"]) or not os.path.exists(paths["meta"]):
+        return False
+    try:
+        with open(paths["meta"], "r", encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return False
+    return meta.get("version") == sheet_version(path, sheet_name)
+
+
+def write_sidecar(path: str, df: pd.DataFrame, sheet_name: SheetRef = 0, version: Optional[str] = None) -> bool:
+    """
+    Escribe el sidecar de un DataFrame ya leído. `version` es la de la hoja al momento de
+    leerla (por defecto, la actual). Devuelve False si pyarrow no está disponible o si el
+    DataFrame no se puede representar en Arrow (columnas con tipos mezclados o etiquetas de
+    columna que no son texto, número ni fecha).
+    """
+    if pa is None:
+        return False
+    signature = _source_signature(path)
+    if version is None:
+        version = sheet_version(path, sheet_name)
+    paths = sidecar_paths(path, sheet_name)
+    table = table_from_frame(df)
+    if table is None:
+        return False
+    os.makedirs(os.path.dirname(paths["data"]), exist_ok=True)
+    # Escritura atómica: primero a un temporal y luego rename
+    tmp_data = f"{paths['data']}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_data, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_data, paths["data"])
+    tmp_meta = f"{paths['meta']}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as fh:
+        json.dump({"source": signature, "version": version, "sheet": str(sheet_name), "rows": len(df)}, fh)
+    os.replace(tmp_meta, paths["meta"])
+    return True
+
+
+def read_sidecar(path: str, sheet_name: SheetRef = 0) -> Optional[pd.DataFrame]:
+    """Lee el sidecar con memory-map si es válido; None en caso contrario."""
+    if pa is None or not is_sidecar_valid(path, sheet_name):
+        return None
+    paths = sidecar_paths(path, sheet_name)
+    try:
+        with pa.memory_map(paths["data"], "r") as source:
+            table = ipc.open_file(source).read_all()
+        return frame_from_table(table)
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def read_excel_columnar(path: str, sheet_name: SheetRef = 0) -> pd.DataFrame:
+    """
+    Lee una hoja de Excel desde su sidecar; si no existe o está desactualizado,
+    parsea el Excel y construye el sidecar en ese momento (build perezoso).
+    """
+    df = read_sidecar(path, sheet_name)
+    if df is not None:
+        return df
+    # La versión se toma antes de leer: si el archivo cambia mientras tanto, el sidecar queda inválido
+    version = sheet_version(path, sheet_name)
+    df = read_excel_auto(path, sheet_name)
+    try:
+        write_sidecar(path, df, sheet_name, version)
+    except OSError:
+        # Si no se puede escribir (p. ej. volumen de solo lectura) se sigue sin sidecar
+        pass
+    return df
+
+
+def ensure_sidecar(path: str, sheet_name: SheetRef = 0) -> Optional[str]:
+    """
+    Ruta del .arrow vigente de una hoja, construyéndolo si hace falta. None si no se
+    puede (sin pyarrow o con columnas que Arrow no representa).
+    """
+    if pa is None:
+        return None
+    if not is_sidecar_valid(path, sheet_name):
+        read_excel_columnar(path, sheet_name)
+        if not is_sidecar_valid(path, sheet_name):
+            return None
+    return sidecar_paths(path, sheet_name)["data"]
+
+
+def build_sidecars_for_file(path: str, force: bool = False) -> Dict[str, object]:
+    """
+    Construye los sidecars de las hojas que no tengan uno vigente; solo esas hojas se parsean,
+    de a una y con el mismo lector que la carga perezosa (por bloques en los libros grandes).
+    """
+    names = sheet_names(path)
+    # La primera hoja se registra con índice 0, que es lo que usan las herramientas por defecto
+    pending = [0 if position == 0 else sheet for position, sheet in enumerate(names)]
+    pending = [ref for ref in pending if force or not is_sidecar_valid(path, ref)]
+    built = []
+    for ref in pending:
+        version = sheet_version(path, ref)
+        if write_sidecar(path, read_excel_auto(path, ref), ref, version):
+            built.append(str(ref))
+    return {"archivo": os.path.basename(path), "hojas_construidas": built,
+            "hojas_reutilizadas": len(names) - len(pending)}
+
+
+def build_all_sidecars(data_dir: str = "data", workers: Optional[int] = None, force: bool = False):
+    """Pre-construye los sidecars de todo el directorio repartiendo los archivos entre procesos."""
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado; no se pueden construir sidecars.")
+    files = [os.path.join(data_dir, f) for f in sorted(os.listdir(data_dir))
+             if f.lower().endswith(EXCEL_EXTENSIONS) and os.path.isfile(os.path.join(data_dir, f))]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(build_sidecars_for_file, f, force): f for f in files}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"archivo": os.path.basename(futures[future]), "error": str(e)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-construye los sidecars Arrow de los archivos Excel.")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto, núcleos disponibles)")
+    parser.add_argument("--force", action="store_true", help="Reconstruir aunque el sidecar sea válido")
+    args = parser.parse_args(argv)
+    for result in build_all_sidecars(args.data_dir, args.workers, args.force):
+        if "error" in result:
+            print(f"[Error] {result['archivo']}: {result['error']}")
+        else:
+            print(f"{result['archivo']}: {', '.join(result['hojas_construidas']) or 'sin cambios'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Coalescencia de llamadas idénticas en curso ("single flight").
+
+Cuando varias sesiones piden lo mismo a la vez (parsear el mismo libro, hacer la misma
+pregunta sobre el mismo contenido), solo la primera llamada ejecuta el trabajo; las demás
+esperan y reciben el mismo resultado o la misma excepción. Al terminar, la clave se libera:
+esto no es una caché, solo evita trabajo duplicado mientras hay uno en vuelo.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Grupo de llamadas coalescidas por clave."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"llamadas": 0, "ejecuciones": 0, "coalescidas": 0, "errores": 0, "en_vuelo": 0}
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta `func` para `key`, o espera el resultado de la ejecución que ya está en curso."""
+        with self._lock:
+            self._stats["llamadas"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["ejecuciones"] += 1
+                self._stats["en_vuelo"] += 1
+            else:
+                call.waiters += 1
+                self._stats["coalescidas"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errores"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                self._stats["en_vuelo"] -= 1
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def single_flight(name: str) -> SingleFlight:
+    """Grupo compartido por nombre para todo el proceso."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """Contadores por grupo: llamadas, ejecuciones reales, llamadas coalescidas, errores y en vuelo."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,226 @@
+"""
+Consultas SQL de solo lectura sobre todos los libros de /data.
+
+Cada hoja es una tabla: `ventas_2025` es la primera hoja de `ventas_2025.xlsx` y
+`ventas_2025__resumen` la hoja "Resumen" (minúsculas, sin acentos, lo que no es letra o
+número pasa a `_`). Las tablas se registran de forma perezosa: solo las que aparecen en la
+consulta, y cada una desde su sidecar Arrow (ver utils/sidecar.py).
+
+Con DuckDB, el sidecar se escanea como dataset de Arrow: el motor pide solo las columnas que
+usa la consulta y empuja los filtros al escaneo, así que un join entre dos archivos no carga
+las demás columnas. Sin DuckDB se usa SQLite en memoria, cargando de cada tabla solo las
+columnas que se mencionan en la consulta.
+"""
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from utils.dataframe_cache import read_excel_cached
+from utils.file_manager import get_directory_index
+from utils.frame_optimizer import widen_frame
+from utils.metrics import span
+from utils.sheet_catalog import SheetRef, read_sheet_catalog
+from utils.sidecar import ensure_sidecar
+
+try:
+    import duckdb
+except ImportError:  # duckdb es opcional: sin él se usa SQLite
+    duckdb = None
+
+# Filas máximas que devuelve una consulta (el resto se descarta y se avisa)
+SQL_MAX_ROWS = int(os.getenv("EXCEL_SQL_MAX_ROWS", "10000"))
+# Hilos de DuckDB por consulta (0 = los que DuckDB elija)
+SQL_THREADS = int(os.getenv("EXCEL_SQL_THREADS", "0"))
+# Memoria máxima de DuckDB por consulta (p. ej. '2GB'; vacío = sin límite propio)
+SQL_MEMORY_LIMIT = os.getenv("EXCEL_SQL_MEMORY_LIMIT", "")
+
+_READ_ONLY_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_FROM_RE = re.compile(r"\b(?:from|join)\s+(?:\"([^\"]+)\"|`([^`]+)`|([\w]+))", re.IGNORECASE)
+_SELECT_STAR_RE = re.compile(r"(?:select|,)\s*(?:distinct\s+)?(?:(?:\"[^\"]*\"|`[^`]*`|\w+)\.)?\*", re.IGNORECASE)
+# Literales de texto (se descartan) e identificadores: "entre comillas", `backticks`, [corchetes] o sueltos
+_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"((?:[^\"]|\"\")*)\"|`([^`]*)`|\[([^\]]*)\]|([^\W\d]\w*)")
+
+_stats = {"consultas": 0, "errores": 0, "tablas_registradas": 0, "filas_devueltas": 0}
+_stats_lock = threading.Lock()
+
+
+class SQLError(ValueError):
+    """Consulta rechazada o fallida; el mensaje es apto para mostrar al usuario."""
+
+
+def _identifier(text: str, prefix: bool = True) -> str:
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9]+", "_", text.casefold()).strip("_")
+    if prefix and (not text or text[0].isdigit()):
+        text = f"t_{text}"
+    return text
+
+
+def table_name(file_name: str, sheet: Optional[str] = None) -> str:
+    """'Ventas 2025.xlsx' -> 'ventas_2025'; con hoja 'Resumen' -> 'ventas_2025__resumen'."""
+    base = _identifier(os.path.splitext(file_name)[0])
+    return base if sheet is None else f"{base}__{_identifier(sheet, prefix=False)}"
+
+
+def _file_tables(data_dir: str) -> Dict[str, str]:
+    # Si dos archivos dan el mismo nombre de tabla (ventas.xlsx y ventas.xls) gana el primero en orden
+    tables: Dict[str, str] = {}
+    for name in get_directory_index(data_dir).names():
+        tables.setdefault(table_name(name), name)
+    return tables
+
+
+def resolve_table(table: str, data_dir: str = "data") -> Optional[Tuple[str, SheetRef]]:
+    """(ruta, hoja) de una tabla, o None si no corresponde a ningún archivo de `data_dir`."""
+    table = table.casefold()
+    files = _file_tables(data_dir)
+    if table in files:
+        return os.path.join(data_dir, files[table]), 0
+    # Los identificadores nunca contienen '__', así que el corte es único
+    base, sep, sheet_id = table.partition("__")
+    if not sep or base not in files:
+        return None
+    path = os.path.join(data_dir, files[base])
+    for sheet in read_sheet_catalog(path):
+        if _identifier(sheet["nombre"], prefix=False) == sheet_id:
+            # La primera hoja comparte el sidecar y la caché que usan las herramientas por defecto
+            return path, 0 if sheet["indice"] == 0 else sheet["nombre"]
+    return None
+
+
+def list_tables(data_dir: str = "data", pattern: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """Tablas disponibles (archivo, hoja, filas y columnas según el catálogo) sin parsear ninguna hoja."""
+    tables = []
+    for name in get_directory_index(data_dir).names(pattern=pattern, limit=limit):
+        try:
+            catalog = read_sheet_catalog(os.path.join(data_dir, name))
+        except Exception:
+            continue
+        for sheet in catalog:
+            tables.append({
+                "tabla": table_name(name) if sheet["indice"] == 0 else table_name(name, sheet["nombre"]),
+                "archivo": name, "hoja": sheet["nombre"], "filas": sheet["filas"], "columnas": sheet["columnas"],
+            })
+    return tables
+
+
+def _check_read_only(sql: str) -> str:
+    sql = sql.strip().rstrip(";").strip()
+    if not _READ_ONLY_RE.match(sql):
+        raise SQLError("Solo se permiten consultas de lectura (SELECT o WITH ... SELECT).")
+    if ";" in sql:
+        raise SQLError("Envía una sola consulta a la vez (sin ';' intermedios).")
+    return sql
+
+
+def _bump(field: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[field] += amount
+
+
+def _run_duckdb(sql: str, data_dir: str, max_rows: int) -> pd.DataFrame:
+    import pyarrow.dataset as ds
+
+    config: Dict[str, Any] = {"enable_external_access": False}
+    if SQL_THREADS:
+        config["threads"] = SQL_THREADS
+    if SQL_MEMORY_LIMIT:
+        config["memory_limit"] = SQL_MEMORY_LIMIT
+    # Sin acceso externo, read_csv/COPY/ATTACH quedan bloqueados: solo se leen las tablas registradas
+    with closing(duckdb.connect(config=config)) as conn:
+        try:
+            referenced, exact = conn.get_table_names(sql), True
+        except duckdb.ParserException as e:
+            raise SQLError(f"La consulta SQL no es válida: {e}")
+        except duckdb.Error:
+            # Algunas formas (p. ej. JOIN ... USING) necesitan las tablas para analizarse: se buscan en el texto
+            referenced, exact = _referenced_names(sql), False
+        for name in referenced:
+            source = resolve_table(name, data_dir)
+            if source is None:
+                if not exact:
+                    continue
+                raise SQLError(f"La tabla '{name}' no existe. Usa `tablas_sql` para ver las disponibles.")
+            data = ensure_sidecar(*source)
+            # Sin sidecar (sin pyarrow o tipos mezclados) se registra el DataFrame cacheado
+            conn.register(name, ds.dataset(data, format="arrow") if data else widen_frame(read_excel_cached(*source)))
+            _bump("tablas_registradas")
+        try:
+            return conn.execute(f"SELECT * FROM ({sql}) AS consulta LIMIT {max_rows + 1}").fetch_df()
+        except duckdb.Error as e:
+            raise SQLError(f"La consulta SQL falló: {e}")
+
+
+def _sql_identifiers(sql: str) -> Set[str]:
+    identifiers = set()
+    for match in _TOKEN_RE.finditer(sql):
+        quoted, backtick, bracket, bare = match.groups()
+        if quoted is not None:
+            identifiers.add(quoted.replace('""', '"').casefold())
+        elif backtick is not None or bracket is not None:
+            identifiers.add((backtick if backtick is not None else bracket).casefold())
+        elif bare is not None:
+            identifiers.add(bare.casefold())
+    return identifiers
+
+
+def _projected(df: pd.DataFrame, sql: str) -> pd.DataFrame:
+    # Sin `SELECT *` ni `t.*`, solo se copian a SQLite las columnas nombradas como identificador en la
+    # consulta (comparando identificadores completos: `id` no arrastra a `paid`)
+    if not _SELECT_STAR_RE.search(sql):
+        identifiers = _sql_identifiers(sql)
+        columns = [c for c in df.columns if str(c).casefold() in identifiers]
+        if columns:
+            df = df[columns]
+    return widen_frame(df)
+
+
+def _referenced_names(sql: str) -> Set[str]:
+    return {next(g for g in match.groups() if g) for match in _FROM_RE.finditer(sql)}
+
+
+def _run_sqlite(sql: str, data_dir: str, max_rows: int) -> pd.DataFrame:
+    with closing(sqlite3.connect(":memory:")) as conn:
+        for name in _referenced_names(sql):
+            # Los nombres de CTE y subconsultas no son archivos: se dejan a SQLite
+            source = resolve_table(name, data_dir)
+            if source is None:
+                continue
+            _projected(read_excel_cached(*source), sql).to_sql(name, conn, index=False)
+            _bump("tablas_registradas")
+        try:
+            return pd.read_sql_query(f"SELECT * FROM ({sql}) LIMIT {max_rows + 1}", conn)
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            raise SQLError(f"La consulta SQL falló: {e}")
+
+
+def run_sql(sql: str, data_dir: str = "data", max_rows: int = SQL_MAX_ROWS) -> Tuple[pd.DataFrame, bool]:
+    """Ejecuta una consulta de solo lectura. Devuelve (resultado, truncado a `max_rows`)."""
+    _bump("consultas")
+    try:
+        sql = _check_read_only(sql)
+        engine = "duckdb" if duckdb is not None else "sqlite"
+        with span("sql.consulta", motor=engine):
+            if duckdb is not None:
+                df = _run_duckdb(sql, data_dir, max_rows)
+            else:
+                df = _run_sqlite(sql, data_dir, max_rows)
+    except Exception:
+        _bump("errores")
+        raise
+    truncated = len(df) > max_rows
+    df = df.iloc[:max_rows]
+    _bump("filas_devueltas", len(df))
+    return df, truncated
+
+
+def sql_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)